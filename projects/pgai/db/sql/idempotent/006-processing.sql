@@ -4,6 +4,10 @@
 create or replace function ai.processing_default
 ( batch_size pg_catalog.int4 default null
 , concurrency pg_catalog.int4 default null
+, lease_seconds pg_catalog.int4 default null
+, reuse_embeddings pg_catalog.bool default null
+, target_batch_seconds pg_catalog.int4 default null
+, statement_trigger pg_catalog.bool default null
 ) returns pg_catalog.jsonb
 as $func$
     select json_strip_nulls(json_build_object
@@ -11,6 +15,10 @@ as $func$
     , 'config_type', 'processing'
     , 'batch_size', batch_size
     , 'concurrency', concurrency
+    , 'lease_seconds', lease_seconds
+    , 'reuse_embeddings', reuse_embeddings
+    , 'target_batch_seconds', target_batch_seconds
+    , 'statement_trigger', statement_trigger
     ))
 $func$ language sql immutable security invoker
 set search_path to pg_catalog, pg_temp
@@ -61,6 +69,40 @@ begin
                     raise exception 'concurrency must be greater than 0';
                 end if;
             end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'lease_seconds');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'number' then
+                    raise exception 'lease_seconds must be a number';
+                end if;
+                if cast(_val as pg_catalog.int4) operator(pg_catalog.<) 1 then
+                    raise exception 'lease_seconds must be greater than 0';
+                end if;
+            end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'reuse_embeddings');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'boolean' then
+                    raise exception 'reuse_embeddings must be a boolean';
+                end if;
+            end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'target_batch_seconds');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'number' then
+                    raise exception 'target_batch_seconds must be a number';
+                end if;
+                if cast(_val as pg_catalog.int4) operator(pg_catalog.<) 1 then
+                    raise exception 'target_batch_seconds must be greater than 0';
+                end if;
+            end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'statement_trigger');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'boolean' then
+                    raise exception 'statement_trigger must be a boolean';
+                end if;
+            end if;
         else
             if _implementation is null then
                 raise exception 'processing implementation not specified';
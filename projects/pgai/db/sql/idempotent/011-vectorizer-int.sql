@@ -426,6 +426,8 @@ begin
       , queued_at pg_catalog.timestamptz not null default now()
       , loading_retries pg_catalog.int4 not null default 0
       , loading_retry_after pg_catalog.timestamptz
+      , lease_id pg_catalog.uuid
+      , lease_expires_at pg_catalog.timestamptz
       )
       $sql$
     , queue_schema, queue_table
@@ -588,6 +590,7 @@ declare
     _func_def pg_catalog.text;
     _relevant_columns_check pg_catalog.text;
     _truncate_statement pg_catalog.text;
+    _notify_statement pg_catalog.text;
 begin
     -- Pre-calculate all the parts we need
     select pg_catalog.string_agg(pg_catalog.format('%I', x.attname), ', ' order by x.attnum)
@@ -616,6 +619,11 @@ begin
                                 target_schema, target_table, queue_schema, queue_table);
     end if;
 
+    -- Wake up the workers listening for new work. Postgres delivers identical
+    -- notifications of a transaction only once, so a bulk write sends one.
+    _notify_statement := pg_catalog.format('perform pg_catalog.pg_notify(%L, %L)',
+        'ai_vectorizer_queue', pg_catalog.concat(queue_schema, '.', queue_table));
+
     _relevant_columns_check := 
         pg_catalog.format('EXISTS (
             SELECT 1 FROM pg_catalog.jsonb_each(to_jsonb(old)) AS o(key, value)
@@ -642,16 +650,19 @@ begin
                         $DELETE_STATEMENT$;
                         insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                             values ($PK_VALUES$);
+                        $NOTIFY_STATEMENT$;
                     -- check if a relevant column has changed and queue the update
                     elsif $RELEVANT_COLUMNS_CHECK$ then
                         insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                         values ($PK_VALUES$);
+                        $NOTIFY_STATEMENT$;
                     end if;
 
                     return new;
                 else
                     insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                     values ($PK_VALUES$);
+                    $NOTIFY_STATEMENT$;
                     return new;
                 end if;
 
@@ -677,6 +688,7 @@ begin
         _func_def := replace(_func_def, '$TARGET_TABLE$', quote_ident(target_table));
         _func_def := replace(_func_def, '$RELEVANT_COLUMNS_CHECK$', _relevant_columns_check);
         _func_def := replace(_func_def, '$TRUNCATE_STATEMENT$', _truncate_statement);
+        _func_def := replace(_func_def, '$NOTIFY_STATEMENT$', _notify_statement);
     
     else
         _func_def := $def$
@@ -686,10 +698,12 @@ begin
                     if $RELEVANT_COLUMNS_CHECK$ then
                         insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                         values ($PK_VALUES$);
+                        $NOTIFY_STATEMENT$;
                     end if;
                 elseif (TG_OP = 'INSERT') then
                     insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                     values ($PK_VALUES$);
+                    $NOTIFY_STATEMENT$;
                 end if;
             end if;
             return null;
@@ -700,12 +714,201 @@ begin
         _func_def := replace(_func_def, '$QUEUE_TABLE$', quote_ident(queue_table));
         _func_def := replace(_func_def, '$PK_COLUMNS$', _pk_columns);
         _func_def := replace(_func_def, '$PK_VALUES$', _pk_values);
+        _func_def := replace(_func_def, '$NOTIFY_STATEMENT$', _notify_statement);
     end if;
     return _func_def;
 end;
 $func$ language plpgsql immutable security invoker
 set search_path to pg_catalog, pg_temp;
 
+-------------------------------------------------------------------------------
+-- _vectorizer_build_statement_trigger_definition
+create or replace function ai._vectorizer_build_statement_trigger_definition
+( queue_schema pg_catalog.name
+, queue_table pg_catalog.name
+, target_schema pg_catalog.name
+, target_table pg_catalog.name
+, source_schema pg_catalog.name
+, source_table pg_catalog.name
+, source_pk pg_catalog.jsonb
+) returns pg_catalog.text as
+$func$
+declare
+    _source_schema pg_catalog.name = source_schema;
+    _source_table pg_catalog.name = source_table;
+    _pk_attnames pg_catalog.name[];
+    _pk_columns pg_catalog.text;
+    _new_pk_values pg_catalog.text;
+    _pk_join pg_catalog.text;
+    _target_pk_join pg_catalog.text;
+    _old_row_missing pg_catalog.text;
+    _relevant_columns_check pg_catalog.text;
+    _embedding_columns_lookup pg_catalog.text;
+    _truncate_statement pg_catalog.text;
+    _notify_statement pg_catalog.text;
+    _func_def pg_catalog.text;
+begin
+    -- Pre-calculate all the parts we need
+    select
+      pg_catalog.string_agg(pg_catalog.format('%I', x.attname), ', ' order by x.attnum)
+    , pg_catalog.string_agg(pg_catalog.format('n.%I', x.attname), ', ' order by x.attnum)
+    , pg_catalog.string_agg(pg_catalog.format('o.%I = n.%I', x.attname, x.attname), ' and ' order by x.attnum)
+    , pg_catalog.string_agg(pg_catalog.format('t.%I = o.%I', x.attname, x.attname), ' and ' order by x.attnum)
+    into strict
+      _pk_columns
+    , _new_pk_values
+    , _pk_join
+    , _target_pk_join
+    from pg_catalog.jsonb_to_recordset(source_pk) x(attnum int, attname name);
+
+    -- the primary key columns are not null, so a missing old row has a null key
+    select pg_catalog.format('o.%I is null', x.attname)
+    into strict _old_row_missing
+    from pg_catalog.jsonb_to_recordset(source_pk) x(attnum int, attname name)
+    order by x.attnum
+    limit 1;
+
+    -- The primary key is compared by the join
+    select pg_catalog.array_agg(x.attname)
+    into strict _pk_attnames
+    from pg_catalog.jsonb_to_recordset(source_pk) x(attnum int, attname name);
+
+    -- Compile the check of the relevant columns to one comparison per column.
+    -- Types without an equality operator in pg_catalog, such as json, are
+    -- compared as jsonb, like the row-level trigger compares all columns. The
+    -- embedding columns of the vectorizers of the source table are written by
+    -- the worker, and don't queue the row again. As vectorizers come and go,
+    -- they are looked up when the trigger runs.
+    select pg_catalog.string_agg
+    ( pg_catalog.format
+      ( '(%L operator(pg_catalog.!=) all(_embedding_columns) and %s)'
+      , a.attname
+      , case
+          when exists
+          ( select 1
+            from pg_catalog.pg_operator r
+            where r.oprname operator(pg_catalog.=) '='
+            and r.oprleft operator(pg_catalog.=) a.atttypid
+            and r.oprright operator(pg_catalog.=) a.atttypid
+            and r.oprnamespace operator(pg_catalog.=) 'pg_catalog'::pg_catalog.regnamespace
+          )
+          then pg_catalog.format('o.%I is distinct from n.%I', a.attname, a.attname)
+          else pg_catalog.format('pg_catalog.to_jsonb(o.%I) is distinct from pg_catalog.to_jsonb(n.%I)', a.attname, a.attname)
+        end
+      )
+    , ' or ' order by a.attnum
+    )
+    into _relevant_columns_check
+    from pg_catalog.pg_attribute a
+    where a.attrelid operator(pg_catalog.=) pg_catalog.format('%I.%I', _source_schema, _source_table)::pg_catalog.regclass::pg_catalog.oid
+    and a.attnum operator(pg_catalog.>) 0
+    and not a.attisdropped
+    and a.attname operator(pg_catalog.!=) all(_pk_attnames)
+    ;
+    _relevant_columns_check := pg_catalog.coalesce(_relevant_columns_check, 'false');
+
+    _embedding_columns_lookup := $sql$select pg_catalog.coalesce(pg_catalog.array_agg((v.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'embedding_column')::pg_catalog.name), '{}')
+                into _embedding_columns
+                from ai.vectorizer v
+                where v.source_schema operator(pg_catalog.=) TG_TABLE_SCHEMA
+                and v.source_table operator(pg_catalog.=) TG_TABLE_NAME
+                and v.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'implementation' operator(pg_catalog.=) 'column'$sql$;
+
+    -- Wake up the workers listening for new work, once per statement
+    _notify_statement := pg_catalog.format('perform pg_catalog.pg_notify(%L, %L)',
+        'ai_vectorizer_queue', pg_catalog.concat(queue_schema, '.', queue_table));
+
+    if target_schema is not null and target_table is not null then
+        _truncate_statement := format('truncate table %I.%I; truncate table %I.%I',
+                                target_schema, target_table, queue_schema, queue_table);
+
+        _func_def := $def$
+        declare
+            _embedding_columns pg_catalog.name[];
+        begin
+            if (TG_OP = 'INSERT') then
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $PK_COLUMNS$ from new_rows;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            elsif (TG_OP = 'UPDATE') then
+                -- delete the embeddings of primary keys that changed
+                delete from $TARGET_SCHEMA$.$TARGET_TABLE$ t
+                using
+                ( select $PK_COLUMNS$ from old_rows
+                  except
+                  select $PK_COLUMNS$ from new_rows
+                ) o
+                where $TARGET_PK_JOIN$;
+                -- queue the rows whose primary key or a relevant column changed
+                $EMBEDDING_COLUMNS_LOOKUP$;
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $NEW_PK_VALUES$
+                from new_rows n
+                left join old_rows o on ($PK_JOIN$)
+                where $OLD_ROW_MISSING$
+                or $RELEVANT_COLUMNS_CHECK$;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            elsif (TG_OP = 'DELETE') then
+                delete from $TARGET_SCHEMA$.$TARGET_TABLE$ t
+                using old_rows o
+                where $TARGET_PK_JOIN$;
+            elsif (TG_OP = 'TRUNCATE') then
+                $TRUNCATE_STATEMENT$;
+            end if;
+            return null;
+        end;
+        $def$;
+        _func_def := replace(_func_def, '$TARGET_SCHEMA$', quote_ident(target_schema));
+        _func_def := replace(_func_def, '$TARGET_TABLE$', quote_ident(target_table));
+        _func_def := replace(_func_def, '$TARGET_PK_JOIN$', _target_pk_join);
+        _func_def := replace(_func_def, '$TRUNCATE_STATEMENT$', _truncate_statement);
+    else
+        _func_def := $def$
+        declare
+            _embedding_columns pg_catalog.name[];
+        begin
+            if (TG_OP = 'INSERT') then
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $PK_COLUMNS$ from new_rows;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            elsif (TG_OP = 'UPDATE') then
+                $EMBEDDING_COLUMNS_LOOKUP$;
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $NEW_PK_VALUES$
+                from new_rows n
+                left join old_rows o on ($PK_JOIN$)
+                where $OLD_ROW_MISSING$
+                or $RELEVANT_COLUMNS_CHECK$;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            end if;
+            return null;
+        end;
+        $def$;
+    end if;
+
+    -- Replace placeholders
+    _func_def := replace(_func_def, '$QUEUE_SCHEMA$', quote_ident(queue_schema));
+    _func_def := replace(_func_def, '$QUEUE_TABLE$', quote_ident(queue_table));
+    _func_def := replace(_func_def, '$PK_COLUMNS$', _pk_columns);
+    _func_def := replace(_func_def, '$NEW_PK_VALUES$', _new_pk_values);
+    _func_def := replace(_func_def, '$PK_JOIN$', _pk_join);
+    _func_def := replace(_func_def, '$OLD_ROW_MISSING$', _old_row_missing);
+    _func_def := replace(_func_def, '$RELEVANT_COLUMNS_CHECK$', _relevant_columns_check);
+    _func_def := replace(_func_def, '$EMBEDDING_COLUMNS_LOOKUP$', _embedding_columns_lookup);
+    _func_def := replace(_func_def, '$NOTIFY_STATEMENT$', _notify_statement);
+    return _func_def;
+end;
+$func$ language plpgsql stable security invoker
+set search_path to pg_catalog, pg_temp;
+
 -------------------------------------------------------------------------------
 -- _vectorizer_create_source_trigger
 create or replace function ai._vectorizer_create_source_trigger
@@ -717,6 +920,7 @@ create or replace function ai._vectorizer_create_source_trigger
 , target_schema pg_catalog.name    -- Schema containing the target table for deletions
 , target_table pg_catalog.name     -- Table where corresponding rows should be deleted
 , source_pk pg_catalog.jsonb       -- JSON describing primary key columns to track
+, statement_trigger pg_catalog.bool default false -- Queue the rows of a statement at once
 ) returns void as
 $func$
 declare
@@ -733,13 +937,24 @@ begin
     $sql$
     , queue_schema
     , trigger_name
-    , ai._vectorizer_build_trigger_definition(queue_schema,
-                                              queue_table,
-                                              target_schema,
-                                              target_table,
-                                              source_schema,
-                                              source_table,
-                                              source_pk)
+    , case
+        when statement_trigger then
+            ai._vectorizer_build_statement_trigger_definition(queue_schema,
+                                                              queue_table,
+                                                              target_schema,
+                                                              target_table,
+                                                              source_schema,
+                                                              source_table,
+                                                              source_pk)
+        else
+            ai._vectorizer_build_trigger_definition(queue_schema,
+                                                    queue_table,
+                                                    target_schema,
+                                                    target_table,
+                                                    source_schema,
+                                                    source_table,
+                                                    source_pk)
+      end
     );
 
     -- Revoke public permissions
@@ -749,20 +964,71 @@ begin
     );
     execute _sql;
 
-    -- Create the row-level trigger
-    select pg_catalog.format(
-        $sql$
-        create trigger %I
-        after insert or update or delete
-        on %I.%I
-        for each row execute function %I.%I()
-        $sql$,
-        trigger_name,
-        source_schema, source_table,
-        queue_schema, trigger_name
-    ) into strict _sql
-    ;
-    execute _sql;
+    if statement_trigger then
+        -- Create the statement-level triggers. A trigger with transition tables
+        -- can only fire on one event, so there is one trigger per event.
+        select pg_catalog.format(
+            $sql$
+            create trigger %I
+            after update
+            on %I.%I
+            referencing old table as old_rows new table as new_rows
+            for each statement execute function %I.%I()
+            $sql$,
+            trigger_name,
+            source_schema, source_table,
+            queue_schema, trigger_name
+        ) into strict _sql
+        ;
+        execute _sql;
+
+        select pg_catalog.format(
+            $sql$
+            create trigger %I_insert
+            after insert
+            on %I.%I
+            referencing new table as new_rows
+            for each statement execute function %I.%I()
+            $sql$,
+            trigger_name,
+            source_schema, source_table,
+            queue_schema, trigger_name
+        ) into strict _sql
+        ;
+        execute _sql;
+
+        if target_schema is not null and target_table is not null then
+            select pg_catalog.format(
+                $sql$
+                create trigger %I_delete
+                after delete
+                on %I.%I
+                referencing old table as old_rows
+                for each statement execute function %I.%I()
+                $sql$,
+                trigger_name,
+                source_schema, source_table,
+                queue_schema, trigger_name
+            ) into strict _sql
+            ;
+            execute _sql;
+        end if;
+    else
+        -- Create the row-level trigger
+        select pg_catalog.format(
+            $sql$
+            create trigger %I
+            after insert or update or delete
+            on %I.%I
+            for each row execute function %I.%I()
+            $sql$,
+            trigger_name,
+            source_schema, source_table,
+            queue_schema, trigger_name
+        ) into strict _sql
+        ;
+        execute _sql;
+    end if;
     
     -- Create the statement-level trigger for TRUNCATE
     -- Note: Using the same trigger function but with a different event and level
@@ -793,6 +1059,7 @@ declare
     _target_schema pg_catalog.name;
     _target_table pg_catalog.name;
     _destination_type pg_catalog.text;
+    _trigger_def pg_catalog.text;
 begin
     -- Find all vectorizers
     for _vec in (
@@ -819,6 +1086,24 @@ begin
             _target_table := null;
         end if;
 
+        if coalesce((_vec.config->'processing'->>'statement_trigger')::bool, false) then
+            _trigger_def := ai._vectorizer_build_statement_trigger_definition(_vec.queue_schema,
+                                                                              _vec.queue_table,
+                                                                              _target_schema,
+                                                                              _target_table,
+                                                                              _vec.source_schema,
+                                                                              _vec.source_table,
+                                                                              _vec.source_pk);
+        else
+            _trigger_def := ai._vectorizer_build_trigger_definition(_vec.queue_schema,
+                                                                    _vec.queue_table,
+                                                                    _target_schema,
+                                                                    _target_table,
+                                                                    _vec.source_schema,
+                                                                    _vec.source_table,
+                                                                    _vec.source_pk);
+        end if;
+
         execute format
         (
         --weird indent is intentional to make the sql functions look the same as during a fresh install
@@ -831,13 +1116,7 @@ begin
     set search_path to pg_catalog, pg_temp
     $sql$
             , _vec.queue_schema, _vec.trigger_name,
-            ai._vectorizer_build_trigger_definition(_vec.queue_schema,
-                                                    _vec.queue_table,
-                                                    _target_schema,
-                                                    _target_table,
-                                                    _vec.source_schema,
-                                                    _vec.source_table,
-                                                    _vec.source_pk)
+            _trigger_def
         );
     end loop;
 end;
@@ -1266,4 +1545,37 @@ end
 $func$
 language plpgsql volatile security invoker
 set search_path to pg_catalog, pg_temp
-;
\ No newline at end of file
+;
+-------------------------------------------------------------------------------
+-- _vectorizer_notify_change
+create or replace function ai._vectorizer_notify_change() returns trigger
+as $func$
+begin
+    -- wake up the workers listening for changes of this vectorizer, so they
+    -- pick up the new configuration or stop working on a disabled vectorizer
+    if TG_OP operator(pg_catalog.=) 'DELETE' then
+        perform pg_catalog.pg_notify('ai_vectorizer_config', old.id::pg_catalog.text);
+    else
+        perform pg_catalog.pg_notify('ai_vectorizer_config', new.id::pg_catalog.text);
+    end if;
+    return null;
+end
+$func$
+language plpgsql volatile security invoker
+set search_path to pg_catalog, pg_temp
+;
+
+do $block$
+begin
+    perform
+    from pg_catalog.pg_trigger g
+    where g.tgrelid operator(pg_catalog.=) 'ai.vectorizer'::pg_catalog.regclass
+    and g.tgname operator(pg_catalog.=) '_vectorizer_notify_change'
+    ;
+    if not found then
+        create trigger _vectorizer_notify_change
+        after insert or update or delete on ai.vectorizer
+        for each row execute function ai._vectorizer_notify_change();
+    end if;
+end
+$block$;
@@ -231,6 +231,7 @@ begin
     , destination operator(pg_catalog.->>) 'target_schema'
     , destination operator(pg_catalog.->>) 'target_table'
     , _source_pk
+    , pg_catalog.coalesce((processing operator(pg_catalog.->>) 'statement_trigger')::pg_catalog.bool, false)
     );
 
 
@@ -414,6 +415,78 @@ $func$ language sql volatile security invoker
 set search_path to pg_catalog, pg_temp
 ;
 
+-------------------------------------------------------------------------------
+-- recompile_vectorizer_trigger
+-- The statement-level trigger compares the columns the source table had when
+-- the trigger was created. After columns are added to or dropped from the
+-- source table, its trigger function has to be recompiled. Until then, added
+-- columns don't queue rows, and updates fail if a column was dropped.
+create or replace function ai.recompile_vectorizer_trigger(vectorizer_id pg_catalog.int4) returns void
+as $func$
+declare
+    _vec ai.vectorizer%rowtype;
+    _target_schema pg_catalog.name;
+    _target_table pg_catalog.name;
+    _trigger_def pg_catalog.text;
+begin
+    select * into strict _vec
+    from ai.vectorizer v
+    where v.id operator(pg_catalog.=) vectorizer_id
+    ;
+
+    if _vec.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'implementation' operator(pg_catalog.=) 'table' then
+        _target_schema := _vec.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'target_schema';
+        _target_table := _vec.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'target_table';
+    end if;
+
+    if pg_catalog.coalesce((_vec.config operator(pg_catalog.->) 'processing' operator(pg_catalog.->>) 'statement_trigger')::pg_catalog.bool, false) then
+        _trigger_def := ai._vectorizer_build_statement_trigger_definition
+        ( _vec.queue_schema
+        , _vec.queue_table
+        , _target_schema
+        , _target_table
+        , _vec.source_schema
+        , _vec.source_table
+        , _vec.source_pk
+        );
+    else
+        _trigger_def := ai._vectorizer_build_trigger_definition
+        ( _vec.queue_schema
+        , _vec.queue_table
+        , _target_schema
+        , _target_table
+        , _vec.source_schema
+        , _vec.source_table
+        , _vec.source_pk
+        );
+    end if;
+
+    execute pg_catalog.format
+    ( $sql$
+    create or replace function %I.%I() returns trigger 
+    as $trigger_def$ 
+    %s
+    $trigger_def$ language plpgsql volatile parallel safe security definer 
+    set search_path to pg_catalog, pg_temp
+    $sql$
+    , _vec.queue_schema
+    , _vec.trigger_name
+    , _trigger_def
+    );
+end;
+$func$ language plpgsql volatile security invoker
+set search_path to pg_catalog, pg_temp
+;
+
+create or replace function ai.recompile_vectorizer_trigger(name pg_catalog.text) returns void
+as $func$
+   select ai.recompile_vectorizer_trigger(v.id)
+   from ai.vectorizer v
+   where v.name operator(pg_catalog.=) recompile_vectorizer_trigger.name;
+$func$ language sql volatile security invoker
+set search_path to pg_catalog, pg_temp
+;
+
 -------------------------------------------------------------------------------
 -- drop_vectorizer
 create or replace function ai.drop_vectorizer
@@ -491,13 +564,18 @@ begin
         ;
         execute _sql;
 
-        select pg_catalog.format
-        ( $sql$drop trigger if exists %I on %I.%I$sql$
-        , format('%s_truncate', _trigger.tgname)
-        , _vec.source_schema
-        , _vec.source_table
-        ) into _sql;
-        execute _sql;
+        -- the triggers of the other events, if any
+        for _sql in
+            select pg_catalog.format
+            ( $sql$drop trigger if exists %I on %I.%I$sql$
+            , format('%s_%s', _trigger.tgname, e)
+            , _vec.source_schema
+            , _vec.source_table
+            )
+            from pg_catalog.unnest(array['truncate', 'insert', 'delete']) e
+        loop
+            execute _sql;
+        end loop;
 
         -- drop the function/procedure backing the trigger
         select pg_catalog.format
@@ -45,4 +45,72 @@ BEGIN
     WHERE vectorizer_id = worker_vectorizer_id;
 END;
 $$ LANGUAGE plpgsql security invoker
-set search_path to pg_catalog, pg_temp;
\ No newline at end of file
+set search_path to pg_catalog, pg_temp;
+
+CREATE OR REPLACE FUNCTION ai._worker_shard(worker_id uuid, OUT shard int, OUT shard_count int) AS $$
+BEGIN
+    --the workers that sent a heartbeat within two intervals are alive, and split
+    --the queues between themselves in the order they started
+    WITH alive AS (
+        SELECT p.id, row_number() OVER (ORDER BY p.started, p.id) - 1 AS shard
+        FROM ai.vectorizer_worker_process p
+        WHERE p.id = worker_id
+        OR p.last_heartbeat >= clock_timestamp() - p.expected_heartbeat_interval * 2
+    )
+    SELECT a.shard, (SELECT count(*) FROM alive)
+    INTO shard, shard_count
+    FROM alive a
+    WHERE a.id = worker_id;
+END;
+$$ LANGUAGE plpgsql security invoker
+set search_path to pg_catalog, pg_temp;
+
+CREATE OR REPLACE FUNCTION ai._reserve_embedding_capacity(embedding_provider text, embedding_model text, key_name text, num_requests int, num_tokens float8) RETURNS float8 AS $$
+DECLARE
+    rate_limit ai.embedding_rate_limit;
+    reserved_at timestamptz = clock_timestamp();
+    elapsed float8;
+    wait float8 = 0;
+BEGIN
+    --the limits are token buckets that refill at the rate per minute, up to a
+    --minute's worth. a reservation is taken right away, even beyond what is
+    --left, and the caller waits until the buckets would have refilled
+    SELECT * INTO rate_limit
+    FROM ai.embedding_rate_limit r
+    WHERE r.provider = embedding_provider
+    AND r.model = embedding_model
+    AND r.api_key_name = coalesce(key_name, '')
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    elapsed = greatest(0, extract(epoch FROM reserved_at - coalesce(rate_limit.refilled_at, reserved_at)));
+    IF rate_limit.requests_per_minute IS NOT NULL THEN
+        rate_limit.requests_available = least(
+            rate_limit.requests_per_minute,
+            coalesce(rate_limit.requests_available, rate_limit.requests_per_minute)
+                + elapsed * rate_limit.requests_per_minute / 60
+        ) - num_requests;
+        wait = greatest(wait, -rate_limit.requests_available * 60 / rate_limit.requests_per_minute);
+    END IF;
+    IF rate_limit.tokens_per_minute IS NOT NULL THEN
+        rate_limit.tokens_available = least(
+            rate_limit.tokens_per_minute,
+            coalesce(rate_limit.tokens_available, rate_limit.tokens_per_minute)
+                + elapsed * rate_limit.tokens_per_minute / 60
+        ) - num_tokens;
+        wait = greatest(wait, -rate_limit.tokens_available * 60 / rate_limit.tokens_per_minute);
+    END IF;
+
+    UPDATE ai.embedding_rate_limit r SET
+          requests_available = rate_limit.requests_available
+        , tokens_available = rate_limit.tokens_available
+        , refilled_at = reserved_at
+    WHERE r.provider = rate_limit.provider
+    AND r.model = rate_limit.model
+    AND r.api_key_name = rate_limit.api_key_name;
+    RETURN wait;
+END;
+$$ LANGUAGE plpgsql security invoker
+set search_path to pg_catalog, pg_temp;
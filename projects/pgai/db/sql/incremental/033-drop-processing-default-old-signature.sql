@@ -0,0 +1 @@
+drop function if exists ai.processing_default(pg_catalog.int4,pg_catalog.int4);
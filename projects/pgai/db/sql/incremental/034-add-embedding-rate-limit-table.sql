@@ -0,0 +1,13 @@
+-- rate limits of embedding providers, shared by all vectorizer workers
+create table ai.embedding_rate_limit(
+      provider text not null
+    , model text not null
+    , api_key_name text not null default ''
+    , requests_per_minute int null check (requests_per_minute > 0)
+    , tokens_per_minute int null check (tokens_per_minute > 0)
+    -- the capacity left as of refilled_at, negative when reserved ahead
+    , requests_available float8 null
+    , tokens_available float8 null
+    , refilled_at timestamptz null
+    , primary key (provider, model, api_key_name)
+);
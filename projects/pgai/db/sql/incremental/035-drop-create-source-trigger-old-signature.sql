@@ -0,0 +1 @@
+drop function if exists ai._vectorizer_create_source_trigger(name,name,name,name,name,name,name,jsonb);
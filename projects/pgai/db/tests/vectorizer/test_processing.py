@@ -47,6 +47,39 @@ def test_processing_default():
                 "concurrency": 3,
             },
         ),
+        (
+            "select ai.processing_default(lease_seconds=>600)",
+            {
+                "implementation": "default",
+                "config_type": "processing",
+                "lease_seconds": 600,
+            },
+        ),
+        (
+            "select ai.processing_default(reuse_embeddings=>true)",
+            {
+                "implementation": "default",
+                "config_type": "processing",
+                "reuse_embeddings": True,
+            },
+        ),
+        (
+            "select ai.processing_default(batch_size=>500, target_batch_seconds=>30)",
+            {
+                "implementation": "default",
+                "config_type": "processing",
+                "batch_size": 500,
+                "target_batch_seconds": 30,
+            },
+        ),
+        (
+            "select ai.processing_default(statement_trigger=>true)",
+            {
+                "implementation": "default",
+                "config_type": "processing",
+                "statement_trigger": True,
+            },
+        ),
     ]
     with psycopg.connect(db_url("test")) as con:
         with con.cursor() as cur:
@@ -65,6 +98,10 @@ def test_validate_processing():
         "select ai._validate_processing(ai.processing_default(batch_size=>2048))",
         "select ai._validate_processing(ai.processing_default(batch_size=>2048, concurrency=>1))",
         "select ai._validate_processing(ai.processing_default(concurrency=>10))",
+        "select ai._validate_processing(ai.processing_default(lease_seconds=>600))",
+        "select ai._validate_processing(ai.processing_default(reuse_embeddings=>false))",
+        "select ai._validate_processing(ai.processing_default(target_batch_seconds=>30))",
+        "select ai._validate_processing(ai.processing_default(statement_trigger=>true))",
     ]
     bad = [
         (
@@ -115,6 +152,38 @@ def test_validate_processing():
             """,
             "concurrency must be less than or equal to 50",
         ),
+        (
+            """
+            select ai._validate_processing
+            ( ai.processing_default(lease_seconds=>0)
+            )
+            """,
+            "lease_seconds must be greater than 0",
+        ),
+        (
+            """
+            select ai._validate_processing
+            ( '{"config_type": "processing", "implementation": "default", "reuse_embeddings": 1}'::jsonb
+            )
+            """,
+            "reuse_embeddings must be a boolean",
+        ),
+        (
+            """
+            select ai._validate_processing
+            ( ai.processing_default(target_batch_seconds=>0)
+            )
+            """,
+            "target_batch_seconds must be greater than 0",
+        ),
+        (
+            """
+            select ai._validate_processing
+            ( '{"config_type": "processing", "implementation": "default", "statement_trigger": "yes"}'::jsonb
+            )
+            """,
+            "statement_trigger must be a boolean",
+        ),
     ]
     with psycopg.connect(db_url("test"), autocommit=True) as con:
         with con.cursor() as cur:
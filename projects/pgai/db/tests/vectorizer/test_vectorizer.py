@@ -1763,6 +1763,192 @@ def test_queue_pending():
             assert cur.fetchone()[0] == 9223372036854775807
 
 
+def test_queue_notifications():
+    with (
+        psycopg.connect(
+            db_url("test"), autocommit=True, row_factory=namedtuple_row
+        ) as con,
+        psycopg.connect(db_url("test"), autocommit=True) as listener,
+    ):
+        with con.cursor() as cur:
+            cur.execute("create extension if not exists timescaledb")
+            cur.execute("create schema if not exists vec")
+            cur.execute("drop table if exists vec.note6")
+            cur.execute("""
+                create table vec.note6
+                ( id bigint not null primary key generated always as identity
+                , note text not null
+                )
+            """)
+            cur.execute("""
+            select ai.create_vectorizer
+            ( 'vec.note6'::regclass
+            , loading => ai.loading_column('note')
+            , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+            , chunking=>ai.chunking_character_text_splitter()
+            , scheduling=> ai.scheduling_none()
+            , indexing=>ai.indexing_none()
+            , grant_to=>null
+            , enqueue_existing=>false
+            );
+            """)
+            vectorizer_id = cur.fetchone()[0]
+            cur.execute("select * from ai.vectorizer where id = %s", (vectorizer_id,))
+            vectorizer = cur.fetchone()
+
+            listener.execute("listen ai_vectorizer_queue")
+            listener.execute("listen ai_vectorizer_config")
+
+            # a transaction queueing many rows sends a single notification
+            cur.execute("""
+            insert into vec.note6 (note)
+            select 'note ' || x from generate_series(1, 10) x
+            """)
+            notifies = list(listener.notifies(timeout=1))
+            assert [(n.channel, n.payload) for n in notifies] == [
+                (
+                    "ai_vectorizer_queue",
+                    f"{vectorizer.queue_schema}.{vectorizer.queue_table}",
+                )
+            ]
+
+            cur.execute("select ai.disable_vectorizer_schedule(%s)", (vectorizer_id,))
+            notifies = list(listener.notifies(timeout=1))
+            assert [(n.channel, n.payload) for n in notifies] == [
+                ("ai_vectorizer_config", str(vectorizer_id))
+            ]
+
+
+def test_statement_trigger():
+    with psycopg.connect(
+        db_url("test"), autocommit=True, row_factory=namedtuple_row
+    ) as con:
+        with con.cursor() as cur:
+            cur.execute("create extension if not exists timescaledb")
+            cur.execute("create schema if not exists vec")
+            cur.execute("drop table if exists vec.note7")
+            cur.execute("""
+                create table vec.note7
+                ( id bigint not null primary key
+                , note text not null
+                , meta json
+                , note_embedding vector(3)
+                )
+            """)
+            cur.execute("""
+            select ai.create_vectorizer
+            ( 'vec.note7'::regclass
+            , loading => ai.loading_column('note')
+            , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+            , chunking=>ai.chunking_character_text_splitter()
+            , scheduling=> ai.scheduling_none()
+            , indexing=>ai.indexing_none()
+            , processing=>ai.processing_default(statement_trigger=>true)
+            , grant_to=>null
+            , enqueue_existing=>false
+            );
+            """)
+            vectorizer_id = cur.fetchone()[0]
+            cur.execute("select * from ai.vectorizer where id = %s", (vectorizer_id,))
+            vectorizer = cur.fetchone()
+            queue = f"{vectorizer.queue_schema}.{vectorizer.queue_table}"
+            target = "vec.note7_embedding_store"
+
+            # the source table has statement-level triggers only
+            cur.execute("""
+                select t.tgname, t.tgtype & 1 = 1 as row_level
+                from pg_trigger t
+                where t.tgrelid = 'vec.note7'::regclass
+                order by t.tgname
+            """)
+            trigger = vectorizer.trigger_name
+            assert [tuple(row) for row in cur.fetchall()] == [
+                (trigger, False),
+                (f"{trigger}_delete", False),
+                (f"{trigger}_insert", False),
+                (f"{trigger}_truncate", False),
+            ]
+
+            def queued() -> list[int]:
+                cur.execute(f"select id from {queue} order by id")
+                ids = [row.id for row in cur.fetchall()]
+                cur.execute(f"delete from {queue}")
+                return ids
+
+            cur.execute("""
+                insert into vec.note7 (id, note, meta)
+                select x, 'note ' || x, '{"a": 1}' from generate_series(1, 5) x
+            """)
+            assert queued() == [1, 2, 3, 4, 5]
+            cur.execute(f"""
+                insert into {target} (id, chunk_seq, chunk, embedding)
+                select x, 0, 'note ' || x, '[0,0,0]' from generate_series(1, 5) x
+            """)
+
+            # only rows whose relevant columns changed are queued
+            cur.execute("update vec.note7 set note = note")
+            assert queued() == []
+            cur.execute("update vec.note7 set note = 'changed' where id = 2")
+            assert queued() == [2]
+            cur.execute("""update vec.note7 set meta = '{"a": 2}' where id = 3""")
+            assert queued() == [3]
+
+            # a changed primary key deletes the embeddings of the old key
+            cur.execute("update vec.note7 set id = 6 where id = 4")
+            assert queued() == [6]
+            cur.execute(f"select id from {target} order by id")
+            assert [row.id for row in cur.fetchall()] == [1, 2, 3, 5]
+
+            cur.execute("delete from vec.note7 where id in (1, 2)")
+            cur.execute(f"select id from {target} order by id")
+            assert [row.id for row in cur.fetchall()] == [3, 5]
+
+            # the embedding columns of the vectorizers of the table don't queue
+            # rows, including those of vectorizers created and dropped later
+            cur.execute("update vec.note7 set note_embedding = '[1,1,1]' where id = 3")
+            assert queued() == [3]
+            cur.execute("""
+            select ai.create_vectorizer
+            ( 'vec.note7'::regclass
+            , loading => ai.loading_column('note')
+            , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+            , destination=>ai.destination_column('note_embedding')
+            , chunking=>ai.chunking_none()
+            , scheduling=> ai.scheduling_none()
+            , indexing=>ai.indexing_none()
+            , grant_to=>null
+            , enqueue_existing=>false
+            );
+            """)
+            column_vectorizer_id = cur.fetchone()[0]
+            cur.execute("update vec.note7 set note_embedding = '[2,2,2]' where id = 3")
+            assert queued() == []
+            cur.execute("select ai.drop_vectorizer(%s)", (column_vectorizer_id,))
+            cur.execute("update vec.note7 set note_embedding = '[3,3,3]' where id = 3")
+            assert queued() == [3]
+
+            # columns added or dropped later are only taken into account once
+            # the trigger is recompiled
+            cur.execute("alter table vec.note7 add column title text")
+            cur.execute("update vec.note7 set title = 'title' where id = 3")
+            assert queued() == []
+            cur.execute("alter table vec.note7 drop column meta")
+            with pytest.raises(psycopg.errors.UndefinedColumn):
+                cur.execute("update vec.note7 set note = 'again' where id = 3")
+            cur.execute("select ai.recompile_vectorizer_trigger(%s)", (vectorizer_id,))
+            cur.execute("update vec.note7 set note = 'again' where id = 3")
+            assert queued() == [3]
+            cur.execute("update vec.note7 set title = 'new title' where id = 3")
+            assert queued() == [3]
+
+            # dropping the vectorizer drops all the triggers
+            cur.execute("select ai.drop_vectorizer(%s)", (vectorizer_id,))
+            cur.execute(
+                "select count(*) from pg_trigger where tgrelid = 'vec.note7'::regclass"
+            )
+            assert cur.fetchone()[0] == 0
+
+
 def test_grant_to_public():
     with psycopg.connect(
         db_url("test"), autocommit=True, row_factory=namedtuple_row
@@ -202,3 +202,79 @@ def test_worker_tracking_progress():
             assert row["success_count"] == 2
             assert row["error_count"] == 1
         con.commit()
+
+
+def test_worker_shard():
+    with psycopg.connect(db_url("test")) as con:
+        with con.cursor(row_factory=dict_row) as cur:
+            cur.execute("delete from ai.vectorizer_worker_process")
+            worker_ids = []
+            for _ in range(3):
+                row = cur.execute(
+                    "select ai._worker_start('0.1.1', interval '1 minute') as worker_id"
+                ).fetchone()
+                worker_ids.append(row["worker_id"])
+
+            # the workers started in the same transaction are ordered by id
+            worker_ids.sort()
+            for shard, worker_id in enumerate(worker_ids):
+                row = cur.execute(
+                    "select * from ai._worker_shard(%s)", (worker_id,)
+                ).fetchone()
+                assert row == {"shard": shard, "shard_count": 3}
+
+            # a worker that missed its heartbeats gives up its shard
+            cur.execute(
+                """
+                update ai.vectorizer_worker_process
+                set last_heartbeat = now() - interval '1 hour'
+                where id = %s
+                """,
+                (worker_ids[0],),
+            )
+            row = cur.execute(
+                "select * from ai._worker_shard(%s)", (worker_ids[2],)
+            ).fetchone()
+            assert row == {"shard": 1, "shard_count": 2}
+            # but still gets one when it asks
+            row = cur.execute(
+                "select * from ai._worker_shard(%s)", (worker_ids[0],)
+            ).fetchone()
+            assert row == {"shard": 0, "shard_count": 3}
+        con.rollback()
+
+
+def test_reserve_embedding_capacity():
+    with psycopg.connect(db_url("test")) as con:
+        with con.cursor() as cur:
+
+            def reserve(requests: int, tokens: float) -> float | None:
+                row = cur.execute(
+                    """
+                    select ai._reserve_embedding_capacity
+                    ('openai', 'text-embedding-3-small', 'OPENAI_API_KEY', %s, %s)
+                    """,
+                    (requests, tokens),
+                ).fetchone()
+                assert row is not None
+                return row[0]
+
+            # without limits, nothing is reserved
+            assert reserve(1, 100) is None
+
+            cur.execute(
+                """
+                insert into ai.embedding_rate_limit
+                (provider, model, api_key_name, requests_per_minute, tokens_per_minute)
+                values ('openai', 'text-embedding-3-small', 'OPENAI_API_KEY', 3, 600)
+                """
+            )
+            # a minute's worth of capacity is available right away
+            assert reserve(1, 300) == 0
+            assert reserve(1, 300) == 0
+            assert reserve(1, 0) == 0
+            # then reservations wait for the buckets to refill, at 0.05
+            # requests and 10 tokens per second
+            assert reserve(1, 0) == pytest.approx(20, abs=1)
+            assert reserve(0, 300) == pytest.approx(30, abs=1)
+        con.rollback()
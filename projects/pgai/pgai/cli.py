@@ -129,7 +129,8 @@ def download_models():
     show_default=True,
     help="The interval, in duration string or integer (seconds), "
     "to wait before checking for new work after processing "
-    "all available work in the queue.",
+    "all available work in the queue. Notifications of new work wake "
+    "the worker up before the interval is over.",
 )
 @click.option(
     "--once",
@@ -153,6 +154,47 @@ def download_models():
     show_default=True,
     help="Exit immediately when an error occurs.",
 )
+@click.option(
+    "--pipeline-depth",
+    type=click.IntRange(1),
+    default=None,
+    show_default=True,
+    help="Overlap fetching, preparing, embedding and writing of batches, "
+    "keeping up to this many batches in flight per asynchronous task.",
+)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(1),
+    default=None,
+    show_default=True,
+    help="Run several vectorizers at once, with up to this many asynchronous "
+    "tasks across all of them. Vectorizers take turns in time slices, "
+    "favouring those that have waited longest and have the smallest queues.",
+)
+@click.option(
+    "--parsing-processes",
+    type=click.IntRange(1),
+    default=None,
+    show_default=True,
+    help="Load, parse, chunk and format documents in this many processes "
+    "instead of the worker process, to use several cores.",
+)
+@click.option(
+    "--shard-queue",
+    type=click.BOOL,
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Split the queues between the running workers and their asynchronous "
+    "tasks by primary key hash, so that they don't compete for the same items.",
+)
+@click.option(
+    "--metrics-port",
+    type=click.IntRange(0, 65535),
+    default=None,
+    show_default=True,
+    help="Serve metrics in the Prometheus text format at /metrics on this port.",
+)
 def vectorizer_worker(
     db_url: str,
     vectorizer_ids: Sequence[int],
@@ -161,6 +203,11 @@ def vectorizer_worker(
     once: bool,
     concurrency: int | None,
     exit_on_error: bool | None,
+    pipeline_depth: int | None,
+    max_concurrency: int | None,
+    parsing_processes: int | None,
+    shard_queue: bool,
+    metrics_port: int | None,
 ) -> None:
     asyncio.run(
         async_run_vectorizer_worker(
@@ -171,6 +218,11 @@ def vectorizer_worker(
             once,
             concurrency,
             exit_on_error,
+            pipeline_depth,
+            max_concurrency,
+            parsing_processes,
+            shard_queue,
+            metrics_port,
         )
     )
 
@@ -183,6 +235,11 @@ async def async_run_vectorizer_worker(
     once: bool,
     concurrency: int | None,
     exit_on_error: bool | None,
+    pipeline_depth: int | None = None,
+    max_concurrency: int | None = None,
+    parsing_processes: int | None = None,
+    shard_queue: bool = False,
+    metrics_port: int | None = None,
 ) -> None:
     from .vectorizer import Worker
 
@@ -201,6 +258,11 @@ async def async_run_vectorizer_worker(
         vectorizer_ids,
         exit_on_error,
         concurrency,
+        pipeline_depth,
+        max_concurrency,
+        parsing_processes=parsing_processes,
+        shard_queue=shard_queue,
+        metrics_port=metrics_port,
     )
     exception = await worker.run()
     if exception is not None:
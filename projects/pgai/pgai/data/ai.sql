@@ -1224,6 +1224,153 @@ begin
 end;
 $outer_migration_block$;
 
+-------------------------------------------------------------------------------
+-- 032-add-vectorizer-queue-lease-columns.sql
+do $outer_migration_block$ /*032-add-vectorizer-queue-lease-columns.sql*/
+declare
+    _sql text;
+    _migration record;
+    _migration_name text = $migration_name$032-add-vectorizer-queue-lease-columns.sql$migration_name$;
+    _migration_body text =
+$migration_body$
+do language plpgsql $block$
+declare
+    _rec pg_catalog.record;
+    _sql pg_catalog.text;
+begin
+    -- loop through all vectorizers to extract queue tables information
+    for _rec in (
+        select queue_schema, queue_table from ai.vectorizer
+    )
+    loop
+
+        select pg_catalog.format
+               ( $sql$alter table %I.%I
+                 add column if not exists lease_id pg_catalog.uuid default null
+                 , add column if not exists lease_expires_at pg_catalog.timestamptz default null$sql$
+                 , _rec.queue_schema
+                 , _rec.queue_table
+               ) into strict _sql;
+
+        raise debug '%', _sql;
+        execute _sql;
+    end loop;
+end;
+$block$;
+
+$migration_body$;
+begin
+    select * into _migration from ai.pgai_lib_migration where "name" operator(pg_catalog.=) _migration_name;
+    if _migration is not null then
+        raise notice 'migration %s already applied. skipping.', _migration_name;
+        if _migration.body operator(pg_catalog.!=) _migration_body then
+            raise warning 'the contents of migration "%s" have changed', _migration_name;
+        end if;
+        return;
+    end if;
+    _sql = pg_catalog.format(E'do /*%s*/ $migration_body$\nbegin\n%s\nend;\n$migration_body$;', _migration_name, _migration_body);
+    execute _sql;
+    insert into ai.pgai_lib_migration ("name", body, applied_at_version)
+    values (_migration_name, _migration_body, $version$__version__$version$);
+end;
+$outer_migration_block$;
+
+-------------------------------------------------------------------------------
+-- 033-drop-processing-default-old-signature.sql
+do $outer_migration_block$ /*033-drop-processing-default-old-signature.sql*/
+declare
+    _sql text;
+    _migration record;
+    _migration_name text = $migration_name$033-drop-processing-default-old-signature.sql$migration_name$;
+    _migration_body text =
+$migration_body$
+drop function if exists ai.processing_default(pg_catalog.int4,pg_catalog.int4);
+
+$migration_body$;
+begin
+    select * into _migration from ai.pgai_lib_migration where "name" operator(pg_catalog.=) _migration_name;
+    if _migration is not null then
+        raise notice 'migration %s already applied. skipping.', _migration_name;
+        if _migration.body operator(pg_catalog.!=) _migration_body then
+            raise warning 'the contents of migration "%s" have changed', _migration_name;
+        end if;
+        return;
+    end if;
+    _sql = pg_catalog.format(E'do /*%s*/ $migration_body$\nbegin\n%s\nend;\n$migration_body$;', _migration_name, _migration_body);
+    execute _sql;
+    insert into ai.pgai_lib_migration ("name", body, applied_at_version)
+    values (_migration_name, _migration_body, $version$__version__$version$);
+end;
+$outer_migration_block$;
+
+-------------------------------------------------------------------------------
+-- 034-add-embedding-rate-limit-table.sql
+do $outer_migration_block$ /*034-add-embedding-rate-limit-table.sql*/
+declare
+    _sql text;
+    _migration record;
+    _migration_name text = $migration_name$034-add-embedding-rate-limit-table.sql$migration_name$;
+    _migration_body text =
+$migration_body$
+-- rate limits of embedding providers, shared by all vectorizer workers
+create table ai.embedding_rate_limit(
+      provider text not null
+    , model text not null
+    , api_key_name text not null default ''
+    , requests_per_minute int null check (requests_per_minute > 0)
+    , tokens_per_minute int null check (tokens_per_minute > 0)
+    -- the capacity left as of refilled_at, negative when reserved ahead
+    , requests_available float8 null
+    , tokens_available float8 null
+    , refilled_at timestamptz null
+    , primary key (provider, model, api_key_name)
+);
+
+$migration_body$;
+begin
+    select * into _migration from ai.pgai_lib_migration where "name" operator(pg_catalog.=) _migration_name;
+    if _migration is not null then
+        raise notice 'migration %s already applied. skipping.', _migration_name;
+        if _migration.body operator(pg_catalog.!=) _migration_body then
+            raise warning 'the contents of migration "%s" have changed', _migration_name;
+        end if;
+        return;
+    end if;
+    _sql = pg_catalog.format(E'do /*%s*/ $migration_body$\nbegin\n%s\nend;\n$migration_body$;', _migration_name, _migration_body);
+    execute _sql;
+    insert into ai.pgai_lib_migration ("name", body, applied_at_version)
+    values (_migration_name, _migration_body, $version$__version__$version$);
+end;
+$outer_migration_block$;
+
+-------------------------------------------------------------------------------
+-- 035-drop-create-source-trigger-old-signature.sql
+do $outer_migration_block$ /*035-drop-create-source-trigger-old-signature.sql*/
+declare
+    _sql text;
+    _migration record;
+    _migration_name text = $migration_name$035-drop-create-source-trigger-old-signature.sql$migration_name$;
+    _migration_body text =
+$migration_body$
+drop function if exists ai._vectorizer_create_source_trigger(name,name,name,name,name,name,name,jsonb);
+
+$migration_body$;
+begin
+    select * into _migration from ai.pgai_lib_migration where "name" operator(pg_catalog.=) _migration_name;
+    if _migration is not null then
+        raise notice 'migration %s already applied. skipping.', _migration_name;
+        if _migration.body operator(pg_catalog.!=) _migration_body then
+            raise warning 'the contents of migration "%s" have changed', _migration_name;
+        end if;
+        return;
+    end if;
+    _sql = pg_catalog.format(E'do /*%s*/ $migration_body$\nbegin\n%s\nend;\n$migration_body$;', _migration_name, _migration_body);
+    execute _sql;
+    insert into ai.pgai_lib_migration ("name", body, applied_at_version)
+    values (_migration_name, _migration_body, $version$__version__$version$);
+end;
+$outer_migration_block$;
+
 --------------------------------------------------------------------------------
 -- 001-chunking.sql
 
@@ -1817,6 +1964,10 @@ set search_path to pg_catalog, pg_temp
 create or replace function ai.processing_default
 ( batch_size pg_catalog.int4 default null
 , concurrency pg_catalog.int4 default null
+, lease_seconds pg_catalog.int4 default null
+, reuse_embeddings pg_catalog.bool default null
+, target_batch_seconds pg_catalog.int4 default null
+, statement_trigger pg_catalog.bool default null
 ) returns pg_catalog.jsonb
 as $func$
     select json_strip_nulls(json_build_object
@@ -1824,6 +1975,10 @@ as $func$
     , 'config_type', 'processing'
     , 'batch_size', batch_size
     , 'concurrency', concurrency
+    , 'lease_seconds', lease_seconds
+    , 'reuse_embeddings', reuse_embeddings
+    , 'target_batch_seconds', target_batch_seconds
+    , 'statement_trigger', statement_trigger
     ))
 $func$ language sql immutable security invoker
 set search_path to pg_catalog, pg_temp
@@ -1874,6 +2029,40 @@ begin
                     raise exception 'concurrency must be greater than 0';
                 end if;
             end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'lease_seconds');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'number' then
+                    raise exception 'lease_seconds must be a number';
+                end if;
+                if cast(_val as pg_catalog.int4) operator(pg_catalog.<) 1 then
+                    raise exception 'lease_seconds must be greater than 0';
+                end if;
+            end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'reuse_embeddings');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'boolean' then
+                    raise exception 'reuse_embeddings must be a boolean';
+                end if;
+            end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'target_batch_seconds');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'number' then
+                    raise exception 'target_batch_seconds must be a number';
+                end if;
+                if cast(_val as pg_catalog.int4) operator(pg_catalog.<) 1 then
+                    raise exception 'target_batch_seconds must be greater than 0';
+                end if;
+            end if;
+
+            _val = pg_catalog.jsonb_extract_path(config, 'statement_trigger');
+            if _val is not null then
+                if pg_catalog.jsonb_typeof(_val) operator(pg_catalog.!=) 'boolean' then
+                    raise exception 'statement_trigger must be a boolean';
+                end if;
+            end if;
         else
             if _implementation is null then
                 raise exception 'processing implementation not specified';
@@ -2706,6 +2895,8 @@ begin
       , queued_at pg_catalog.timestamptz not null default now()
       , loading_retries pg_catalog.int4 not null default 0
       , loading_retry_after pg_catalog.timestamptz
+      , lease_id pg_catalog.uuid
+      , lease_expires_at pg_catalog.timestamptz
       )
       $sql$
     , queue_schema, queue_table
@@ -2868,6 +3059,7 @@ declare
     _func_def pg_catalog.text;
     _relevant_columns_check pg_catalog.text;
     _truncate_statement pg_catalog.text;
+    _notify_statement pg_catalog.text;
 begin
     -- Pre-calculate all the parts we need
     select pg_catalog.string_agg(pg_catalog.format('%I', x.attname), ', ' order by x.attnum)
@@ -2896,6 +3088,11 @@ begin
                                 target_schema, target_table, queue_schema, queue_table);
     end if;
 
+    -- Wake up the workers listening for new work. Postgres delivers identical
+    -- notifications of a transaction only once, so a bulk write sends one.
+    _notify_statement := pg_catalog.format('perform pg_catalog.pg_notify(%L, %L)',
+        'ai_vectorizer_queue', pg_catalog.concat(queue_schema, '.', queue_table));
+
     _relevant_columns_check := 
         pg_catalog.format('EXISTS (
             SELECT 1 FROM pg_catalog.jsonb_each(to_jsonb(old)) AS o(key, value)
@@ -2922,16 +3119,19 @@ begin
                         $DELETE_STATEMENT$;
                         insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                             values ($PK_VALUES$);
+                        $NOTIFY_STATEMENT$;
                     -- check if a relevant column has changed and queue the update
                     elsif $RELEVANT_COLUMNS_CHECK$ then
                         insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                         values ($PK_VALUES$);
+                        $NOTIFY_STATEMENT$;
                     end if;
 
                     return new;
                 else
                     insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                     values ($PK_VALUES$);
+                    $NOTIFY_STATEMENT$;
                     return new;
                 end if;
 
@@ -2957,6 +3157,7 @@ begin
         _func_def := replace(_func_def, '$TARGET_TABLE$', quote_ident(target_table));
         _func_def := replace(_func_def, '$RELEVANT_COLUMNS_CHECK$', _relevant_columns_check);
         _func_def := replace(_func_def, '$TRUNCATE_STATEMENT$', _truncate_statement);
+        _func_def := replace(_func_def, '$NOTIFY_STATEMENT$', _notify_statement);
     
     else
         _func_def := $def$
@@ -2966,10 +3167,12 @@ begin
                     if $RELEVANT_COLUMNS_CHECK$ then
                         insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                         values ($PK_VALUES$);
+                        $NOTIFY_STATEMENT$;
                     end if;
                 elseif (TG_OP = 'INSERT') then
                     insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
                     values ($PK_VALUES$);
+                    $NOTIFY_STATEMENT$;
                 end if;
             end if;
             return null;
@@ -2980,12 +3183,201 @@ begin
         _func_def := replace(_func_def, '$QUEUE_TABLE$', quote_ident(queue_table));
         _func_def := replace(_func_def, '$PK_COLUMNS$', _pk_columns);
         _func_def := replace(_func_def, '$PK_VALUES$', _pk_values);
+        _func_def := replace(_func_def, '$NOTIFY_STATEMENT$', _notify_statement);
     end if;
     return _func_def;
 end;
 $func$ language plpgsql immutable security invoker
 set search_path to pg_catalog, pg_temp;
 
+-------------------------------------------------------------------------------
+-- _vectorizer_build_statement_trigger_definition
+create or replace function ai._vectorizer_build_statement_trigger_definition
+( queue_schema pg_catalog.name
+, queue_table pg_catalog.name
+, target_schema pg_catalog.name
+, target_table pg_catalog.name
+, source_schema pg_catalog.name
+, source_table pg_catalog.name
+, source_pk pg_catalog.jsonb
+) returns pg_catalog.text as
+$func$
+declare
+    _source_schema pg_catalog.name = source_schema;
+    _source_table pg_catalog.name = source_table;
+    _pk_attnames pg_catalog.name[];
+    _pk_columns pg_catalog.text;
+    _new_pk_values pg_catalog.text;
+    _pk_join pg_catalog.text;
+    _target_pk_join pg_catalog.text;
+    _old_row_missing pg_catalog.text;
+    _relevant_columns_check pg_catalog.text;
+    _embedding_columns_lookup pg_catalog.text;
+    _truncate_statement pg_catalog.text;
+    _notify_statement pg_catalog.text;
+    _func_def pg_catalog.text;
+begin
+    -- Pre-calculate all the parts we need
+    select
+      pg_catalog.string_agg(pg_catalog.format('%I', x.attname), ', ' order by x.attnum)
+    , pg_catalog.string_agg(pg_catalog.format('n.%I', x.attname), ', ' order by x.attnum)
+    , pg_catalog.string_agg(pg_catalog.format('o.%I = n.%I', x.attname, x.attname), ' and ' order by x.attnum)
+    , pg_catalog.string_agg(pg_catalog.format('t.%I = o.%I', x.attname, x.attname), ' and ' order by x.attnum)
+    into strict
+      _pk_columns
+    , _new_pk_values
+    , _pk_join
+    , _target_pk_join
+    from pg_catalog.jsonb_to_recordset(source_pk) x(attnum int, attname name);
+
+    -- the primary key columns are not null, so a missing old row has a null key
+    select pg_catalog.format('o.%I is null', x.attname)
+    into strict _old_row_missing
+    from pg_catalog.jsonb_to_recordset(source_pk) x(attnum int, attname name)
+    order by x.attnum
+    limit 1;
+
+    -- The primary key is compared by the join
+    select pg_catalog.array_agg(x.attname)
+    into strict _pk_attnames
+    from pg_catalog.jsonb_to_recordset(source_pk) x(attnum int, attname name);
+
+    -- Compile the check of the relevant columns to one comparison per column.
+    -- Types without an equality operator in pg_catalog, such as json, are
+    -- compared as jsonb, like the row-level trigger compares all columns. The
+    -- embedding columns of the vectorizers of the source table are written by
+    -- the worker, and don't queue the row again. As vectorizers come and go,
+    -- they are looked up when the trigger runs.
+    select pg_catalog.string_agg
+    ( pg_catalog.format
+      ( '(%L operator(pg_catalog.!=) all(_embedding_columns) and %s)'
+      , a.attname
+      , case
+          when exists
+          ( select 1
+            from pg_catalog.pg_operator r
+            where r.oprname operator(pg_catalog.=) '='
+            and r.oprleft operator(pg_catalog.=) a.atttypid
+            and r.oprright operator(pg_catalog.=) a.atttypid
+            and r.oprnamespace operator(pg_catalog.=) 'pg_catalog'::pg_catalog.regnamespace
+          )
+          then pg_catalog.format('o.%I is distinct from n.%I', a.attname, a.attname)
+          else pg_catalog.format('pg_catalog.to_jsonb(o.%I) is distinct from pg_catalog.to_jsonb(n.%I)', a.attname, a.attname)
+        end
+      )
+    , ' or ' order by a.attnum
+    )
+    into _relevant_columns_check
+    from pg_catalog.pg_attribute a
+    where a.attrelid operator(pg_catalog.=) pg_catalog.format('%I.%I', _source_schema, _source_table)::pg_catalog.regclass::pg_catalog.oid
+    and a.attnum operator(pg_catalog.>) 0
+    and not a.attisdropped
+    and a.attname operator(pg_catalog.!=) all(_pk_attnames)
+    ;
+    _relevant_columns_check := pg_catalog.coalesce(_relevant_columns_check, 'false');
+
+    _embedding_columns_lookup := $sql$select pg_catalog.coalesce(pg_catalog.array_agg((v.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'embedding_column')::pg_catalog.name), '{}')
+                into _embedding_columns
+                from ai.vectorizer v
+                where v.source_schema operator(pg_catalog.=) TG_TABLE_SCHEMA
+                and v.source_table operator(pg_catalog.=) TG_TABLE_NAME
+                and v.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'implementation' operator(pg_catalog.=) 'column'$sql$;
+
+    -- Wake up the workers listening for new work, once per statement
+    _notify_statement := pg_catalog.format('perform pg_catalog.pg_notify(%L, %L)',
+        'ai_vectorizer_queue', pg_catalog.concat(queue_schema, '.', queue_table));
+
+    if target_schema is not null and target_table is not null then
+        _truncate_statement := format('truncate table %I.%I; truncate table %I.%I',
+                                target_schema, target_table, queue_schema, queue_table);
+
+        _func_def := $def$
+        declare
+            _embedding_columns pg_catalog.name[];
+        begin
+            if (TG_OP = 'INSERT') then
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $PK_COLUMNS$ from new_rows;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            elsif (TG_OP = 'UPDATE') then
+                -- delete the embeddings of primary keys that changed
+                delete from $TARGET_SCHEMA$.$TARGET_TABLE$ t
+                using
+                ( select $PK_COLUMNS$ from old_rows
+                  except
+                  select $PK_COLUMNS$ from new_rows
+                ) o
+                where $TARGET_PK_JOIN$;
+                -- queue the rows whose primary key or a relevant column changed
+                $EMBEDDING_COLUMNS_LOOKUP$;
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $NEW_PK_VALUES$
+                from new_rows n
+                left join old_rows o on ($PK_JOIN$)
+                where $OLD_ROW_MISSING$
+                or $RELEVANT_COLUMNS_CHECK$;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            elsif (TG_OP = 'DELETE') then
+                delete from $TARGET_SCHEMA$.$TARGET_TABLE$ t
+                using old_rows o
+                where $TARGET_PK_JOIN$;
+            elsif (TG_OP = 'TRUNCATE') then
+                $TRUNCATE_STATEMENT$;
+            end if;
+            return null;
+        end;
+        $def$;
+        _func_def := replace(_func_def, '$TARGET_SCHEMA$', quote_ident(target_schema));
+        _func_def := replace(_func_def, '$TARGET_TABLE$', quote_ident(target_table));
+        _func_def := replace(_func_def, '$TARGET_PK_JOIN$', _target_pk_join);
+        _func_def := replace(_func_def, '$TRUNCATE_STATEMENT$', _truncate_statement);
+    else
+        _func_def := $def$
+        declare
+            _embedding_columns pg_catalog.name[];
+        begin
+            if (TG_OP = 'INSERT') then
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $PK_COLUMNS$ from new_rows;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            elsif (TG_OP = 'UPDATE') then
+                $EMBEDDING_COLUMNS_LOOKUP$;
+                insert into $QUEUE_SCHEMA$.$QUEUE_TABLE$ ($PK_COLUMNS$)
+                select $NEW_PK_VALUES$
+                from new_rows n
+                left join old_rows o on ($PK_JOIN$)
+                where $OLD_ROW_MISSING$
+                or $RELEVANT_COLUMNS_CHECK$;
+                if found then
+                    $NOTIFY_STATEMENT$;
+                end if;
+            end if;
+            return null;
+        end;
+        $def$;
+    end if;
+
+    -- Replace placeholders
+    _func_def := replace(_func_def, '$QUEUE_SCHEMA$', quote_ident(queue_schema));
+    _func_def := replace(_func_def, '$QUEUE_TABLE$', quote_ident(queue_table));
+    _func_def := replace(_func_def, '$PK_COLUMNS$', _pk_columns);
+    _func_def := replace(_func_def, '$NEW_PK_VALUES$', _new_pk_values);
+    _func_def := replace(_func_def, '$PK_JOIN$', _pk_join);
+    _func_def := replace(_func_def, '$OLD_ROW_MISSING$', _old_row_missing);
+    _func_def := replace(_func_def, '$RELEVANT_COLUMNS_CHECK$', _relevant_columns_check);
+    _func_def := replace(_func_def, '$EMBEDDING_COLUMNS_LOOKUP$', _embedding_columns_lookup);
+    _func_def := replace(_func_def, '$NOTIFY_STATEMENT$', _notify_statement);
+    return _func_def;
+end;
+$func$ language plpgsql stable security invoker
+set search_path to pg_catalog, pg_temp;
+
 -------------------------------------------------------------------------------
 -- _vectorizer_create_source_trigger
 create or replace function ai._vectorizer_create_source_trigger
@@ -2997,6 +3389,7 @@ create or replace function ai._vectorizer_create_source_trigger
 , target_schema pg_catalog.name    -- Schema containing the target table for deletions
 , target_table pg_catalog.name     -- Table where corresponding rows should be deleted
 , source_pk pg_catalog.jsonb       -- JSON describing primary key columns to track
+, statement_trigger pg_catalog.bool default false -- Queue the rows of a statement at once
 ) returns void as
 $func$
 declare
@@ -3013,13 +3406,24 @@ begin
     $sql$
     , queue_schema
     , trigger_name
-    , ai._vectorizer_build_trigger_definition(queue_schema,
-                                              queue_table,
-                                              target_schema,
-                                              target_table,
-                                              source_schema,
-                                              source_table,
-                                              source_pk)
+    , case
+        when statement_trigger then
+            ai._vectorizer_build_statement_trigger_definition(queue_schema,
+                                                              queue_table,
+                                                              target_schema,
+                                                              target_table,
+                                                              source_schema,
+                                                              source_table,
+                                                              source_pk)
+        else
+            ai._vectorizer_build_trigger_definition(queue_schema,
+                                                    queue_table,
+                                                    target_schema,
+                                                    target_table,
+                                                    source_schema,
+                                                    source_table,
+                                                    source_pk)
+      end
     );
 
     -- Revoke public permissions
@@ -3029,20 +3433,71 @@ begin
     );
     execute _sql;
 
-    -- Create the row-level trigger
-    select pg_catalog.format(
-        $sql$
-        create trigger %I
-        after insert or update or delete
-        on %I.%I
-        for each row execute function %I.%I()
-        $sql$,
-        trigger_name,
-        source_schema, source_table,
-        queue_schema, trigger_name
-    ) into strict _sql
-    ;
-    execute _sql;
+    if statement_trigger then
+        -- Create the statement-level triggers. A trigger with transition tables
+        -- can only fire on one event, so there is one trigger per event.
+        select pg_catalog.format(
+            $sql$
+            create trigger %I
+            after update
+            on %I.%I
+            referencing old table as old_rows new table as new_rows
+            for each statement execute function %I.%I()
+            $sql$,
+            trigger_name,
+            source_schema, source_table,
+            queue_schema, trigger_name
+        ) into strict _sql
+        ;
+        execute _sql;
+
+        select pg_catalog.format(
+            $sql$
+            create trigger %I_insert
+            after insert
+            on %I.%I
+            referencing new table as new_rows
+            for each statement execute function %I.%I()
+            $sql$,
+            trigger_name,
+            source_schema, source_table,
+            queue_schema, trigger_name
+        ) into strict _sql
+        ;
+        execute _sql;
+
+        if target_schema is not null and target_table is not null then
+            select pg_catalog.format(
+                $sql$
+                create trigger %I_delete
+                after delete
+                on %I.%I
+                referencing old table as old_rows
+                for each statement execute function %I.%I()
+                $sql$,
+                trigger_name,
+                source_schema, source_table,
+                queue_schema, trigger_name
+            ) into strict _sql
+            ;
+            execute _sql;
+        end if;
+    else
+        -- Create the row-level trigger
+        select pg_catalog.format(
+            $sql$
+            create trigger %I
+            after insert or update or delete
+            on %I.%I
+            for each row execute function %I.%I()
+            $sql$,
+            trigger_name,
+            source_schema, source_table,
+            queue_schema, trigger_name
+        ) into strict _sql
+        ;
+        execute _sql;
+    end if;
     
     -- Create the statement-level trigger for TRUNCATE
     -- Note: Using the same trigger function but with a different event and level
@@ -3073,6 +3528,7 @@ declare
     _target_schema pg_catalog.name;
     _target_table pg_catalog.name;
     _destination_type pg_catalog.text;
+    _trigger_def pg_catalog.text;
 begin
     -- Find all vectorizers
     for _vec in (
@@ -3099,6 +3555,24 @@ begin
             _target_table := null;
         end if;
 
+        if coalesce((_vec.config->'processing'->>'statement_trigger')::bool, false) then
+            _trigger_def := ai._vectorizer_build_statement_trigger_definition(_vec.queue_schema,
+                                                                              _vec.queue_table,
+                                                                              _target_schema,
+                                                                              _target_table,
+                                                                              _vec.source_schema,
+                                                                              _vec.source_table,
+                                                                              _vec.source_pk);
+        else
+            _trigger_def := ai._vectorizer_build_trigger_definition(_vec.queue_schema,
+                                                                    _vec.queue_table,
+                                                                    _target_schema,
+                                                                    _target_table,
+                                                                    _vec.source_schema,
+                                                                    _vec.source_table,
+                                                                    _vec.source_pk);
+        end if;
+
         execute format
         (
         --weird indent is intentional to make the sql functions look the same as during a fresh install
@@ -3111,13 +3585,7 @@ begin
     set search_path to pg_catalog, pg_temp
     $sql$
             , _vec.queue_schema, _vec.trigger_name,
-            ai._vectorizer_build_trigger_definition(_vec.queue_schema,
-                                                    _vec.queue_table,
-                                                    _target_schema,
-                                                    _target_table,
-                                                    _vec.source_schema,
-                                                    _vec.source_table,
-                                                    _vec.source_pk)
+            _trigger_def
         );
     end loop;
 end;
@@ -3547,6 +4015,40 @@ $func$
 language plpgsql volatile security invoker
 set search_path to pg_catalog, pg_temp
 ;
+-------------------------------------------------------------------------------
+-- _vectorizer_notify_change
+create or replace function ai._vectorizer_notify_change() returns trigger
+as $func$
+begin
+    -- wake up the workers listening for changes of this vectorizer, so they
+    -- pick up the new configuration or stop working on a disabled vectorizer
+    if TG_OP operator(pg_catalog.=) 'DELETE' then
+        perform pg_catalog.pg_notify('ai_vectorizer_config', old.id::pg_catalog.text);
+    else
+        perform pg_catalog.pg_notify('ai_vectorizer_config', new.id::pg_catalog.text);
+    end if;
+    return null;
+end
+$func$
+language plpgsql volatile security invoker
+set search_path to pg_catalog, pg_temp
+;
+
+do $block$
+begin
+    perform
+    from pg_catalog.pg_trigger g
+    where g.tgrelid operator(pg_catalog.=) 'ai.vectorizer'::pg_catalog.regclass
+    and g.tgname operator(pg_catalog.=) '_vectorizer_notify_change'
+    ;
+    if not found then
+        create trigger _vectorizer_notify_change
+        after insert or update or delete on ai.vectorizer
+        for each row execute function ai._vectorizer_notify_change();
+    end if;
+end
+$block$;
+
 
 --------------------------------------------------------------------------------
 -- 012-vectorizer-api.sql
@@ -3783,6 +4285,7 @@ begin
     , destination operator(pg_catalog.->>) 'target_schema'
     , destination operator(pg_catalog.->>) 'target_table'
     , _source_pk
+    , pg_catalog.coalesce((processing operator(pg_catalog.->>) 'statement_trigger')::pg_catalog.bool, false)
     );
 
 
@@ -3966,6 +4469,78 @@ $func$ language sql volatile security invoker
 set search_path to pg_catalog, pg_temp
 ;
 
+-------------------------------------------------------------------------------
+-- recompile_vectorizer_trigger
+-- The statement-level trigger compares the columns the source table had when
+-- the trigger was created. After columns are added to or dropped from the
+-- source table, its trigger function has to be recompiled. Until then, added
+-- columns don't queue rows, and updates fail if a column was dropped.
+create or replace function ai.recompile_vectorizer_trigger(vectorizer_id pg_catalog.int4) returns void
+as $func$
+declare
+    _vec ai.vectorizer%rowtype;
+    _target_schema pg_catalog.name;
+    _target_table pg_catalog.name;
+    _trigger_def pg_catalog.text;
+begin
+    select * into strict _vec
+    from ai.vectorizer v
+    where v.id operator(pg_catalog.=) vectorizer_id
+    ;
+
+    if _vec.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'implementation' operator(pg_catalog.=) 'table' then
+        _target_schema := _vec.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'target_schema';
+        _target_table := _vec.config operator(pg_catalog.->) 'destination' operator(pg_catalog.->>) 'target_table';
+    end if;
+
+    if pg_catalog.coalesce((_vec.config operator(pg_catalog.->) 'processing' operator(pg_catalog.->>) 'statement_trigger')::pg_catalog.bool, false) then
+        _trigger_def := ai._vectorizer_build_statement_trigger_definition
+        ( _vec.queue_schema
+        , _vec.queue_table
+        , _target_schema
+        , _target_table
+        , _vec.source_schema
+        , _vec.source_table
+        , _vec.source_pk
+        );
+    else
+        _trigger_def := ai._vectorizer_build_trigger_definition
+        ( _vec.queue_schema
+        , _vec.queue_table
+        , _target_schema
+        , _target_table
+        , _vec.source_schema
+        , _vec.source_table
+        , _vec.source_pk
+        );
+    end if;
+
+    execute pg_catalog.format
+    ( $sql$
+    create or replace function %I.%I() returns trigger 
+    as $trigger_def$ 
+    %s
+    $trigger_def$ language plpgsql volatile parallel safe security definer 
+    set search_path to pg_catalog, pg_temp
+    $sql$
+    , _vec.queue_schema
+    , _vec.trigger_name
+    , _trigger_def
+    );
+end;
+$func$ language plpgsql volatile security invoker
+set search_path to pg_catalog, pg_temp
+;
+
+create or replace function ai.recompile_vectorizer_trigger(name pg_catalog.text) returns void
+as $func$
+   select ai.recompile_vectorizer_trigger(v.id)
+   from ai.vectorizer v
+   where v.name operator(pg_catalog.=) recompile_vectorizer_trigger.name;
+$func$ language sql volatile security invoker
+set search_path to pg_catalog, pg_temp
+;
+
 -------------------------------------------------------------------------------
 -- drop_vectorizer
 create or replace function ai.drop_vectorizer
@@ -4043,13 +4618,18 @@ begin
         ;
         execute _sql;
 
-        select pg_catalog.format
-        ( $sql$drop trigger if exists %I on %I.%I$sql$
-        , format('%s_truncate', _trigger.tgname)
-        , _vec.source_schema
-        , _vec.source_table
-        ) into _sql;
-        execute _sql;
+        -- the triggers of the other events, if any
+        for _sql in
+            select pg_catalog.format
+            ( $sql$drop trigger if exists %I on %I.%I$sql$
+            , format('%s_%s', _trigger.tgname, e)
+            , _vec.source_schema
+            , _vec.source_table
+            )
+            from pg_catalog.unnest(array['truncate', 'insert', 'delete']) e
+        loop
+            execute _sql;
+        end loop;
 
         -- drop the function/procedure backing the trigger
         select pg_catalog.format
@@ -4427,6 +5007,75 @@ END;
 $$ LANGUAGE plpgsql security invoker
 set search_path to pg_catalog, pg_temp;
 
+CREATE OR REPLACE FUNCTION ai._worker_shard(worker_id uuid, OUT shard int, OUT shard_count int) AS $$
+BEGIN
+    --the workers that sent a heartbeat within two intervals are alive, and split
+    --the queues between themselves in the order they started
+    WITH alive AS (
+        SELECT p.id, row_number() OVER (ORDER BY p.started, p.id) - 1 AS shard
+        FROM ai.vectorizer_worker_process p
+        WHERE p.id = worker_id
+        OR p.last_heartbeat >= clock_timestamp() - p.expected_heartbeat_interval * 2
+    )
+    SELECT a.shard, (SELECT count(*) FROM alive)
+    INTO shard, shard_count
+    FROM alive a
+    WHERE a.id = worker_id;
+END;
+$$ LANGUAGE plpgsql security invoker
+set search_path to pg_catalog, pg_temp;
+
+CREATE OR REPLACE FUNCTION ai._reserve_embedding_capacity(embedding_provider text, embedding_model text, key_name text, num_requests int, num_tokens float8) RETURNS float8 AS $$
+DECLARE
+    rate_limit ai.embedding_rate_limit;
+    reserved_at timestamptz = clock_timestamp();
+    elapsed float8;
+    wait float8 = 0;
+BEGIN
+    --the limits are token buckets that refill at the rate per minute, up to a
+    --minute's worth. a reservation is taken right away, even beyond what is
+    --left, and the caller waits until the buckets would have refilled
+    SELECT * INTO rate_limit
+    FROM ai.embedding_rate_limit r
+    WHERE r.provider = embedding_provider
+    AND r.model = embedding_model
+    AND r.api_key_name = coalesce(key_name, '')
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    elapsed = greatest(0, extract(epoch FROM reserved_at - coalesce(rate_limit.refilled_at, reserved_at)));
+    IF rate_limit.requests_per_minute IS NOT NULL THEN
+        rate_limit.requests_available = least(
+            rate_limit.requests_per_minute,
+            coalesce(rate_limit.requests_available, rate_limit.requests_per_minute)
+                + elapsed * rate_limit.requests_per_minute / 60
+        ) - num_requests;
+        wait = greatest(wait, -rate_limit.requests_available * 60 / rate_limit.requests_per_minute);
+    END IF;
+    IF rate_limit.tokens_per_minute IS NOT NULL THEN
+        rate_limit.tokens_available = least(
+            rate_limit.tokens_per_minute,
+            coalesce(rate_limit.tokens_available, rate_limit.tokens_per_minute)
+                + elapsed * rate_limit.tokens_per_minute / 60
+        ) - num_tokens;
+        wait = greatest(wait, -rate_limit.tokens_available * 60 / rate_limit.tokens_per_minute);
+    END IF;
+
+    UPDATE ai.embedding_rate_limit r SET
+          requests_available = rate_limit.requests_available
+        , tokens_available = rate_limit.tokens_available
+        , refilled_at = reserved_at
+    WHERE r.provider = rate_limit.provider
+    AND r.model = rate_limit.model
+    AND r.api_key_name = rate_limit.api_key_name;
+    RETURN wait;
+END;
+$$ LANGUAGE plpgsql security invoker
+set search_path to pg_catalog, pg_temp;
+
+
 --------------------------------------------------------------------------------
 -- 014-semantic-catalog.sql
 
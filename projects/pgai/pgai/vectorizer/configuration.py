@@ -273,6 +273,10 @@ class ProcessingDefaultConfig(SQLArgumentMixin):
 
     batch_size: int | None = None
     concurrency: int | None = None
+    lease_seconds: int | None = None
+    reuse_embeddings: bool | None = None
+    target_batch_seconds: int | None = None
+    statement_trigger: bool | None = None
 
 
 @dataclass
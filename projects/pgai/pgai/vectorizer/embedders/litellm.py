@@ -1,5 +1,6 @@
+import asyncio
 import os
-from collections.abc import AsyncGenerator, Callable
+from collections.abc import AsyncGenerator
 from typing import Any, Literal
 
 from pydantic import BaseModel
@@ -9,8 +10,11 @@ from ..embeddings import (
     ApiKeyMixin,
     Embedder,
     EmbeddingResponse,
-    EmbeddingVector,
+    Embeddings,
+    RateLimiter,
+    TokenCounter,
     Usage,
+    cached_token_counter,
     logger,
 )
 from .voyageai import voyage_max_tokens_per_batch, voyage_token_counter
@@ -34,16 +38,18 @@ class LiteLLM(ApiKeyMixin, BaseModel, Embedder):
 
     @override
     async def embed(
-        self, documents: list[str]
-    ) -> AsyncGenerator[list[EmbeddingVector], None]:
+        self, documents: list[str], rate_limiter: RateLimiter | None = None
+    ) -> AsyncGenerator[Embeddings, None]:
         """
         Embeds a list of documents into vectors using LiteLLM.
 
         Args:
             documents (list[str]): A list of documents to be embedded.
+            rate_limiter (RateLimiter | None): Reserves capacity before every
+                embedding request, when given.
 
         Returns:
-            Sequence[EmbeddingVector]: The embeddings for each document.
+            Embeddings: The embeddings for each document.
         """
         await logger.adebug(f"Chunks produced: {len(documents)}")
         token_counter = self._token_counter()
@@ -51,10 +57,12 @@ class LiteLLM(ApiKeyMixin, BaseModel, Embedder):
         chunk_lengths = (
             [0 for _ in documents]
             if token_counter is None
-            else [token_counter(doc) for doc in documents]
+            else await asyncio.to_thread(token_counter, documents)
         )
         logger.debug("batching")
-        async for embeddings in self.batch_chunks_and_embed(documents, chunk_lengths):
+        async for embeddings in self.batch_chunks_and_embed(
+            documents, chunk_lengths, rate_limiter
+        ):
             yield embeddings
 
     @override
@@ -115,7 +123,15 @@ class LiteLLM(ApiKeyMixin, BaseModel, Embedder):
             case _:
                 return None
 
-    def _token_counter(self) -> Callable[[str], int] | None:
+    @override
+    async def setup(self) -> None:
+        # load the tokenizer off the event loop, once per process
+        await asyncio.to_thread(self._token_counter)
+
+    def _token_counter(self) -> TokenCounter | None:
+        return cached_token_counter("litellm", self.model, self._load_token_counter)
+
+    def _load_token_counter(self) -> TokenCounter | None:
         # Note: deferred import to avoid import overhead
         import litellm
 
@@ -127,12 +143,12 @@ class LiteLLM(ApiKeyMixin, BaseModel, Embedder):
 
                 m_tokenizer = MistralTokenizer.from_model(model, strict=True)  # type: ignore
 
-                def token_counter(text: str) -> int:
-                    return len(
-                        m_tokenizer.instruct_tokenizer.tokenizer.encode(  # type: ignore
-                            text, False, False
-                        )
-                    )
+                def token_counter(texts: list[str]) -> list[int]:
+                    tokenizer = m_tokenizer.instruct_tokenizer.tokenizer  # type: ignore
+                    return [
+                        len(tokenizer.encode(text, False, False))  # type: ignore
+                        for text in texts
+                    ]
 
                 return token_counter
             case "vertex_ai":
@@ -141,10 +157,14 @@ class LiteLLM(ApiKeyMixin, BaseModel, Embedder):
 
                 v_tokenizer = TextEmbeddingModel.from_pretrained(model)
 
-                def token_counter(text: str) -> int:
+                def token_counter(texts: list[str]) -> list[int]:
                     # NOTE: This is hideously inefficient, as evey call to
-                    # count_tokens makes an API request to the CountTokens API
-                    return v_tokenizer.count_tokens([text]).total_tokens
+                    # count_tokens makes an API request to the CountTokens API.
+                    # It only returns the total of its inputs, so every chunk
+                    # is counted with a request of its own.
+                    return [
+                        v_tokenizer.count_tokens([text]).total_tokens for text in texts
+                    ]
 
                 return token_counter
             case "openai" | "azure":
@@ -157,10 +177,10 @@ class LiteLLM(ApiKeyMixin, BaseModel, Embedder):
                     logger.warning(f"Tokenizer for the model {self.model} not found.")
                     encoder = None
 
-                def token_counter(text: str) -> int:
+                def token_counter(texts: list[str]) -> list[int]:
                     if encoder is None:
-                        return 0
-                    return len(encoder.encode(text))
+                        return [0 for _ in texts]
+                    return [len(tokens) for tokens in encoder.encode_batch(texts)]
 
                 return token_counter
             case "voyage":
@@ -1,16 +1,21 @@
 import os
 from collections.abc import AsyncGenerator, Sequence
-from typing import Literal
+from typing import TYPE_CHECKING, Literal
 
 from pydantic import BaseModel
 from typing_extensions import TypedDict, override
 
+if TYPE_CHECKING:
+    import ollama
+
 from ..embeddings import (
     BaseURLMixin,
     Embedder,
     EmbeddingResponse,
-    EmbeddingVector,
+    Embeddings,
+    RateLimiter,
     Usage,
+    embedding_clients,
     logger,
 )
 
@@ -73,20 +78,24 @@ class Ollama(BaseModel, BaseURLMixin, Embedder):
 
     @override
     async def embed(
-        self, documents: list[str]
-    ) -> AsyncGenerator[list[EmbeddingVector], None]:
+        self, documents: list[str], rate_limiter: RateLimiter | None = None
+    ) -> AsyncGenerator[Embeddings, None]:
         """
         Embeds a list of documents into vectors using Ollama's embeddings API.
 
         Args:
             documents (list[str]): A list of documents to be embedded.
+            rate_limiter (RateLimiter | None): Reserves capacity before every
+                embedding request, when given.
 
         Returns:
-            Sequence[EmbeddingVector]: The embeddings for each document.
+            Embeddings: The embeddings for each document.
         """
         await logger.adebug(f"Chunks produced: {len(documents)}")
         chunk_lengths = [0 for _ in documents]
-        async for embeddings in self.batch_chunks_and_embed(documents, chunk_lengths):
+        async for embeddings in self.batch_chunks_and_embed(
+            documents, chunk_lengths, rate_limiter
+        ):
             yield embeddings
 
     @override
@@ -96,12 +105,29 @@ class Ollama(BaseModel, BaseURLMixin, Embedder):
             os.getenv("PGAI_VECTORIZER_OLLAMA_MAX_CHUNKS_PER_BATCH", default="2048")
         )
 
+    @property
+    def _client(self) -> "ollama.AsyncClient":
+        # Note: deferred import to avoid import overhead
+        import ollama
+
+        return embedding_clients().get(
+            ("ollama", self.base_url),
+            lambda: ollama.AsyncClient(host=self.base_url),
+        )
+
     @override
     async def setup(self):
+        # every Executor sets the embedder up, but the model only needs to be
+        # checked, or pulled, once
+        await embedding_clients().setup(
+            ("ollama", self.base_url, self.model), self._pull_missing_model
+        )
+
+    async def _pull_missing_model(self):
         # Note: deferred import to avoid import overhead
         import ollama
 
-        client = ollama.AsyncClient(host=self.base_url)
+        client = self._client
         try:
             await client.show(self.model)
         except ollama.ResponseError as e:
@@ -113,10 +139,7 @@ class Ollama(BaseModel, BaseURLMixin, Embedder):
 
     @override
     async def call_embed_api(self, documents: list[str]) -> EmbeddingResponse:
-        # Note: deferred import to avoid import overhead
-        import ollama
-
-        response = await ollama.AsyncClient(host=self.base_url).embed(
+        response = await self._client.embed(
             model=self.model,
             input=documents,
             options=self.options,
@@ -132,10 +155,7 @@ class Ollama(BaseModel, BaseURLMixin, Embedder):
         """
         Gets the context_length of the configured model, if available
         """
-        # Note: deferred import to avoid import overhead
-        import ollama
-
-        model = await ollama.AsyncClient(host=self.base_url).show(self.model)
+        model = await self._client.show(self.model)
         architecture = model["model_info"].get("general.architecture", None)
         if architecture is None:
             logger.warn(f"unable to determine architecture for model '{self.model}'")
@@ -1,7 +1,14 @@
+import asyncio
+import base64
+import hashlib
+import os
 import re
+import threading
+from array import array
+from collections import OrderedDict
 from collections.abc import AsyncGenerator
 from functools import cached_property
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, ClassVar, Literal
 
 import ijson  # type: ignore
 from pydantic import BaseModel
@@ -18,13 +25,19 @@ from ..embeddings import (
     BaseURLMixin,
     Embedder,
     EmbeddingResponse,
-    EmbeddingVector,
+    Embeddings,
+    RateLimiter,
     Usage,
+    api_key_digest,
+    embedding_clients,
     logger,
 )
 
 TOKEN_CONTEXT_LENGTH_ERROR = "chunk exceeds model context length"
 
+# the number of times a failed request is sent again
+MAX_RETRIES = 3
+
 EMBEDDING_MODEL_CONTEXT_LENGTH = {
     "text-embedding-ada-002": 8191,
     "text-embedding-3-small": 8191,
@@ -39,10 +52,35 @@ EMBEDDING_MODEL_CONTEXT_LENGTH = {
 # The value of 64KB is the default from ijson.
 RESPONSE_READ_BUF_SIZE = 64 * 1024
 
+ENCODING_FORMATS = ("float", "base64")
+
 openai_token_length_regex = re.compile(
     r"This model's maximum context length is (\d+) tokens"
 )
 
+# Token counts of the chunks that were tokenized to check their length, keyed
+# by the encoding and the md5 hash of the chunk. Chunks are often embedded
+# again unchanged, e.g. when a row is updated, and are then not tokenized again.
+TOKEN_COUNT_CACHE_SIZE = 100_000
+_token_counts: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def _cached_token_count(key: tuple[str, bytes]) -> int | None:
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+        return count
+
+
+def _cache_token_count(key: tuple[str, bytes], count: int) -> None:
+    with _token_counts_lock:
+        _token_counts[key] = count
+        _token_counts.move_to_end(key)
+        while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+
 
 class ResponseWithRead:
     def __init__(self, response: "AsyncAPIResponse[types.CreateEmbeddingResponse]"):
@@ -72,6 +110,8 @@ class OpenAI(ApiKeyMixin, BaseURLMixin, BaseModel, Embedder):
     dimensions: int | None = None
     user: str | None = None
 
+    _overload_retries: ClassVar[int] = MAX_RETRIES
+
     @cached_property
     def _openai_dimensions(self) -> "int | openai.NotGiven":
         # Note: deferred import to avoid import overhead
@@ -90,13 +130,25 @@ class OpenAI(ApiKeyMixin, BaseURLMixin, BaseModel, Embedder):
 
         return self.user if self.user is not None else openai.NOT_GIVEN
 
-    @cached_property
+    @property
     def _embedder(self) -> "resources.AsyncEmbeddingsWithStreamingResponse":
+        # Note: deferred import to avoid import overhead
         import openai
 
-        return openai.AsyncOpenAI(
-            base_url=self.base_url, api_key=self._api_key, max_retries=3
-        ).embeddings.with_streaming_response
+        # With adaptive concurrency, overloaded requests are retried through
+        # the concurrency controller instead of by the client, so that the
+        # controller sees every overload
+        max_retries = 0 if self._concurrency_controller() is not None else MAX_RETRIES
+        # the client, and its connection pool, outlive this configuration,
+        # which is parsed again on every poll
+        client = embedding_clients().get(
+            ("openai", self.base_url, api_key_digest(self._api_key), max_retries),
+            lambda: openai.AsyncOpenAI(
+                base_url=self.base_url, api_key=self._api_key, max_retries=max_retries
+            ),
+            lambda client: client.close(),
+        )
+        return client.embeddings.with_streaming_response
 
     @override
     def _max_chunks_per_batch(self) -> int:
@@ -106,10 +158,32 @@ class OpenAI(ApiKeyMixin, BaseURLMixin, BaseModel, Embedder):
     def _max_tokens_per_batch(self) -> int:
         return 300_000
 
+    @cached_property
+    def _encoding_format(self) -> Literal["float", "base64"]:
+        encoding_format = os.getenv(
+            "PGAI_VECTORIZER_OPENAI_ENCODING_FORMAT", default="float"
+        )
+        if encoding_format == "float":
+            return "float"
+        if encoding_format == "base64":
+            return "base64"
+        raise ValueError(
+            f"PGAI_VECTORIZER_OPENAI_ENCODING_FORMAT must be one of "
+            f"{ENCODING_FORMATS}, got {encoding_format!r}"
+        )
+
     @override
     async def call_embed_api(self, documents: list[str]) -> EmbeddingResponse:
-        embeddings: list[list[float]] = []
-        current_embedding: list[float] = []
+        # Note: deferred import to avoid import overhead
+        import numpy as np
+
+        # The embeddings are collected into a single float32 buffer and
+        # returned as the rows of a matrix, instead of as one list of Python
+        # floats per embedding. With the base64 encoding the buffer is
+        # filled with the decoded little-endian float32 values directly.
+        floats = array("f")
+        encoded = bytearray()
+        rows = 0
         total_tokens = 0
         prompt_tokens = 0
         async with self._embedder.create(
@@ -117,7 +191,7 @@ class OpenAI(ApiKeyMixin, BaseURLMixin, BaseModel, Embedder):
             model=self.model,
             dimensions=self._openai_dimensions,
             user=self._openai_user,
-            encoding_format="float",
+            encoding_format=self._encoding_format,
         ) as streaming_response:
             # We could simplify by using ijson.item_async:
             #
@@ -135,37 +209,72 @@ class OpenAI(ApiKeyMixin, BaseURLMixin, BaseModel, Embedder):
                 use_float=True,
                 buf_size=RESPONSE_READ_BUF_SIZE,
             ):
-                if prefix == "data.item.embedding" and event == "start_array":
-                    current_embedding = []
                 if prefix == "data.item.embedding" and event == "end_array":
-                    embeddings.append(current_embedding)
+                    rows += 1
+                elif prefix == "data.item.embedding" and event == "string":
+                    encoded += base64.b64decode(value)
+                    rows += 1
                 elif prefix == "data.item.embedding.item" and event == "number":
-                    current_embedding.append(value)
+                    floats.append(value)
                 elif prefix == "usage.prompt_tokens" and event == "number":
                     prompt_tokens = value
                 elif prefix == "usage.total_tokens" and event == "number":
                     total_tokens = value
 
+        if encoded:
+            embeddings = np.frombuffer(encoded, dtype="<f4")
+        else:
+            embeddings = np.frombuffer(floats, dtype=np.float32)
         return EmbeddingResponse(
-            embeddings=embeddings, usage=Usage(prompt_tokens, total_tokens)
+            embeddings=embeddings.reshape(rows, -1),
+            usage=Usage(prompt_tokens, total_tokens),
         )
 
-    def _estimate_token_length(self, document: str) -> float:
-        """
-        Estimates token count based on UTF-8 byte length.
+    async def _truncate(self, documents: list[str], encoded: list[bytes]) -> None:
         """
+        Truncates the documents that exceed the context length of the model,
+        in place, along with their UTF-8 encoding.
 
-        total_estimated_tokens = 0
-        for char in document:
-            byte_length = len(char.encode("utf-8"))
-            total_estimated_tokens += byte_length * 0.25  # 0.25 tokens per byte
-
-        return total_estimated_tokens
+        A token is at least one byte long, so only the documents with more
+        bytes than the context length can exceed it. Those are tokenized
+        together by tiktoken in several threads, off the event loop, unless
+        their token count is cached from an earlier batch.
+        """
+        encoder = self._encoder
+        context_length = self._context_length
+        if encoder is None or context_length is None:
+            return
+        to_tokenize: list[tuple[int, tuple[str, bytes]]] = []
+        for i, document_bytes in enumerate(encoded):
+            if len(document_bytes) <= context_length:
+                continue
+            key = (
+                encoder.name,
+                hashlib.md5(document_bytes, usedforsecurity=False).digest(),
+            )
+            count = _cached_token_count(key)
+            if count is None or count > context_length:
+                to_tokenize.append((i, key))
+        if not to_tokenize:
+            return
+        tokenized = await asyncio.to_thread(
+            encoder.encode_batch,
+            [documents[i] for i, _ in to_tokenize],
+            num_threads=min(8, os.cpu_count() or 1),
+        )
+        for (i, key), tokens in zip(to_tokenize, tokenized, strict=True):
+            _cache_token_count(key, len(tokens))
+            if len(tokens) > context_length:
+                await logger.awarning(
+                    f"chunk truncated from {len(tokens)} to {context_length} tokens"
+                )
+                documents[i] = encoder.decode(tokens[:context_length])
+                encoded[i] = documents[i].encode("utf-8")
 
     @override
     async def embed(
-        self, documents: list[str]
-    ) -> AsyncGenerator[list[EmbeddingVector], None]:
+        self, documents: list[str], rate_limiter: RateLimiter | None = None
+    ) -> AsyncGenerator[Embeddings, None]:
         """
         Embeds a list of documents into vectors using OpenAI's embeddings API.
         The documents are first encoded into tokens before being embedded and
@@ -173,28 +282,23 @@ class OpenAI(ApiKeyMixin, BaseURLMixin, BaseModel, Embedder):
 
         Args:
             documents (list[str]): A list of documents to be embedded.
+            rate_limiter (RateLimiter | None): Reserves capacity before every
+                embedding request, when given.
 
         Returns:
-            AsyncGenerator[list[EmbeddingVector], None]: The embeddings for
+            AsyncGenerator[Embeddings, None]: The embeddings for
             each document.
         """
         await logger.adebug(f"Chunks produced: {len(documents)}")
-        encoder = self._encoder
-        context_length = self._context_length
-        if encoder is not None and context_length is not None:
-            # truncate all documents before submitting them to the API
-            for i, document in enumerate(documents):
-                tokenized = encoder.encode(document)
-                tokenized_length = len(tokenized)
-                if tokenized_length > context_length:
-                    await logger.awarning(
-                        f"chunk truncated from {len(tokenized)} to {context_length} tokens"
-                    )
-                    documents[i] = encoder.decode(tokenized[:context_length])
+        encoded = [document.encode("utf-8") for document in documents]
+        # truncate all documents before submitting them to the API
+        await self._truncate(documents, encoded)
         # OpenAIs per batch token limit is using a token estimator instead of actual tokens
-        # So we are reproducing their token counts
-        token_counts = [self._estimate_token_length(document) for document in documents]
-        async for embeddings in self.batch_chunks_and_embed(documents, token_counts):
+        # So we are reproducing their token counts, 0.25 tokens per UTF-8 byte
+        token_counts = [len(document_bytes) * 0.25 for document_bytes in encoded]
+        async for embeddings in self.batch_chunks_and_embed(
+            documents, token_counts, rate_limiter
+        ):
             yield embeddings
 
     @cached_property
@@ -1,4 +1,5 @@
-from collections.abc import AsyncGenerator, Callable
+import asyncio
+from collections.abc import AsyncGenerator
 from typing import Any, Literal
 
 from pydantic import BaseModel
@@ -9,8 +10,13 @@ from ..embeddings import (
     ApiKeyMixin,
     Embedder,
     EmbeddingResponse,
-    EmbeddingVector,
+    Embeddings,
+    RateLimiter,
+    TokenCounter,
     Usage,
+    api_key_digest,
+    cached_token_counter,
+    embedding_clients,
     logger,
 )
 
@@ -30,19 +36,54 @@ def voyage_max_tokens_per_batch(model: str) -> int:
             return 120_000  # Conservative default for specialized and older models
 
 
-def voyage_token_counter(
-    model: str, api_key: str | None = None
-) -> Callable[[str], int] | None:
+def _is_missing_tokenizer(e: Exception) -> bool:
+    """Returns whether loading a tokenizer from the Hugging Face Hub failed
+    because the model has no published tokenizer or access to it is denied,
+    rather than because of a transient error."""
     # Note: deferred import to avoid import overhead
-    import voyageai
+    from huggingface_hub.errors import (
+        EntryNotFoundError,
+        HfHubHTTPError,
+        LocalEntryNotFoundError,
+        RepositoryNotFoundError,
+    )
+
+    if isinstance(e, LocalEntryNotFoundError):
+        # the Hub could not be reached, and the tokenizer isn't cached
+        return False
+    if isinstance(e, (RepositoryNotFoundError, EntryNotFoundError)):
+        return True
+    return (
+        isinstance(e, HfHubHTTPError)
+        and e.response is not None
+        and e.response.status_code in (401, 403, 404)
+    )
+
+
+def voyage_token_counter(model: str, api_key: str | None = None) -> TokenCounter | None:
+    """Returns the token counter of a Voyage AI model, loading its tokenizer
+    on first use, or None if the model has no tokenizer available. Transient
+    errors while loading the tokenizer are raised, and not remembered."""
+
+    def load() -> TokenCounter | None:
+        # Note: deferred import to avoid import overhead
+        import voyageai
+
+        client: voyageai.Client = voyageai.Client(api_key=api_key)
+        try:
+            tokenizer: Tokenizer = client.tokenizer(model)
+        except Exception as e:
+            if not _is_missing_tokenizer(e):
+                raise
+            logger.warn(f"Tokenizer for model '{model}' not found")
+            return None
+
+        def token_counter(texts: list[str]) -> list[int]:
+            return [len(e.tokens) for e in tokenizer.encode_batch(texts)]
 
-    client: voyageai.Client = voyageai.Client(api_key=api_key)
-    try:
-        tokenizer: Tokenizer = client.tokenizer(model)
-        return lambda text: len(tokenizer.encode(text).tokens)
-    except BaseException:
-        logger.warn(f"Tokenizer for model '{model}' not found")
-        return None
+        return token_counter
+
+    return cached_token_counter("voyageai", model, load)
 
 
 class VoyageAI(ApiKeyMixin, BaseModel, Embedder):
@@ -73,25 +114,29 @@ class VoyageAI(ApiKeyMixin, BaseModel, Embedder):
 
     @override
     async def embed(
-        self, documents: list[str]
-    ) -> AsyncGenerator[list[EmbeddingVector], None]:
+        self, documents: list[str], rate_limiter: RateLimiter | None = None
+    ) -> AsyncGenerator[Embeddings, None]:
         """
         Embeds a list of documents into vectors using the VoyageAI embeddings API.
 
         Args:
             documents (list[str]): A list of documents to be embedded.
+            rate_limiter (RateLimiter | None): Reserves capacity before every
+                embedding request, when given.
 
         Returns:
-            Sequence[EmbeddingVector]: The embeddings for each document.
+            Embeddings: The embeddings for each document.
         """
         await logger.adebug(f"Chunks produced: {len(documents)}")
         token_counter = self._token_counter()
         chunk_lengths = (
             [0 for _ in documents]
             if token_counter is None
-            else [token_counter(doc) for doc in documents]
+            else await asyncio.to_thread(token_counter, documents)
         )
-        async for embeddings in self.batch_chunks_and_embed(documents, chunk_lengths):
+        async for embeddings in self.batch_chunks_and_embed(
+            documents, chunk_lengths, rate_limiter
+        ):
             yield embeddings
 
     @override
@@ -102,7 +147,12 @@ class VoyageAI(ApiKeyMixin, BaseModel, Embedder):
     def _max_tokens_per_batch(self) -> int | None:
         return voyage_max_tokens_per_batch(self.model)
 
-    def _token_counter(self) -> Callable[[str], int] | None:
+    @override
+    async def setup(self) -> None:
+        # load the tokenizer off the event loop, once per process
+        await asyncio.to_thread(self._token_counter)
+
+    def _token_counter(self) -> TokenCounter | None:
         return voyage_token_counter(self.model, self._api_key)
 
     @override
@@ -120,7 +170,11 @@ class VoyageAI(ApiKeyMixin, BaseModel, Embedder):
         if self.output_dtype is not None:
             params["output_dtype"] = self.output_dtype
 
-        response = await voyageai.AsyncClient(api_key=self._api_key).embed(
+        client = embedding_clients().get(
+            ("voyageai", api_key_digest(self._api_key)),
+            lambda: voyageai.AsyncClient(api_key=self._api_key),
+        )
+        response = await client.embed(
             documents,
             **params,
         )
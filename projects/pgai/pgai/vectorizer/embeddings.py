@@ -1,15 +1,43 @@
+import asyncio
+import hashlib
+import os
+import threading
 import time
 from abc import ABC, abstractmethod
-from collections.abc import AsyncGenerator
+from collections import deque
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+)
+from contextlib import AbstractAsyncContextManager, asynccontextmanager, nullcontext
 from dataclasses import dataclass
-from typing import TypeAlias
+from functools import cache
+from typing import TYPE_CHECKING, Any, TypeAlias, TypeVar
+from weakref import WeakKeyDictionary
 
 import structlog
 from ddtrace.trace import tracer
 
+from . import metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+    import numpy.typing as npt
+
 logger = structlog.get_logger()
 
 EmbeddingVector: TypeAlias = list[float]
+# One float32 embedding per row. Embedders that can decode the response of the
+# provider straight into an array return this instead of lists of floats, which
+# saves allocating a Python float for every dimension of every embedding.
+EmbeddingMatrix: TypeAlias = "npt.NDArray[np.float32]"
+Embeddings: TypeAlias = "list[EmbeddingVector] | EmbeddingMatrix"
+# Counts the tokens of every chunk of a list, in one call, so that tokenizers
+# can encode the chunks in a batch.
+TokenCounter: TypeAlias = Callable[[list[str]], list[int]]
 
 
 @dataclass
@@ -24,7 +52,7 @@ class Usage:
 class EmbeddingResponse:
     """A generic embedding response"""
 
-    embeddings: list[list[float]]
+    embeddings: Embeddings
     usage: Usage
 
 
@@ -73,28 +101,361 @@ def batch_indices(
     return [(idxs[0], idxs[-1] + 1) for idxs in batches]
 
 
+_token_counters: dict[tuple[str, str], TokenCounter | None] = {}
+# one lock per model, so that loading a tokenizer only holds back the callers
+# waiting for the same one
+_token_counter_locks: dict[tuple[str, str], threading.Lock] = {}
+_token_counter_locks_lock = threading.Lock()
+
+
+def cached_token_counter(
+    provider: str, model: str, load: Callable[[], TokenCounter | None]
+) -> TokenCounter | None:
+    """
+    Returns the token counter of a model, calling `load` to create it on first
+    use. Tokenizers are slow to load, so they are kept for the lifetime of the
+    process and shared by all the embedders of the model. Models without a
+    tokenizer are remembered as well, as None. Errors raised by `load` are
+    not remembered, the next call tries again.
+
+    Args:
+        provider (str): The embedding provider.
+        model (str): The model of the provider.
+        load (Callable[[], TokenCounter | None]): Creates the token counter,
+            or returns None if the model has no tokenizer.
+    """
+    key = (provider, model)
+    try:
+        return _token_counters[key]
+    except KeyError:
+        pass
+    with _token_counter_locks_lock:
+        lock = _token_counter_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _token_counters:
+            _token_counters[key] = load()
+        return _token_counters[key]
+
+
+class ConcurrencyController:
+    """
+    Adapts the number of concurrent requests to an embedding provider to the
+    capacity the provider shows, with additive increase and multiplicative
+    decrease (AIMD).
+
+    The limit starts at one request, and grows by one for every request that
+    completes in good health until the provider first shows signs of overload.
+    From then on it grows by one for every `limit` healthy requests, i.e. by
+    about one request per round of requests. When a request is rejected as
+    rate limited (429) or with a server error (5xx), times out, or takes far
+    longer than usual per chunk, the limit is halved, at most once per round.
+
+    Args:
+        max_limit (int): The largest number of concurrent requests.
+
+    Attributes:
+        limit (float): The current number of concurrent requests allowed.
+        in_flight (int): The number of requests being sent.
+        seconds_per_chunk (float | None): The moving average of the time a
+            request takes per chunk.
+        seconds_per_request (float | None): The moving average of the time a
+            request takes, which is the length of a round.
+    """
+
+    # a request is slow when it takes this many times the average per chunk
+    LATENCY_SPIKE_FACTOR = 3.0
+    # the number of requests to average before judging their latency
+    LATENCY_WARMUP = 10
+    DECREASE_FACTOR = 0.5
+    SMOOTHING = 0.2
+
+    def __init__(self, max_limit: int, provider: str = "", model: str = ""):
+        self.max_limit = max_limit
+        self.provider = provider
+        self.model = model
+        self.limit = 1.0
+        self.in_flight = 0
+        self.seconds_per_chunk: float | None = None
+        self.seconds_per_request: float | None = None
+        self._samples = 0
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._condition: asyncio.Condition | None = None
+
+    @asynccontextmanager
+    async def request(
+        self,
+        chunk_count: int,
+        ready: Callable[[], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[None]:
+        """Waits until a request may be sent, and adjusts the limit to the
+        outcome of the request sent within the context. `ready` is awaited
+        once the request may be sent, before it is timed, e.g. to wait for
+        the rate limits of the provider."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        condition = self._condition
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            if ready is not None:
+                await ready()
+            start_time = time.perf_counter()
+            try:
+                yield
+            except Exception as e:
+                if is_overload_error(e):
+                    self.decrease(str(type(e).__name__))
+                raise
+            else:
+                self.observe(time.perf_counter() - start_time, chunk_count)
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
+
+    def observe(self, duration: float, chunk_count: int) -> None:
+        """Adjusts the limit to a request that succeeded in `duration`."""
+        per_chunk = duration / max(1, chunk_count)
+        spike = (
+            self.seconds_per_chunk is not None
+            and self._samples >= self.LATENCY_WARMUP
+            and per_chunk > self.LATENCY_SPIKE_FACTOR * self.seconds_per_chunk
+        )
+        # slow requests are averaged too, so that the average follows a
+        # provider that stays slower
+        self._samples += 1
+        self.seconds_per_chunk = self._smooth(self.seconds_per_chunk, per_chunk)
+        self.seconds_per_request = self._smooth(self.seconds_per_request, duration)
+        if spike:
+            self.decrease("latency")
+        else:
+            self._set_limit(self.limit + (1 if self._slow_start else 1 / self.limit))
+
+    def _smooth(self, average: float | None, value: float) -> float:
+        if average is None:
+            return value
+        return self.SMOOTHING * value + (1 - self.SMOOTHING) * average
+
+    def decrease(self, reason: str) -> None:
+        """Cuts the limit, unless it was cut during the current round of
+        requests already."""
+        self._slow_start = False
+        now = time.monotonic()
+        if now - self._last_decrease < (self.seconds_per_request or 0):
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit * self.DECREASE_FACTOR, reason)
+
+    def _set_limit(self, limit: float, reason: str | None = None) -> None:
+        previous = int(self.limit)
+        self.limit = max(1.0, min(limit, float(self.max_limit)))
+        metrics.EMBEDDING_CONCURRENCY_LIMIT.set(
+            self.provider, self.model, value=int(self.limit)
+        )
+        if int(self.limit) != previous:
+            # cuts are worth noticing, the steady growth is not
+            log = logger.info if reason is not None else logger.debug
+            log(
+                "adjusted embedding concurrency",
+                provider=self.provider,
+                model=self.model,
+                limit=int(self.limit),
+                previous_limit=previous,
+                reason=reason,
+            )
+
+
+def is_overload_error(e: Exception) -> bool:
+    """Returns whether an error of an embedding request shows that the
+    provider is overloaded: a 429 or 5xx response, or a timeout."""
+    status_code = getattr(e, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return isinstance(e, TimeoutError) or "Timeout" in type(e).__name__
+
+
+# the delay before a request rejected as overloaded is sent again, doubled at
+# every attempt
+OVERLOAD_RETRY_SECONDS = 0.5
+
+
+# the controllers are bound to the event loop they are used in, like the
+# clients, as their condition is
+_concurrency_controllers: WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[tuple[str, str], ConcurrencyController]
+] = WeakKeyDictionary()
+
+
+def concurrency_controller(provider: str, model: str) -> ConcurrencyController | None:
+    """
+    Returns the concurrency controller of a model, shared by all the embedders
+    of the model in the event loop, or None when the
+    PGAI_VECTORIZER_EMBEDDING_MAX_CONCURRENCY environment variable doesn't
+    enable adaptive concurrency.
+    """
+    value = os.getenv("PGAI_VECTORIZER_EMBEDDING_MAX_CONCURRENCY")
+    if not value:
+        return None
+    controllers = _concurrency_controllers.setdefault(asyncio.get_running_loop(), {})
+    key = (provider, model)
+    controller = controllers.get(key)
+    if controller is None:
+        controller = controllers[key] = ConcurrencyController(
+            max(1, int(value)), provider, model
+        )
+    return controller
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class _CachedClient:
+    client: Any
+    close: Callable[[Any], Awaitable[None]] | None
+    last_used: float
+
+
+class ClientCache:
+    """
+    Keeps the clients of the embedding providers, and with them their pools of
+    keep-alive connections, between batches, Executors and poll cycles. The
+    clients are bound to the event loop they are used in, and are dropped once
+    they haven't been used for `idle_timeout` seconds.
+    """
+
+    def __init__(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._clients: WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[Hashable, _CachedClient]
+        ] = WeakKeyDictionary()
+        self._closing: set[asyncio.Task[None]] = set()
+
+    def get(
+        self,
+        key: Hashable,
+        create: Callable[[], T],
+        close: Callable[[T], Awaitable[None]] | None = None,
+    ) -> T:
+        """
+        Returns the client cached under `key`, calling `create` to create it if
+        there is none.
+
+        Args:
+            key (Hashable): Identifies the client, e.g. the implementation, the
+                base URL and the API key.
+            create (Callable[[], T]): Creates the client.
+            close (Callable[[T], Awaitable[None]] | None): Closes the client
+                once it is dropped from the cache.
+        """
+        clients = self._clients.setdefault(asyncio.get_running_loop(), {})
+        now = time.monotonic()
+        self._drop_idle(clients, now)
+        cached = clients.get(key)
+        if cached is None:
+            cached = clients[key] = _CachedClient(create(), close, now)
+        cached.last_used = now
+        return cached.client
+
+    async def setup(self, key: Hashable, setup: Callable[[], Awaitable[None]]) -> None:
+        """
+        Runs `setup` once for `key` until it is dropped from the cache. Callers
+        that come in while it runs wait for it, and a failed setup is run again
+        by the next caller.
+        """
+        key = ("setup", key)
+        task = self.get(key, lambda: asyncio.ensure_future(setup()))
+        try:
+            # a cancelled caller must not cancel the setup of the others
+            await asyncio.shield(task)
+        except BaseException:
+            if task.done():
+                clients = self._clients.get(asyncio.get_running_loop(), {})
+                cached = clients.get(key)
+                if cached is not None and cached.client is task:
+                    del clients[key]
+            raise
+
+    def _drop_idle(self, clients: dict[Hashable, _CachedClient], now: float) -> None:
+        for key, cached in list(clients.items()):
+            if now - cached.last_used <= self.idle_timeout:
+                continue
+            del clients[key]
+            if cached.close is not None:
+                task = asyncio.ensure_future(cached.close(cached.client))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+
+
+@cache
+def embedding_clients() -> ClientCache:
+    """
+    The clients of the embedding providers of the process. They are dropped
+    after PGAI_VECTORIZER_EMBEDDING_CLIENT_IDLE_TIMEOUT seconds without use,
+    by default 10 minutes.
+    """
+    idle_timeout = float(
+        os.getenv("PGAI_VECTORIZER_EMBEDDING_CLIENT_IDLE_TIMEOUT", default="600")
+    )
+    return ClientCache(idle_timeout)
+
+
+def api_key_digest(api_key: str | None) -> bytes | None:
+    """Identifies an API key in cache keys, without keeping the key itself."""
+    return None if api_key is None else hashlib.sha256(api_key.encode()).digest()
+
+
+class RateLimiter(ABC):
+    """Holds embedding requests back to stay within the rate limits of the
+    embedding provider."""
+
+    @abstractmethod
+    async def reserve(self, requests: int, tokens: float) -> None:
+        """
+        Reserves the capacity for a request, and returns once the request can
+        be sent.
+
+        Args:
+            requests (int): The number of requests.
+            tokens (float): The estimated number of tokens of the requests.
+        """
+
+
 class Embedder(ABC):
     """
     Abstract base class for an Embedder.
 
     This class defines the interface for embedding text documents into vectors
     or returning embedding errors.
+
+    Attributes:
+        _overload_retries (int): The number of times a request rejected as
+            overloaded is sent again through the concurrency controller, with
+            adaptive concurrency.
     """
 
+    _overload_retries: int = 0
+
     @abstractmethod
     async def embed(
-        self, documents: list[str]
-    ) -> AsyncGenerator[list[EmbeddingVector], None]:
+        self, documents: list[str], rate_limiter: RateLimiter | None = None
+    ) -> AsyncGenerator[Embeddings, None]:
         """
         Embeds a list of documents into vectors.
 
         Args:
             documents (list[str]): A list of strings representing the documents
             to be embedded.
+            rate_limiter (RateLimiter | None): Reserves capacity before every
+                embedding request, when given.
 
         Returns:
-            AsyncGenerator[list[EmbeddingVector], None]: A sequence of
-            embedding vectors.
+            AsyncGenerator[Embeddings, None]: A sequence of embedding vectors,
+            either as lists of floats or as rows of a float32 matrix.
         """
         raise NotImplementedError
         yield ""  # https://github.com/microsoft/pyright/issues/9949
@@ -113,6 +474,29 @@ class Embedder(ABC):
         """
         return None
 
+    def _max_in_flight(self) -> int:
+        """
+        The maximum number of embedding API calls of a single work batch that
+        are sent concurrently. Defaults to 1, i.e. requests are sent one after
+        the other.
+        :return: int: the max number of concurrent requests
+        """
+        max_in_flight = max(
+            1, int(os.getenv("PGAI_VECTORIZER_EMBEDDING_MAX_IN_FLIGHT", default="1"))
+        )
+        # With adaptive concurrency, the requests are held back by the
+        # controller instead
+        controller = self._concurrency_controller()
+        if controller is not None:
+            return max(max_in_flight, controller.max_limit)
+        return max_in_flight
+
+    def _concurrency_controller(self) -> ConcurrencyController | None:
+        return concurrency_controller(
+            getattr(self, "implementation", type(self).__name__),
+            getattr(self, "model", ""),
+        )
+
     async def setup(self) -> None:  # noqa: B027 empty on purpose
         """
         Setup the embedder
@@ -127,8 +511,11 @@ class Embedder(ABC):
         """
 
     async def batch_chunks_and_embed(
-        self, documents: list[str], token_counts: list[float] | list[int]
-    ) -> AsyncGenerator[list[EmbeddingVector], None]:
+        self,
+        documents: list[str],
+        token_counts: list[float] | list[int],
+        rate_limiter: RateLimiter | None = None,
+    ) -> AsyncGenerator[Embeddings, None]:
         """
         Performs the actual embedding of encoded documents by sending requests
         to the embedding API.
@@ -136,9 +523,11 @@ class Embedder(ABC):
         Args:
             documents (list[str]): A list of documents.
             token_counts (list[float]): A list of token count for each document, or 0
+            rate_limiter (RateLimiter | None): Reserves capacity before every
+                request, when given.
         Returns:
-            AsyncGenerator[list[EmbeddingVector], None]: A list of embedding vectors
-            for each document.
+            AsyncGenerator[Embeddings, None]: The embedding vectors of each
+            request, in the order of the documents.
         """
         assert len(documents) == len(token_counts)
         max_chunks_per_batch = self._max_chunks_per_batch()
@@ -149,6 +538,7 @@ class Embedder(ABC):
             max_tokens_per_batch=max_tokens_per_batch,
         )
         num_batches = len(batches)
+        max_in_flight = self._max_in_flight()
 
         total_duration = 0.0
         embedding_stats = EmbeddingStats()
@@ -157,38 +547,41 @@ class Embedder(ABC):
             if current_span:
                 current_span.set_tag("batches.total", num_batches)
                 current_span.set_tag("tokens.total", sum(token_counts))
-            for i, (start, end) in enumerate(batches):
-                batch_num = i + 1
-                batch = documents[start:end]
-
-                await logger.adebug(f"Batch {batch_num} of {num_batches}")
-                await logger.adebug(f"Chunks for this batch: {len(batch)}")
-                await logger.adebug(f"Request {batch_num} of {num_batches} initiated")
-                with tracer.trace("embeddings.do.embedder.create"):
-                    current_span = tracer.current_span()
-                    if current_span:
-                        current_span.set_tag("batch.id", batch_num)
-                        current_span.set_tag("batch.chunks.total", len(batch))
-                        current_span.set_tag(
-                            "batch.tokens.total", sum(token_counts[start:end])
-                        )
-                    start_time = time.perf_counter()
-                    response_ = await self.call_embed_api(batch)
-                    request_duration = time.perf_counter() - start_time
-                    if current_span:
-                        current_span.set_metric(
-                            "embeddings.embedder.create_request.time.seconds",
-                            request_duration,
+                current_span.set_tag("batches.max_in_flight", max_in_flight)
+            # Up to max_in_flight requests are running at any time. Results are
+            # awaited and yielded in submission order, so callers can pair
+            # them with their documents positionally.
+            in_flight: deque[asyncio.Task[tuple[Embeddings, float]]] = deque()
+            pending = iter(enumerate(batches))
+            try:
+                while True:
+                    while len(in_flight) < max_in_flight:
+                        next_batch = next(pending, None)
+                        if next_batch is None:
+                            break
+                        i, (start, end) = next_batch
+                        in_flight.append(
+                            asyncio.create_task(
+                                self._embed_batch(
+                                    i + 1,
+                                    num_batches,
+                                    documents[start:end],
+                                    sum(token_counts[start:end]),
+                                    rate_limiter,
+                                )
+                            )
                         )
-
-                    await logger.adebug(
-                        f"Request {batch_num} of {num_batches} "
-                        f"ended after: {request_duration} seconds. "
-                        f"Tokens usage: {response_.usage}"
-                    )
+                    if not in_flight:
+                        break
+                    embeddings, request_duration = await in_flight.popleft()
                     total_duration += request_duration
-
-                    yield response_.embeddings
+                    yield embeddings
+            finally:
+                for task in in_flight:
+                    task.cancel()
+                # Wait for the cancelled requests to unwind, so they release
+                # their concurrency slots before the caller moves on
+                await asyncio.gather(*in_flight, return_exceptions=True)
 
             embedding_stats.add_request_time(total_duration, len(documents))
             await embedding_stats.print_stats()
@@ -207,6 +600,94 @@ class Embedder(ABC):
                     embedding_stats.chunks_per_second(),
                 )
 
+    async def _embed_batch(
+        self,
+        batch_num: int,
+        num_batches: int,
+        batch: list[str],
+        tokens: float,
+        rate_limiter: RateLimiter | None = None,
+    ) -> tuple[Embeddings, float]:
+        """
+        Sends a single embedding request for one batch of chunks.
+
+        Returns:
+            tuple[Embeddings, float]: The embeddings of the batch and
+            the duration of the request in seconds.
+        """
+        await logger.adebug(f"Batch {batch_num} of {num_batches}")
+        await logger.adebug(f"Chunks for this batch: {len(batch)}")
+        await logger.adebug(f"Request {batch_num} of {num_batches} initiated")
+        with tracer.trace("embeddings.do.embedder.create"):
+            current_span = tracer.current_span()
+            if current_span:
+                current_span.set_tag("batch.id", batch_num)
+                current_span.set_tag("batch.chunks.total", len(batch))
+                current_span.set_tag("batch.tokens.total", tokens)
+            provider = getattr(self, "implementation", type(self).__name__)
+            model = getattr(self, "model", "")
+
+            async def wait_for_rate_limits() -> None:
+                if rate_limiter is not None:
+                    await rate_limiter.reserve(1, tokens)
+
+            # The capacity is reserved once the request may be sent, so that
+            # it isn't used up by requests waiting for their turn
+            controller = self._concurrency_controller()
+            attempt = 0
+            while True:
+                concurrency_limit: AbstractAsyncContextManager[None]
+                if controller is None:
+                    await wait_for_rate_limits()
+                    concurrency_limit = nullcontext()
+                else:
+                    concurrency_limit = controller.request(
+                        len(batch), ready=wait_for_rate_limits
+                    )
+                try:
+                    async with concurrency_limit:
+                        metrics.EMBEDDING_REQUESTS.inc(provider, model)
+                        start_time = time.perf_counter()
+                        try:
+                            response_ = await self.call_embed_api(batch)
+                        except Exception:
+                            metrics.EMBEDDING_REQUEST_ERRORS.inc(provider, model)
+                            raise
+                        request_duration = time.perf_counter() - start_time
+                    break
+                except Exception as e:
+                    if (
+                        controller is None
+                        or attempt >= self._overload_retries
+                        or not is_overload_error(e)
+                    ):
+                        raise
+                # retried through the controller, which just cut the limit
+                attempt += 1
+                await asyncio.sleep(OVERLOAD_RETRY_SECONDS * 2 ** (attempt - 1))
+            metrics.EMBEDDING_REQUEST_DURATION.observe(
+                provider, model, value=request_duration
+            )
+            metrics.EMBEDDING_CHUNKS.inc(provider, model, amount=len(batch))
+            metrics.EMBEDDING_TOKENS.inc(
+                provider, model, "prompt", amount=response_.usage.prompt_tokens
+            )
+            metrics.EMBEDDING_TOKENS.inc(
+                provider, model, "total", amount=response_.usage.total_tokens
+            )
+            if current_span:
+                current_span.set_metric(
+                    "embeddings.embedder.create_request.time.seconds",
+                    request_duration,
+                )
+
+            await logger.adebug(
+                f"Request {batch_num} of {num_batches} "
+                f"ended after: {request_duration} seconds. "
+                f"Tokens usage: {response_.usage}"
+            )
+        return response_.embeddings, request_duration
+
 
 class BaseURLMixin:
     """
@@ -16,12 +16,20 @@ class Features:
         has_loading_retries: bool,
         has_reveal_secret_function: bool,
         has_vectorizer_errors_view: bool,
+        has_queue_leases: bool,
+        has_vectorizer_notifications: bool,
+        has_queue_shards: bool,
+        has_embedding_rate_limits: bool,
     ) -> None:
         self.has_disabled_column = has_disabled_column
         self.has_worker_tracking_table = has_worker_tracking_table
         self.has_loading_retries = has_loading_retries
         self.has_reveal_secret_function = has_reveal_secret_function
         self.has_vectorizer_errors_view = has_vectorizer_errors_view
+        self.has_queue_leases = has_queue_leases
+        self.has_vectorizer_notifications = has_vectorizer_notifications
+        self.has_queue_shards = has_queue_shards
+        self.has_embedding_rate_limits = has_embedding_rate_limits
 
     @classmethod
     def from_db(cls: type[Self], cur: psycopg.Cursor) -> Self:
@@ -74,21 +82,70 @@ class Features:
         cur.execute(query)
         has_vectorizer_errors_view = cur.fetchone() is not None
 
+        # Queue tables have lease columns since processing_default accepts
+        # the lease_seconds argument.
+        query = """
+        SELECT p.proname
+        FROM pg_proc p
+        JOIN pg_namespace n ON p.pronamespace = n.oid
+        WHERE p.proname = 'processing_default'
+        AND n.nspname = 'ai'
+        AND 'lease_seconds' = ANY(p.proargnames)
+        """
+        cur.execute(query)
+        has_queue_leases = cur.fetchone() is not None
+
+        query = """
+        SELECT p.proname
+        FROM pg_proc p
+        JOIN pg_namespace n ON p.pronamespace = n.oid
+        WHERE p.proname = '_vectorizer_notify_change'
+        AND n.nspname = 'ai'
+        """
+        cur.execute(query)
+        has_vectorizer_notifications = cur.fetchone() is not None
+
+        # Workers can split the queues between them since the
+        # ai._worker_shard function exists.
+        query = """
+        SELECT p.proname
+        FROM pg_proc p
+        JOIN pg_namespace n ON p.pronamespace = n.oid
+        WHERE p.proname = '_worker_shard'
+        AND n.nspname = 'ai'
+        """
+        cur.execute(query)
+        has_queue_shards = cur.fetchone() is not None
+
+        query = """
+        SELECT p.proname
+        FROM pg_proc p
+        JOIN pg_namespace n ON p.pronamespace = n.oid
+        WHERE p.proname = '_reserve_embedding_capacity'
+        AND n.nspname = 'ai'
+        """
+        cur.execute(query)
+        has_embedding_rate_limits = cur.fetchone() is not None
+
         return cls(
             has_disabled_column,
             has_worker_tracking_table,
             has_loading_retries,
             has_reveal_secret_function,
             has_vectorizer_errors_view,
+            has_queue_leases,
+            has_vectorizer_notifications,
+            has_queue_shards,
+            has_embedding_rate_limits,
         )
 
     @classmethod
     def for_testing_latest_version(cls: type[Self]) -> Self:
-        return cls(True, True, True, True, True)
+        return cls(True, True, True, True, True, True, True, True, True)
 
     @classmethod
     def for_testing_no_features(cls: type[Self]) -> Self:
-        return cls(False, False, False, False, False)
+        return cls(False, False, False, False, False, False, False, False, False)
 
     @cached_property
     def disable_vectorizers(self) -> bool:
@@ -117,3 +174,42 @@ class Features:
     def db_reveal_secrets(self) -> bool:
         """If the db has the `reveal_secret` function."""
         return self.has_reveal_secret_function
+
+    @cached_property
+    def queue_leases(self) -> bool:
+        """If the queue tables support lease-based claiming.
+
+        The feature consists of the `lease_id` and `lease_expires_at` columns
+        in the queue tables, and the `lease_seconds` processing setting.
+        """
+        return self.has_queue_leases
+
+    @cached_property
+    def vectorizer_notifications(self) -> bool:
+        """If the database notifies workers about vectorizer changes.
+
+        The queue triggers notify the `ai_vectorizer_queue` channel when they
+        queue work, and changes to `ai.vectorizer` rows notify the
+        `ai_vectorizer_config` channel.
+        """
+        return self.has_vectorizer_notifications
+
+    @cached_property
+    def queue_shards(self) -> bool:
+        """If workers can claim queue items in shards.
+
+        The feature consists of the `ai._worker_shard` function assigning each
+        live worker its share of the hashes of the primary keys. The workers
+        index the queue tables on the hash when they claim work in shards.
+        """
+        return self.has_queue_shards
+
+    @cached_property
+    def embedding_rate_limits(self) -> bool:
+        """If workers share the rate limits of embedding providers.
+
+        The feature consists of the `ai.embedding_rate_limit` table, and the
+        `ai._reserve_embedding_capacity` function reserving capacity in it
+        before every embedding request.
+        """
+        return self.has_embedding_rate_limits
@@ -1,21 +1,75 @@
+import datetime
 import os
+import tempfile
+import threading
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import cached_property
 from io import BytesIO
-from typing import Any, Literal
+from typing import IO, Any, Literal
 from urllib.parse import urlparse
 
 from filetype import filetype  # type: ignore
 from pydantic import BaseModel
+from typing_extensions import override
+
+# Downloads are copied in chunks of this size
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def _spool_max_size() -> int:
+    """The size in bytes up to which a downloaded document is kept in memory,
+    from the PGAI_VECTORIZER_LOADING_SPOOL_MAX_SIZE environment variable."""
+    value = os.getenv("PGAI_VECTORIZER_LOADING_SPOOL_MAX_SIZE")
+    return int(value) if value else 32 * 1024 * 1024
 
 
 @dataclass
 class LoadedDocument:
-    content: BytesIO
+    """
+    A loaded document. Large documents are spooled to a temporary file, whose
+    path is in `spool_path`, so that parsers can open them from disk instead
+    of reading them into memory. The file is deleted when `content` is closed.
+    """
+
+    content: IO[bytes]
     file_path: str | None = None
     file_type: str | None = None
+    spool_path: str | None = None
 
+    def close(self) -> None:
+        self.content.close()
 
-def guess_filetype(file_like: BytesIO, file_path: str | None = None) -> str | None:
+
+def spool(source: IO[bytes], suffix: str = "") -> tuple[IO[bytes], str | None]:
+    """
+    Copies the source in chunks, in memory up to
+    PGAI_VECTORIZER_LOADING_SPOOL_MAX_SIZE bytes and to a temporary file past
+    that, so the memory a document takes stays bounded whatever its size.
+
+    Returns:
+        The rewound copy, and the path of the temporary file if there is one.
+    """
+    max_size = _spool_max_size()
+    buffer = BytesIO()
+    spooled = None
+    while chunk := source.read(SPOOL_CHUNK_SIZE):
+        if spooled is None and buffer.tell() + len(chunk) > max_size:
+            # deleted when closed
+            spooled = tempfile.NamedTemporaryFile(prefix="pgai-", suffix=suffix)  # noqa: SIM115
+            spooled.write(buffer.getvalue())
+            buffer = BytesIO()
+        (buffer if spooled is None else spooled).write(chunk)
+    if spooled is None:
+        buffer.seek(0)
+        return buffer, None
+    spooled.seek(0)
+    return spooled, spooled.name
+
+
+def guess_filetype(file_like: IO[bytes], file_path: str | None = None) -> str | None:
     guess = filetype.guess(file_like)  # type: ignore[reportUnknownArgumentType,reportUnknownMemberType]
     file_like.seek(0)
     if guess is not None:
@@ -48,6 +102,118 @@ class ColumnLoading(BaseModel):
             )
         return content
 
+    def load_many(
+        self, rows: Iterable[dict[str, str]]
+    ) -> Iterator[str | LoadedDocument | Exception]:
+        """Loads the given rows one after the other. Yields the loaded values,
+        or the exception that failed the loading of a value."""
+        for row in rows:
+            try:
+                yield self.load(row)
+            except Exception as e:
+                yield e
+
+
+# Assumed-role credentials are refreshed this long before they expire
+CREDENTIALS_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def _max_downloads() -> int:
+    """The number of documents a process downloads at once, from the
+    PGAI_VECTORIZER_LOADING_MAX_IN_FLIGHT environment variable."""
+    value = os.getenv("PGAI_VECTORIZER_LOADING_MAX_IN_FLIGHT")
+    return max(1, int(value)) if value else 8
+
+
+class _Clients:
+    """
+    The S3 clients and HTTP sessions shared by all the documents a process
+    loads, so that their connection pools are reused. S3 clients that use
+    the credentials of an assumed role are replaced shortly before the
+    credentials expire.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._s3_clients: dict[str | None, tuple[Any, datetime.datetime | None]] = {}
+        self._http = threading.local()
+        self._downloads: ThreadPoolExecutor | None = None
+
+    def s3_client(self, aws_role_arn: str | None) -> Any:
+        # Note: deferred import to avoid import overhead
+        import boto3
+
+        with self._lock:
+            cached = self._s3_clients.get(aws_role_arn)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if cached is not None and (cached[1] is None or now < cached[1]):
+                return cached[0]
+
+            if aws_role_arn is None:
+                client, expires_at = boto3.client("s3"), None  # type: ignore
+            else:
+                client, expires_at = self._assume_role(aws_role_arn)
+            self._s3_clients[aws_role_arn] = (client, expires_at)
+            return client
+
+    @staticmethod
+    def _assume_role(aws_role_arn: str) -> tuple[Any, datetime.datetime]:
+        # Note: deferred import to avoid import overhead
+        import boto3
+        from mypy_boto3_s3.client import S3Client
+        from mypy_boto3_sts.client import STSClient
+
+        external_id = os.getenv("AWS_ASSUME_ROLE_EXTERNAL_ID")
+        sts_client: STSClient = boto3.client("sts")  # type: ignore
+        kwargs: dict[str, Any] = {}
+        if external_id is not None:
+            kwargs["ExternalId"] = external_id
+        assumed_role = sts_client.assume_role(
+            RoleArn=aws_role_arn,
+            RoleSessionName="timescale-vectorizer",
+            **kwargs,
+        )
+        # Extract the temporary credentials
+        credentials = assumed_role["Credentials"]
+
+        # Create a boto3 session with the assumed role credentials
+        session = boto3.Session(
+            aws_access_key_id=credentials["AccessKeyId"],
+            aws_secret_access_key=credentials["SecretAccessKey"],
+            aws_session_token=credentials["SessionToken"],
+        )
+
+        # Create an S3 client using the session with assumed role
+        s3_client: S3Client = session.client("s3")  # type: ignore
+        return s3_client, credentials["Expiration"] - CREDENTIALS_REFRESH_MARGIN
+
+    def http_session(self) -> Any:
+        # requests sessions aren't thread-safe, so each thread has its own
+        session = getattr(self._http, "session", None)
+        if session is None:
+            # Note: deferred import to avoid import overhead
+            import requests
+
+            session = self._http.session = requests.Session()
+        return session
+
+    @cached_property
+    def max_downloads(self) -> int:
+        """The number of documents downloaded at once, read once so that the
+        size of the download threads and the bound of `load_many` agree."""
+        return _max_downloads()
+
+    def downloads(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._downloads is None:
+                self._downloads = ThreadPoolExecutor(
+                    max_workers=self.max_downloads, thread_name_prefix="pgai-loading"
+                )
+            return self._downloads
+
+
+_clients = _Clients()
+
 
 class UriLoading(BaseModel):
     implementation: Literal["uri"]
@@ -57,49 +223,68 @@ class UriLoading(BaseModel):
 
     def load(self, row: dict[str, str]) -> LoadedDocument:
         # Note: deferred import to avoid import overhead
-        import boto3
         import smart_open  # type: ignore
-        from mypy_boto3_s3.client import S3Client
-        from mypy_boto3_sts.client import STSClient
 
         file_path = row[self.column_name]
 
         transport_params = None
-        if file_path.startswith("s3://") and self.aws_role_arn is not None:
-            external_id = os.getenv("AWS_ASSUME_ROLE_EXTERNAL_ID")
-            sts_client: STSClient = boto3.client("sts")  # type: ignore
-            kwargs: dict[str, Any] = {}
-            if external_id is not None:
-                kwargs["ExternalId"] = external_id
-            assumed_role = sts_client.assume_role(
-                RoleArn=self.aws_role_arn,
-                RoleSessionName="timescale-vectorizer",
-                **kwargs,
-            )
-            # Extract the temporary credentials
-            credentials = assumed_role["Credentials"]
-
-            # Create a boto3 session with the assumed role credentials
-            session = boto3.Session(
-                aws_access_key_id=credentials["AccessKeyId"],
-                aws_secret_access_key=credentials["SecretAccessKey"],
-                aws_session_token=credentials["SessionToken"],
-            )
-
-            # Create an S3 client using the session with assumed role
-            s3_client: S3Client = session.client("s3")  # type: ignore
-            transport_params = {"client": s3_client}
-        content = BytesIO(
-            smart_open.open(  # type: ignore
-                file_path, "rb", transport_params=transport_params
-            ).read()
-        )
+        scheme = urlparse(file_path).scheme
+        if scheme == "s3":
+            transport_params = {"client": _clients.s3_client(self.aws_role_arn)}
+        elif scheme in ("http", "https"):
+            transport_params = {"session": _clients.http_session()}
+        _, suffix = os.path.splitext(urlparse(file_path).path)
+        with smart_open.open(  # type: ignore
+            file_path, "rb", transport_params=transport_params
+        ) as source:  # type: ignore
+            content, spool_path = spool(source, suffix)  # type: ignore
         return LoadedDocument(
             content=content,
             file_path=file_path,
             file_type=guess_filetype(content, file_path),
+            spool_path=spool_path,
         )
 
+    def load_many(
+        self, rows: Iterable[dict[str, str]]
+    ) -> Iterator[LoadedDocument | Exception]:
+        """
+        Loads the documents of the given rows, downloading up to
+        PGAI_VECTORIZER_LOADING_MAX_IN_FLIGHT documents at once. Yields the
+        documents in the order of the rows, or the exception that failed the
+        loading of a document.
+        """
+        downloads = _clients.downloads()
+        max_in_flight = _clients.max_downloads
+        in_flight: deque[Future[LoadedDocument]] = deque()
+        try:
+            for row in rows:
+                in_flight.append(downloads.submit(self.load, row))
+                # don't download further ahead than the documents being processed
+                if len(in_flight) >= max_in_flight:
+                    yield _result(in_flight.popleft())
+            while in_flight:
+                yield _result(in_flight.popleft())
+        finally:
+            # When the caller stops early, the documents it won't get are
+            # closed, deleting their spool files, once they are loaded
+            for future in in_flight:
+                if not future.cancel():
+                    future.add_done_callback(_close_result)
+
+
+def _result(future: Future[LoadedDocument]) -> LoadedDocument | Exception:
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+
+def _close_result(future: Future[LoadedDocument]) -> None:
+    document = _result(future)
+    if isinstance(document, LoadedDocument):
+        document.close()
+
 
 class LoadingError(Exception):
     """
@@ -111,3 +296,14 @@ class LoadingError(Exception):
         self.__cause__ = e
 
     msg = "loading failed"
+
+    @override
+    def __reduce__(self) -> tuple[Any, ...]:
+        # Loading errors are sent back from the processes that prepare
+        # documents. The cause may not be picklable, but only its message is
+        # needed to record the error.
+        return _rebuild_loading_error, (self.args, str(self.__cause__))
+
+
+def _rebuild_loading_error(args: tuple[str, ...], cause: str) -> LoadingError:
+    return LoadingError(*args, e=Exception(cause))
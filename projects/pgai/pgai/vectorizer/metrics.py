@@ -0,0 +1,418 @@
+"""
+Metrics of the vectorizer worker, exposed in the Prometheus text format.
+
+The metrics are collected in process, and served over HTTP by `serve_metrics`
+when the worker is started with a metrics port. Only counters, gauges and
+histograms are implemented, as far as the worker needs them, so that exposing
+metrics doesn't add a dependency to the worker.
+"""
+
+import asyncio
+import math
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Iterator, Sequence
+
+import structlog
+
+logger = structlog.get_logger()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Seconds, from a quick database round-trip to a slow embedding request
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# Items or chunks per batch, up to the largest batch size
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2048, 5000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric(ABC):
+    """
+    A family of samples sharing a name, one per combination of label values.
+
+    Args:
+        name (str): The name of the metric, without the `_total` suffix of
+            counters.
+        documentation (str): The help text of the metric.
+        labelnames (Sequence[str]): The names of the labels.
+    """
+
+    type: str
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labelvalues: Sequence[object]) -> tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {labelvalues}"
+            )
+        return tuple(str(value) for value in labelvalues)
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        """Yields the samples of the metric as (suffix, label names, label
+        values, value)."""
+        raise NotImplementedError
+
+    def render(self, openmetrics: bool = False) -> str:
+        """Renders the metric in the Prometheus text format, or in the
+        OpenMetrics format."""
+        name = self.name
+        if self.type == "counter" and not openmetrics:
+            name = f"{self.name}_total"
+        lines = [
+            f"# HELP {name} {self.documentation}",
+            f"# TYPE {name} {self.type}",
+        ]
+        for suffix, names, values, value in self.samples():
+            labels = _format_labels(names, values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only goes up, such as the number of items processed."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: object, amount: float = 1) -> None:
+        """Increments the counter of the given label values by `amount`."""
+        if amount < 0:
+            raise ValueError("counters can only be incremented")
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labelvalues: object) -> float:
+        return self._values.get(self._key(labelvalues), 0)
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "_total", self.labelnames, key, value
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as the current batch size."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, *labelvalues: object, value: float) -> None:
+        """Sets the gauge of the given label values to `value`."""
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, *labelvalues: object) -> float:
+        return self._values.get(self._key(labelvalues), 0)
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", self.labelnames, key, value
+
+
+class Histogram(Metric):
+    """
+    Counts observed values, such as durations, in cumulative buckets.
+
+    Args:
+        buckets (Sequence[float]): The upper bounds of the buckets, in
+            increasing order. A bucket for all values is added.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = (*buckets, math.inf)
+        # per label values: the count of each bucket, and the sum
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, *labelvalues: object, value: float) -> None:
+        """Adds `value` to the histogram of the given label values."""
+        key = self._key(labelvalues)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def get_count(self, *labelvalues: object) -> int:
+        counts, _ = self._values.get(self._key(labelvalues), ([0], 0.0))
+        return sum(counts)
+
+    def get_sum(self, *labelvalues: object) -> float:
+        _, total = self._values.get(self._key(labelvalues), ([0], 0.0))
+        return total
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        with self._lock:
+            values = [
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            ]
+        names = (*self.labelnames, "le")
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                yield "_bucket", names, (*key, _format_value(bound)), cumulative
+            yield "_count", self.labelnames, key, cumulative
+            yield "_sum", self.labelnames, key, total
+
+
+class Registry:
+    """The metrics exposed by the worker."""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self, openmetrics: bool = False) -> str:
+        """Renders all metrics in the Prometheus text format, or in the
+        OpenMetrics format."""
+        text = "".join(metric.render(openmetrics) for metric in self.metrics)
+        if openmetrics:
+            text += "# EOF\n"
+        return text
+
+
+REGISTRY = Registry()
+
+
+STAGE_DURATION = Histogram(
+    "pgai_vectorizer_stage_duration_seconds",
+    "Time spent per batch in each processing stage: fetch, load, parse, chunk, "
+    "embed and write.",
+    ["vectorizer_id", "stage"],
+)
+BATCH_ITEMS = Histogram(
+    "pgai_vectorizer_batch_items",
+    "Number of queue items per processed batch.",
+    ["vectorizer_id"],
+    buckets=SIZE_BUCKETS,
+)
+BATCH_CHUNKS = Histogram(
+    "pgai_vectorizer_batch_chunks",
+    "Number of embedded chunks per processed batch.",
+    ["vectorizer_id"],
+    buckets=SIZE_BUCKETS,
+)
+BATCH_DURATION = Histogram(
+    "pgai_vectorizer_batch_duration_seconds",
+    "Time taken to process a batch, from claiming to committing it, leaving"
+    " out the time a pipelined batch waits between stages.",
+    ["vectorizer_id"],
+)
+BATCH_SIZE = Gauge(
+    "pgai_vectorizer_batch_size",
+    "Number of queue items claimed for the next batch.",
+    ["vectorizer_id"],
+)
+ITEMS = Counter(
+    "pgai_vectorizer_items",
+    "Queue items processed.",
+    ["vectorizer_id"],
+)
+CHUNKS = Counter(
+    "pgai_vectorizer_chunks",
+    "Chunks written with their embedding.",
+    ["vectorizer_id"],
+)
+LOADING_RETRIES = Counter(
+    "pgai_vectorizer_loading_retries",
+    "Queue items requeued after failing to load.",
+    ["vectorizer_id"],
+)
+LOADING_FAILURES = Counter(
+    "pgai_vectorizer_loading_failures",
+    "Queue items moved to the failed queue after running out of retries.",
+    ["vectorizer_id"],
+)
+ERRORS = Counter(
+    "pgai_vectorizer_errors",
+    "Runs of a vectorizer that stopped with an error, by kind of error.",
+    ["vectorizer_id", "kind"],
+)
+DEDUPLICATED_CHUNKS = Counter(
+    "pgai_vectorizer_deduplicated_chunks",
+    "Chunks that were not sent to the embedding provider, as their text was "
+    "embedded for another chunk of the batch, or found in the embedding cache.",
+    ["vectorizer_id", "source"],
+)
+EMBEDDING_REQUESTS = Counter(
+    "pgai_embedding_requests",
+    "Requests sent to the embedding provider.",
+    ["provider", "model"],
+)
+EMBEDDING_REQUEST_ERRORS = Counter(
+    "pgai_embedding_request_errors",
+    "Requests to the embedding provider that failed, after the retries of the "
+    "provider's client.",
+    ["provider", "model"],
+)
+EMBEDDING_REQUEST_DURATION = Histogram(
+    "pgai_embedding_request_duration_seconds",
+    "Time taken by successful requests to the embedding provider.",
+    ["provider", "model"],
+)
+EMBEDDING_RATE_LIMIT_WAIT = Counter(
+    "pgai_embedding_rate_limit_wait_seconds",
+    "Time requests to the embedding provider were held back to stay within "
+    "the shared rate limits.",
+    ["provider", "model"],
+)
+EMBEDDING_CONCURRENCY_LIMIT = Gauge(
+    "pgai_embedding_concurrency_limit",
+    "Number of concurrent requests to the embedding provider allowed by the "
+    "adaptive concurrency controller.",
+    ["provider", "model"],
+)
+EMBEDDING_CHUNKS = Counter(
+    "pgai_embedding_chunks",
+    "Chunks embedded by the embedding provider.",
+    ["provider", "model"],
+)
+EMBEDDING_TOKENS = Counter(
+    "pgai_embedding_tokens",
+    "Tokens used by the embedding provider, as reported in its responses.",
+    ["provider", "model", "kind"],
+)
+
+for _metric in (
+    STAGE_DURATION,
+    BATCH_ITEMS,
+    BATCH_CHUNKS,
+    BATCH_DURATION,
+    BATCH_SIZE,
+    ITEMS,
+    CHUNKS,
+    LOADING_RETRIES,
+    LOADING_FAILURES,
+    ERRORS,
+    DEDUPLICATED_CHUNKS,
+    EMBEDDING_REQUESTS,
+    EMBEDDING_REQUEST_ERRORS,
+    EMBEDDING_REQUEST_DURATION,
+    EMBEDDING_RATE_LIMIT_WAIT,
+    EMBEDDING_CONCURRENCY_LIMIT,
+    EMBEDDING_CHUNKS,
+    EMBEDDING_TOKENS,
+):
+    REGISTRY.register(_metric)
+
+
+async def _handle_request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    try:
+        request_line = await reader.readline()
+        accept = ""
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "accept":
+                accept = value.strip()
+        method, path, *_ = request_line.decode("latin-1").split(" ") + ["", ""]
+        if method != "GET" or path.split("?")[0] not in ("/metrics", "/"):
+            status = "404 Not Found"
+            content_type = "text/plain; charset=utf-8"
+            body = b"not found\n"
+        else:
+            openmetrics = "application/openmetrics-text" in accept
+            status = "200 OK"
+            content_type = (
+                OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE
+            )
+            body = REGISTRY.render(openmetrics).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(port: int, host: str = "0.0.0.0") -> asyncio.Server:
+    """
+    Serves the metrics over HTTP at `/metrics` until the returned server is
+    closed. The format is chosen from the Accept header of the request:
+    OpenMetrics if asked for, else the Prometheus text format.
+
+    Args:
+        port (int): The port to listen on. 0 picks a free port.
+        host (str): The address to listen on.
+    """
+    server = await asyncio.start_server(_handle_request, host, port)
+    await logger.ainfo(
+        "serving metrics",
+        address=[socket.getsockname() for socket in server.sockets],
+    )
+    return server
@@ -1,4 +1,5 @@
 import os
+import threading
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Any, Literal
@@ -64,7 +65,8 @@ class BaseDocumentParsing(BaseModel, ABC):
             raise ValueError("No file extension could be determined")
 
         if payload.file_type in ["txt", "md"]:
-            return payload.content.getvalue().decode("utf-8")
+            payload.content.seek(0)
+            return payload.content.read().decode("utf-8")
 
         return self.parse_doc(row, payload)
 
@@ -87,9 +89,14 @@ class ParsingPyMuPDF(BaseDocumentParsing):
         import pymupdf  # type: ignore
         import pymupdf4llm  # type: ignore
 
-        with pymupdf.open(
-            stream=payload.content, filetype=payload.file_type
-        ) as pdf_document:  # type: ignore
+        if payload.spool_path is not None:
+            # open spooled documents from disk rather than reading them in
+            pdf_document = pymupdf.open(payload.spool_path, filetype=payload.file_type)  # type: ignore
+        else:
+            pdf_document = pymupdf.open(  # type: ignore
+                stream=payload.content, filetype=payload.file_type
+            )
+        with pdf_document:  # type: ignore
             return pymupdf4llm.to_markdown(pdf_document)  # type: ignore
 
 
@@ -98,6 +105,53 @@ cache_dir = os.getenv("VECTORIZER_DOCLING_CACHE_DIR")
 DOCLING_CACHE_DIR = DEFAULT_CACHE_DIR if cache_dir is None else Path(cache_dir)
 
 
+_docling_converters = threading.local()
+
+
+def _docling_converter(cache_dir: Path | str) -> Any:
+    """
+    Returns the Docling converter for the given models directory. Converters
+    are built once per thread, so their models stay loaded between documents.
+    """
+    converters: dict[str, Any] | None = getattr(
+        _docling_converters, "by_cache_dir", None
+    )
+    if converters is None:
+        converters = _docling_converters.by_cache_dir = {}
+    if str(cache_dir) in converters:
+        return converters[str(cache_dir)]
+
+    # Note: deferred import to avoid import overhead
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.document_converter import (
+        DocumentConverter,
+        ImageFormatOption,
+        PdfFormatOption,
+    )
+
+    basic_pipeline_options = PdfPipelineOptions(
+        do_ocr=False,  # we do not want to do OCR in PDF (yet)
+        artifacts_path=cache_dir if os.path.isdir(cache_dir) else None,
+    )  # pyright: ignore[reportCallIssue]
+
+    with_ocr_pipeline_options = basic_pipeline_options
+    with_ocr_pipeline_options.do_ocr = True
+
+    converter = DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=basic_pipeline_options),
+            InputFormat.IMAGE: ImageFormatOption(
+                pipeline_options=with_ocr_pipeline_options
+            ),
+            # we don't need to configure the rest of the formats as they follow the
+            # simple pipeline without external models, OCR, etc.
+        }
+    )
+    converters[str(cache_dir)] = converter
+    return converter
+
+
 class ParsingDocling(BaseDocumentParsing):
     """Document parsing implementation using Docling."""
 
@@ -107,38 +161,15 @@ class ParsingDocling(BaseDocumentParsing):
     @override
     def parse_doc(self, row: dict[str, Any], payload: LoadedDocument) -> str:  # noqa: ARG002
         # Note: deferred import to avoid import overhead
-        from docling.datamodel.base_models import (
-            DocumentStream,  # type: ignore
-            InputFormat,
-        )
-        from docling.datamodel.pipeline_options import PdfPipelineOptions
-        from docling.document_converter import (
-            DocumentConverter,
-            ImageFormatOption,
-            PdfFormatOption,
-        )
-
-        basic_pipeline_options = PdfPipelineOptions(
-            do_ocr=False,  # we do not want to do OCR in PDF (yet)
-            artifacts_path=self.cache_dir if os.path.isdir(self.cache_dir) else None,
-        )  # pyright: ignore[reportCallIssue]
-
-        with_ocr_pipeline_options = basic_pipeline_options
-        with_ocr_pipeline_options.do_ocr = True
-
-        converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(
-                    pipeline_options=basic_pipeline_options
-                ),
-                InputFormat.IMAGE: ImageFormatOption(
-                    pipeline_options=with_ocr_pipeline_options
-                ),
-                # we don't need to configure the rest of the formats as they follow the
-                # simple pipeline without external models, OCR, etc.
-            }
-        )
-
-        source = DocumentStream(name=payload.file_path or "", stream=payload.content)
-        result = converter.convert(source)
+        from docling.datamodel.base_models import DocumentStream  # type: ignore
+
+        converter = _docling_converter(self.cache_dir)
+        if payload.spool_path is not None:
+            # convert spooled documents from disk rather than reading them in
+            result = converter.convert(Path(payload.spool_path))
+        else:
+            source = DocumentStream(
+                name=payload.file_path or "", stream=payload.content
+            )
+            result = converter.convert(source)
         return result.document.export_to_markdown()
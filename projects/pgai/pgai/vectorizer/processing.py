@@ -20,6 +20,20 @@ class ProcessingDefault(BaseModel):
         concurrency (Annotated[int, Gt(gt=0), Le(le=10)]): The number of
             concurrent tasks allowed, constrained to be greater than 0 and less
             than or equal to 10. Default is 1.
+        lease_seconds (Annotated[int, Gt(gt=0)] | None): If set, queue items
+            are claimed with a lease of this many seconds instead of being
+            locked for the duration of a batch. Default is None.
+        reuse_embeddings (bool): Whether to reuse the stored embedding of a
+            chunk whose text did not change instead of embedding it again.
+            Default is False.
+        target_batch_seconds (Annotated[int, Gt(gt=0)] | None): If set, the
+            number of items claimed per batch is adjusted so that a batch
+            takes about this many seconds, up to `batch_size` or 2048 items.
+            Default is None.
+        statement_trigger (bool): Whether the source table is watched by
+            statement-level triggers that queue all the rows of a statement at
+            once, instead of a row-level trigger. Only used when the
+            vectorizer is created. Default is False.
         log_level (Literal["CRITICAL", "FATAL", "ERROR", "WARN",
             "WARNING", "INFO", "DEBUG"]): The log level for logging output.
             Default is "INFO".
@@ -28,6 +42,10 @@ class ProcessingDefault(BaseModel):
     implementation: Literal["default"]
     batch_size: int | None = None
     concurrency: Annotated[int, Gt(gt=0), Le(le=10)] = 1
+    lease_seconds: Annotated[int, Gt(gt=0)] | None = None
+    reuse_embeddings: bool = False
+    target_batch_seconds: Annotated[int, Gt(gt=0)] | None = None
+    statement_trigger: bool = False
     log_level: Literal[
         "CRITICAL",
         "FATAL",
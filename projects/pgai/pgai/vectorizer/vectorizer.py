@@ -1,14 +1,21 @@
 import asyncio
+import hashlib
 import json
+import multiprocessing
 import os
+import signal
 import sys
 import threading
 import time
-from collections.abc import AsyncGenerator, Callable, Sequence
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, AsyncIterator, Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager, closing, suppress
+from dataclasses import dataclass
 from functools import cache, cached_property, partial
 from itertools import islice
 from typing import Any, TypeAlias, TypeVar
-from uuid import UUID
+from uuid import UUID, uuid4
 
 import psycopg
 import structlog
@@ -17,10 +24,12 @@ from pgvector.psycopg import register_vector_async  # type: ignore
 from psycopg import AsyncConnection, sql
 from psycopg.rows import dict_row
 from psycopg.types.json import Jsonb, set_json_dumps
+from psycopg_pool import AsyncConnectionPool
 from pydantic import BaseModel, Field, model_validator
 from pydantic_core._pydantic_core import ArgsKwargs
 from typing_extensions import override
 
+from . import metrics
 from .chunking import (
     LangChainCharacterTextSplitter,
     LangChainRecursiveCharacterTextSplitter,
@@ -28,9 +37,10 @@ from .chunking import (
 )
 from .destination import ColumnDestination, TableDestination
 from .embedders import LiteLLM, Ollama, OpenAI, VoyageAI
+from .embeddings import RateLimiter
 from .features import Features
 from .formatting import ChunkValue, PythonTemplate
-from .loading import ColumnLoading, LoadingError, UriLoading
+from .loading import ColumnLoading, LoadedDocument, LoadingError, UriLoading
 from .migrations import apply_migrations
 from .parsing import ParsingAuto, ParsingNone, ParsingPyMuPDF
 from .processing import ProcessingDefault
@@ -41,6 +51,11 @@ logger = structlog.get_logger()
 VectorizerErrorRecord: TypeAlias = tuple[int, str, Jsonb]
 EmbeddingRecord: TypeAlias = list[Any]
 SourceRow: TypeAlias = dict[str, Any]
+PreparedDocuments: TypeAlias = tuple[
+    list[EmbeddingRecord], list[str], list[tuple[SourceRow, LoadingError]]
+]
+# Seconds spent loading, parsing and chunking while preparing documents
+PreparingDurations: TypeAlias = dict[str, float]
 
 DEFAULT_CONCURRENCY = 1
 DEFAULT_VECTORIZER_ERRORS_TABLE = "_vectorizer_errors"
@@ -148,6 +163,11 @@ class Vectorizer(BaseModel):
         worker_tracking: WorkerTracking,
         concurrency: int | None = None,
         should_continue_processing_hook: None | Callable[[int, int], bool] = None,
+        pipeline_depth: int | None = None,
+        pool: AsyncConnectionPool | None = None,
+        disabled_check_interval: float = 0,
+        preparing_pool: "PreparingPool | None" = None,
+        shard_queue: bool = False,
     ) -> int:
         """Run this vectorizer with the specified configuration using Worker instances
 
@@ -159,6 +179,18 @@ class Vectorizer(BaseModel):
                 (overrides vectorizer config if provided)
             should_continue_processing_hook: Optional callback to
                 control processing flow
+            pipeline_depth: If set, each Executor runs its batches through a
+                staged pipeline with up to this many batches in flight
+            pool: Optional connection pool the Executors take their
+                connections from, instead of connecting on their own
+            disabled_check_interval: Minimum number of seconds between checks
+                of whether the vectorizer was disabled, for callers that learn
+                about it otherwise
+            preparing_pool: Optional pool of processes that load, parse, chunk
+                and format the documents
+            shard_queue: If set, each Executor claims work from its own share
+                of the queue, and from the rest of the queue once its share
+                is empty
 
         Returns:
             Number of items processed
@@ -170,21 +202,45 @@ class Vectorizer(BaseModel):
         ):
             self.errors_table = "vectorizer_errors"
 
-        concurrency = concurrency or self.config.processing.concurrency
-        tasks = [
-            asyncio.create_task(
-                Executor(
-                    db_url,
-                    self,
-                    features,
-                    worker_tracking,
-                    should_continue_processing_hook,
-                ).run()
+        embedding = self.config.embedding
+        rate_limiter = None
+        if features.embedding_rate_limits:
+            rate_limiter = EmbeddingRateLimiter(
+                db_url,
+                embedding.implementation,
+                getattr(embedding, "model", ""),
+                getattr(embedding, "api_key_name", None),
+                pool,
             )
-            for _ in range(concurrency)
-        ]
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            if shard_queue and features.queue_shards:
+                await self._create_shard_index(db_url, pool)
+
+            concurrency = concurrency or self.config.processing.concurrency
+            tasks = [
+                asyncio.create_task(
+                    Executor(
+                        db_url,
+                        self,
+                        features,
+                        worker_tracking,
+                        should_continue_processing_hook,
+                        pipeline_depth,
+                        pool,
+                        disabled_check_interval,
+                        preparing_pool,
+                        (slot, concurrency) if shard_queue else None,
+                        rate_limiter,
+                    ).run()
+                )
+                for slot in range(concurrency)
+            ]
+
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            if rate_limiter is not None:
+                await rate_limiter.aclose()
 
         # raise any exceptions, but only after all tasks have completed
         items: int = 0
@@ -206,6 +262,33 @@ class Vectorizer(BaseModel):
 
         return items
 
+    async def _create_shard_index(
+        self, db_url: str, pool: AsyncConnectionPool | None
+    ) -> None:
+        """
+        Indexes the queue table on the shard key that the Executors claiming
+        work in shards read ranges of, unless the index exists. Only workers
+        that claim work in shards need it, so the queue tables don't come with
+        it. Failures, e.g. when the worker's role doesn't own the queue table,
+        are logged, and the Executors claim work without the index.
+        """
+        query = VectorizerQueryBuilder(self).create_shard_index_query
+        try:
+            if pool is not None:
+                async with pool.connection() as conn:
+                    await conn.execute(query)
+            else:
+                async with await psycopg.AsyncConnection.connect(
+                    db_url, autocommit=True
+                ) as conn:
+                    await conn.execute(query)
+        except psycopg.Error as e:
+            logger.warning(
+                "failed to index the queue table on the shard key",
+                vectorizer_id=self.id,
+                error=str(e),
+            )
+
     @model_validator(mode="before")
     @classmethod
     def migrate_config_to_new_version(cls, data: Any) -> Any:
@@ -247,6 +330,27 @@ class VectorizerQueryBuilder:
             ]
         )
 
+    @property
+    def shard_key_sql(self) -> sql.Composed:
+        """Generates the SQL expression for the hash of the primary key, which
+        the queue table is indexed on. Workers claiming work in shards each
+        take a range of its values.
+        """
+        return sql.SQL("pg_catalog.hash_record(row({}))").format(self.pk_fields_sql)
+
+    @cached_property
+    def create_shard_index_query(self) -> sql.Composed:
+        """
+        Generates the SQL query to index the queue table on the shard key,
+        unless the index exists. The index is built concurrently, so that the
+        triggers can keep queuing items in the meantime.
+        """
+        return sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})").format(
+            sql.Identifier(f"{self.vectorizer.queue_table}_hash_record_idx"),
+            self.queue_table_ident,
+            self.shard_key_sql,
+        )
+
     @cached_property
     def pk_attnames(self) -> list[str]:
         """
@@ -348,10 +452,24 @@ class VectorizerQueryBuilder:
         The only differece, between the blog and this query, is that we handle
         composite primary keys.
         """
+        return self._fetch_work_query(sql.SQL("true"))
+
+    @cached_property
+    def sharded_fetch_work_query(self) -> sql.Composed:
+        """
+        Like `fetch_work_query`, but only claims the items whose shard key is
+        between the two first parameters, from the queue table's index on it.
+        """
+        return self._fetch_work_query(
+            sql.SQL("{} BETWEEN %s AND %s").format(self.shard_key_sql)
+        )
+
+    def _fetch_work_query(self, shard_filter: sql.Composable) -> sql.Composed:
         return sql.SQL("""
                 WITH selected_rows AS (
                     SELECT {pk_fields}
                     FROM {queue_table}
+                    WHERE {shard_filter}
                     LIMIT %s
                     FOR UPDATE SKIP LOCKED
                 ),
@@ -386,6 +504,7 @@ class VectorizerQueryBuilder:
                 ORDER BY {pk_fields}
                         """).format(
             pk_fields=self.pk_fields_sql,
+            shard_filter=shard_filter,
             queue_table=sql.Identifier(
                 self.vectorizer.queue_schema, self.vectorizer.queue_table
             ),
@@ -456,11 +575,28 @@ class VectorizerQueryBuilder:
         The only difference, between the blog and this query, is that we handle
         composite primary keys.
         """
+        return self._fetch_work_query_with_retries(sql.SQL("true"))
+
+    @cached_property
+    def sharded_fetch_work_query_with_retries(self) -> sql.Composed:
+        """
+        Like `fetch_work_query_with_retries`, but only claims the items whose
+        shard key is between the two first parameters, from the queue table's
+        index on it.
+        """
+        return self._fetch_work_query_with_retries(
+            sql.SQL("{} BETWEEN %s AND %s").format(self.shard_key_sql)
+        )
+
+    def _fetch_work_query_with_retries(
+        self, shard_filter: sql.Composable
+    ) -> sql.Composed:
         return sql.SQL("""
                 WITH selected_rows AS (
                     SELECT {pk_fields}, {loading_retries}
                     FROM {queue_table}
-                    WHERE loading_retry_after is null or loading_retry_after < now()
+                    WHERE (loading_retry_after is null or loading_retry_after < now())
+                    AND {shard_filter}
                     LIMIT %s
                     FOR UPDATE SKIP LOCKED
                 ),
@@ -495,6 +631,7 @@ class VectorizerQueryBuilder:
                 ORDER BY {pk_fields}
                         """).format(
             pk_fields=self.pk_fields_sql,
+            shard_filter=shard_filter,
             loading_retries=sql.Identifier("loading_retries"),
             queue_table=sql.Identifier(
                 self.vectorizer.queue_schema, self.vectorizer.queue_table
@@ -531,19 +668,256 @@ class VectorizerQueryBuilder:
             ),
         )
 
+    @cached_property
+    def lease_work_query(self) -> sql.Composed:
+        """
+        Generates the SQL query to claim work items from the queue table with
+        a lease.
+
+        Instead of deleting the queue rows inside a transaction that stays open
+        until the embeddings are written, the rows are stamped with a lease id
+        and an expiry, and the query commits right away. Rows whose lease
+        expired, e.g. because the worker holding them died, can be claimed
+        again. All queue rows of a primary key are leased together, and keys
+        with a live lease held by someone else are skipped, so that a key is
+        only processed by one worker at a time.
+
+        The leased rows are deleted by `delete_leased_work_query` when the
+        embeddings are written.
+        """
+        return self._lease_work_query(sql.SQL("true"))
+
+    @cached_property
+    def sharded_lease_work_query(self) -> sql.Composed:
+        """
+        Like `lease_work_query`, but only claims the items whose shard key is
+        between the `shard_min` and `shard_max` parameters, from the queue
+        table's index on it.
+        """
+        return self._lease_work_query(
+            sql.SQL("{} BETWEEN %(shard_min)s AND %(shard_max)s").format(
+                self.shard_key_sql
+            )
+        )
+
+    def _lease_work_query(self, shard_filter: sql.Composable) -> sql.Composed:
+        return sql.SQL("""
+                WITH selected_rows AS (
+                    SELECT {pk_fields}
+                    FROM {queue_table}
+                    WHERE (loading_retry_after is null or loading_retry_after < now())
+                    AND (lease_expires_at is null or lease_expires_at < now())
+                    AND {shard_filter}
+                    LIMIT %(batch_size)s
+                    FOR UPDATE SKIP LOCKED
+                ),
+                locked_items AS (
+                    SELECT
+                        {pk_fields},
+                        pg_try_advisory_xact_lock(
+                            %(lock_id)s::int,
+                            hashtext(concat_ws('|', {lock_fields}))::int
+                        ) AS locked
+                    FROM (
+                        SELECT DISTINCT {pk_fields}
+                        FROM selected_rows
+                        ORDER BY {pk_fields}
+                    ) as ids
+                ),
+                leased_rows AS (
+                    UPDATE {queue_table} AS w
+                    SET lease_id = %(lease_id)s,
+                        lease_expires_at = now()
+                            + make_interval(secs => %(lease_seconds)s)
+                    FROM locked_items AS l
+                    WHERE l.locked = true
+                    AND {delete_join_predicates}
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM {queue_table} AS o
+                        WHERE {other_join_predicates}
+                        AND o.lease_expires_at >= now()
+                    )
+                    RETURNING {leased_pk_fields}, w.loading_retries
+                ),
+                leased_items AS (
+                    SELECT {pk_fields}, max(loading_retries) AS loading_retries
+                    FROM leased_rows
+                    GROUP BY {pk_fields}
+                )
+                SELECT s.*, l.loading_retries
+                FROM leased_items l
+                LEFT JOIN LATERAL ( -- NOTE: lateral join forces runtime chunk exclusion
+                    SELECT *
+                    FROM {source_schema}.{source_table} s
+                    WHERE {lateral_join_predicates}
+                    LIMIT 1
+                ) AS s ON true
+                ORDER BY {l_pk_fields}
+                        """).format(
+            pk_fields=self.pk_fields_sql,
+            shard_filter=shard_filter,
+            leased_pk_fields=sql.SQL(" ,").join(
+                [sql.SQL("w.{}").format(pk) for pk in self.pk_fields]
+            ),
+            l_pk_fields=sql.SQL(" ,").join(
+                [sql.SQL("l.{}").format(pk) for pk in self.pk_fields]
+            ),
+            queue_table=self.queue_table_ident,
+            lock_fields=sql.SQL(" ,").join(
+                [
+                    xs
+                    for x in self.vectorizer.source_pk
+                    for xs in [
+                        sql.Literal(x.attname),
+                        sql.Identifier(x.attname),
+                    ]
+                ]
+            ),
+            delete_join_predicates=sql.SQL(" AND ").join(
+                [
+                    sql.SQL("w.{} = l.{}").format(
+                        sql.Identifier(x.attname),
+                        sql.Identifier(x.attname),
+                    )
+                    for x in self.vectorizer.source_pk
+                ]
+            ),
+            other_join_predicates=sql.SQL(" AND ").join(
+                [
+                    sql.SQL("o.{} = l.{}").format(
+                        sql.Identifier(x.attname),
+                        sql.Identifier(x.attname),
+                    )
+                    for x in self.vectorizer.source_pk
+                ]
+            ),
+            source_schema=sql.Identifier(self.vectorizer.source_schema),
+            source_table=sql.Identifier(self.vectorizer.source_table),
+            lateral_join_predicates=sql.SQL(" AND ").join(
+                [
+                    sql.SQL("l.{} = s.{}").format(
+                        sql.Identifier(x.attname),
+                        sql.Identifier(x.attname),
+                    )
+                    for x in self.vectorizer.source_pk
+                ]
+            ),
+        )
+
+    @cached_property
+    def delete_leased_work_query(self) -> sql.Composed:
+        """
+        Generates the SQL query to delete the queue rows of a lease, and return
+        the primary keys that were still held by it.
+
+        The advisory lock of every key is taken, blocking, before the rows are
+        deleted. It serializes writers of the same key and keeps workers that
+        claim by locking from picking up the keys while they are written.
+        """
+        return sql.SQL("""
+                WITH locked_items AS (
+                    SELECT
+                        {pk_fields},
+                        pg_advisory_xact_lock(
+                            %(lock_id)s::int,
+                            hashtext(concat_ws('|', {lock_fields}))::int
+                        )
+                    FROM (
+                        SELECT DISTINCT {pk_fields}
+                        FROM {queue_table}
+                        WHERE lease_id = %(lease_id)s
+                        ORDER BY {pk_fields}
+                    ) as ids
+                )
+                DELETE FROM {queue_table} AS w
+                USING locked_items AS l
+                WHERE w.lease_id = %(lease_id)s
+                AND {delete_join_predicates}
+                RETURNING {leased_pk_fields}
+                        """).format(
+            pk_fields=self.pk_fields_sql,
+            leased_pk_fields=sql.SQL(" ,").join(
+                [sql.SQL("w.{}").format(pk) for pk in self.pk_fields]
+            ),
+            queue_table=self.queue_table_ident,
+            lock_fields=sql.SQL(" ,").join(
+                [
+                    xs
+                    for x in self.vectorizer.source_pk
+                    for xs in [
+                        sql.Literal(x.attname),
+                        sql.Identifier(x.attname),
+                    ]
+                ]
+            ),
+            delete_join_predicates=sql.SQL(" AND ").join(
+                [
+                    sql.SQL("w.{} = l.{}").format(
+                        sql.Identifier(x.attname),
+                        sql.Identifier(x.attname),
+                    )
+                    for x in self.vectorizer.source_pk
+                ]
+            ),
+        )
+
+    @cached_property
+    def release_lease_query(self) -> sql.Composed:
+        """
+        Generates the SQL query to give up a lease, making its queue rows
+        available to other workers right away.
+        """
+        return sql.SQL(
+            "UPDATE {} SET lease_id = null, lease_expires_at = null WHERE lease_id = %s"
+        ).format(self.queue_table_ident)
+
+    @cached_property
+    def extend_leases_query(self) -> sql.Composed:
+        """
+        Generates the SQL query to push back the expiry of many leases at once.
+        It takes the lease duration in seconds and an array of lease ids.
+        """
+        return sql.SQL(
+            "UPDATE {} SET lease_expires_at = now() + make_interval(secs => %s)"
+            " WHERE lease_id = any(%s)"
+        ).format(self.queue_table_ident)
+
     @cached_property
     def fetch_queue_table_oid_query(self) -> sql.Composed:
         return sql.SQL("SELECT to_regclass('{}')::oid").format(
             sql.Identifier(self.vectorizer.queue_schema, self.vectorizer.queue_table)
         )
 
+    @cache  # noqa: B019
     def delete_embeddings_query(
-        self, items_count: int, destination: TableDestination
+        self,
+        destination: TableDestination,
+        pk_types: tuple[str, ...],
+        rows: int | None = None,
+    ) -> sql.Composed:
+        return sql.SQL("DELETE FROM {} AS t USING {} WHERE {}").format(
+            self.target_table_ident(destination),  # type: ignore
+            self._unnest_pks(pk_types, rows),
+            self._pks_match,
+        )
+
+    @cache  # noqa: B019
+    def stored_embeddings_query(
+        self,
+        destination: TableDestination,
+        pk_types: tuple[str, ...],
+        rows: int | None = None,
     ) -> sql.Composed:
-        return sql.SQL("DELETE FROM {} WHERE ({}) IN ({})").format(
+        """Returns a SQL query to fetch the md5 hash of every stored chunk of the
+        given items, along with its embedding."""
+        return sql.SQL(
+            "SELECT {}, md5(t.chunk), t.embedding FROM {} AS t, {} WHERE {}"
+        ).format(
+            sql.SQL(", ").join(sql.SQL("t.{}").format(f) for f in self.pk_fields),
             self.target_table_ident(destination),  # type: ignore
-            self.pk_fields_sql,
-            self._pks_placeholders_tuples(items_count),
+            self._unnest_pks(pk_types, rows),
+            self._pks_match,
         )
 
     @cache  # noqa: B019
@@ -553,13 +927,40 @@ class VectorizerQueryBuilder:
         ).format(self.target_table_ident(destination), self.pk_fields_sql)  # type: ignore
 
     @cache  # noqa: B019
-    def update_embedding_query(self, destination: ColumnDestination) -> sql.Composed:
-        """Returns a SQL query to update the embedding column (for ColumnDestination)"""
-        return sql.SQL("UPDATE {} SET {} = %s WHERE ({}) = ({})").format(
+    def update_embeddings_query(
+        self,
+        destination: ColumnDestination,
+        column_types: tuple[str, ...],
+        rows: int | None = None,
+    ) -> sql.Composed:
+        """Returns a SQL query that updates the embedding column of many rows
+        at once (for ColumnDestination).
+
+        The query takes one array per primary key field, followed by an array
+        of embeddings, all of the same length, and joins their unnested rows
+        to the source table:
+
+        UPDATE src AS t SET embedding = u.embedding
+        FROM unnest(%s::int4[], %s::vector(768)[]) AS u(id, embedding)
+        WHERE (t.id) = (u.id)
+
+        If a primary key field has an array type, it takes the values row by
+        row from a VALUES list instead, see `by_row`.
+
+        Args:
+            destination (ColumnDestination): The destination of the embeddings.
+            column_types (tuple[str, ...]): The types of the primary key
+                fields and of the embedding column, used to cast the arrays.
+            rows (int | None): The number of rows when passing the values row
+                by row, None when passing arrays.
+        """
+        embedding_column = sql.Identifier(destination.embedding_column)
+        return sql.SQL("UPDATE {} AS t SET {} = u.{} FROM {} WHERE {}").format(
             self.source_table_ident,
-            sql.Identifier(destination.embedding_column),
-            self.pk_fields_sql,
-            sql.SQL(", ").join([sql.Placeholder() for _ in self.pk_fields]),
+            embedding_column,
+            embedding_column,
+            self._rows(column_types, [*self.pk_fields, embedding_column], rows),
+            self._pks_match,
         )
 
     @cached_property
@@ -570,31 +971,85 @@ class VectorizerQueryBuilder:
             self.errors_table_ident,
         )
 
-    def _pks_placeholders_tuples(self, items_count: int) -> sql.Composed:
-        """Generates a comma separated list of tuples with placeholders for the
-        primary key fields of the source table.
+    def _typed_arrays(self, types: Sequence[str]) -> sql.Composed:
+        """Generates a comma separated list of placeholders, one per type, each
+        cast to an array of that type.
+
+        self._typed_arrays(["integer", "text"])
+        # => "%s::integer[], %s::text[]"
+        """
+        return sql.SQL(", ").join(
+            sql.SQL("%s::{}[]").format(sql.SQL(t))  # type: ignore
+            for t in types
+        )
+
+    @staticmethod
+    def by_row(types: Sequence[str]) -> bool:
+        """Returns whether values of the given types have to be passed row by
+        row. unnest flattens multi-dimensional arrays into their elements, so
+        an array of arrays can't pass the values of an array typed column,
+        e.g. of a primary key field of type text[]."""
+        return any(t.endswith("]") for t in types)
+
+    def _rows(
+        self,
+        types: Sequence[str],
+        fields: Sequence[sql.Composable],
+        rows: int | None,
+    ) -> sql.Composed:
+        """Generates a FROM item aliased as "u" with the given fields, out of
+        one array parameter per field. If `rows` is set, it takes one
+        parameter per field and row instead, for types that can't be passed
+        in arrays, see `by_row`.
+
+        self._rows(["integer", "text[]"], [id, tags], 2)
+        # => "(VALUES (%s::integer, %s::text[]), (%s::integer, %s::text[]))
+        #     AS u(id, tags)"
+        """
+        if rows is None:
+            values = sql.SQL("unnest({})").format(self._typed_arrays(types))
+        else:
+            row = sql.SQL("({})").format(
+                sql.SQL(", ").join(
+                    sql.SQL("%s::{}").format(sql.SQL(t))  # type: ignore
+                    for t in types
+                )
+            )
+            values = sql.SQL("(VALUES {})").format(sql.SQL(", ").join([row] * rows))
+        return sql.SQL("{} AS u({})").format(values, sql.SQL(", ").join(fields))
+
+    def _unnest_pks(
+        self, pk_types: tuple[str, ...], rows: int | None = None
+    ) -> sql.Composed:
+        """Generates a FROM item with one row per item, out of one array
+        parameter per primary key field, or with one parameter per field and
+        item if `rows` is set.
 
-        If the primary key has 2 fields, and we want to generate the
-        placeholders to match against 3 items:
+        If the primary key has 2 fields (author, title):
 
-        self._pks_placeholders_tuples(3)
-        # => "(%s, %s), (%s, %s), (%s, %s)"
+        self._unnest_pks(("text", "text"))
+        # => "unnest(%s::text[], %s::text[]) AS u(author, title)"
 
         This can be used for queries like:
 
-        DELETE FROM table WHERE (pk1, pk2) IN ((%s, %s), (%s, %s), (%s, %s))
+        DELETE FROM table AS t USING unnest(...) AS u(author, title)
+        WHERE (t.author, t.title) = (u.author, u.title)
 
-        We cannot use ANY = %s because Postgres doesn't allow it for anonymous
-        composite values.
+        Contrary to a list of placeholder tuples, the text of the query does
+        not depend on the number of items, so that Postgres can reuse the
+        prepared statement and its plan for batches of any size.
         """
-        placeholder_tuple = sql.SQL(", ").join(
-            sql.Placeholder() for _ in range(len(self.vectorizer.source_pk))
-        )
+        return self._rows(pk_types, self.pk_fields, rows)
 
-        tuples = sql.SQL(",").join(
-            sql.SQL("({})").format(placeholder_tuple) for _ in range(items_count)
+    @property
+    def _pks_match(self) -> sql.Composed:
+        """Generates the condition matching the primary key of the table
+        aliased as "t" with the rows of _unnest_pks, aliased as "u".
+        """
+        return sql.SQL("({}) = ({})").format(
+            sql.SQL(", ").join(sql.SQL("t.{}").format(f) for f in self.pk_fields),
+            sql.SQL(", ").join(sql.SQL("u.{}").format(f) for f in self.pk_fields),
         )
-        return tuples
 
     @cached_property
     def is_vectorizer_disabled_query(self) -> sql.Composed:
@@ -602,41 +1057,50 @@ class VectorizerQueryBuilder:
             self.vectorizer_table_ident,
         )
 
-    @cached_property
-    def reinsert_work_to_retry_query(self) -> sql.Composed:
+    @cache  # noqa: B019
+    def reinsert_work_to_retry_query(
+        self, pk_types: tuple[str, ...], rows: int | None = None
+    ) -> sql.Composed:
+        """Returns a SQL query that requeues many items at once. It takes one
+        array per primary key field, followed by an array with the number of
+        times each item was already retried, or these values row by row if
+        `rows` is set."""
         return sql.SQL("""
             INSERT INTO {queue_table}
                 ({pk_fields}, loading_retries, loading_retry_after)
-            VALUES
-                ({pk_values}, (%(loading_retries)s+1),
-                now() + INTERVAL '3 minutes'* (%(loading_retries)s + 1))
+            SELECT
+                {pk_fields}, (u.loading_retries + 1),
+                now() + INTERVAL '3 minutes' * (u.loading_retries + 1)
+            FROM {rows}
                         """).format(
             pk_fields=self.pk_fields_sql,
             queue_table=sql.Identifier(
                 self.vectorizer.queue_schema, self.vectorizer.queue_table
             ),
-            pk_values=sql.SQL(",").join(
-                sql.SQL("(%(pk{})s)").format(sql.Literal(i))
-                for i in range(len(self.pk_fields))
+            rows=self._rows(
+                (*pk_types, "pg_catalog.int4"),
+                [*self.pk_fields, sql.Identifier("loading_retries")],
+                rows,
             ),
         )
 
-    @cached_property
-    def insert_queue_failed_query(self) -> sql.Composed:
+    @cache  # noqa: B019
+    def insert_queue_failed_query(
+        self, pk_types: tuple[str, ...], rows: int | None = None
+    ) -> sql.Composed:
+        """Returns a SQL query that moves many items to the failed queue at
+        once. It takes the failure step, followed by one array per primary
+        key field, or the primary keys row by row if `rows` is set."""
         return sql.SQL("""
             INSERT INTO {queue_failed_table}
                 ({pk_fields}, failure_step)
-            VALUES
-                ({pk_values}, %(failure_step)s)""").format(
+            SELECT {pk_fields}, %s FROM {unnest}""").format(
             queue_failed_table=sql.Identifier(
                 self.vectorizer.queue_schema,
                 self.vectorizer.queue_failed_table,  # type: ignore
             ),
             pk_fields=self.pk_fields_sql,
-            pk_values=sql.SQL(",").join(
-                sql.SQL("(%(pk{})s)").format(sql.Literal(i))
-                for i in range(len(self.pk_fields))
-            ),
+            unnest=self._unnest_pks(pk_types, rows),
         )
 
 
@@ -650,6 +1114,9 @@ class ProcessingStats:
     Attributes:
         total_processing_time (float): The total time spent processing chunks.
         total_chunks (int): The total number of chunks processed.
+        total_batches (int): The total number of batches processed.
+        total_round_trips (int): The total number of round-trips to the
+            database made to process the batches.
         wall_time (float): The total wall time from when processing started.
         wall_start (float): The time when processing started, used for
             calculating the elapsed time.
@@ -657,6 +1124,8 @@ class ProcessingStats:
 
     total_processing_time: float
     total_chunks: int
+    total_batches: int
+    total_round_trips: int
     wall_time: float
     wall_start: float
 
@@ -672,19 +1141,25 @@ class ProcessingStats:
             )
             cls._instance.total_processing_time = 0.0
             cls._instance.total_chunks = 0
+            cls._instance.total_batches = 0
+            cls._instance.total_round_trips = 0
             cls._instance.wall_start = time.perf_counter()
         return cls._instance
 
-    def add_request_time(self, duration: float, chunk_count: int):
+    def add_request_time(self, duration: float, chunk_count: int, round_trips: int):
         """
-        Adds the time and chunk count of a processing request to the accumulated totals.
+        Adds the time, chunk count and round-trips of a processed batch to the
+        accumulated totals.
 
         Args:
             duration (float): The time taken for the request.
             chunk_count (int): The number of chunks processed in the request.
+            round_trips (int): The number of round-trips to the database.
         """
         self.total_processing_time += duration
         self.total_chunks += chunk_count
+        self.total_batches += 1
+        self.total_round_trips += round_trips
 
     async def print_stats(self):
         """
@@ -704,6 +1179,9 @@ class ProcessingStats:
         )
         wall_time = time.perf_counter() - self.wall_start
         chunks_per_second = self.total_chunks / wall_time if wall_time > 0 else 0
+        round_trips_per_batch = (
+            self.total_round_trips / self.total_batches if self.total_batches else 0
+        )
         await logger.adebug(
             "Processing stats",
             wall_time=wall_time,
@@ -711,10 +1189,196 @@ class ProcessingStats:
             total_chunks=self.total_chunks,
             chunks_per_second=chunks_per_second,
             chunks_per_second_per_thread=chunks_per_second_per_thread,
+            round_trips_per_batch=round_trips_per_batch,
             task=id(asyncio.current_task()),
         )
 
 
+class BatchSizer:
+    """
+    Adjusts the number of items claimed per batch so that a batch takes about
+    `target_seconds`.
+
+    The time an item takes to process is estimated from the batches processed
+    so far, with recent batches weighing the most, and the size is set to the
+    number of items that fill the target time. Fixed costs per batch, such as
+    round-trips to the database and to the embedding provider, weigh on small
+    batches, so the estimate per item falls and the batches grow until they
+    fill the target. The size at most doubles from one batch to the next, and
+    shrinks right away when items get slower, e.g. with large documents or a
+    degraded embedding provider.
+
+    Attributes:
+        size (int): The number of items to claim for the next batch.
+        max_size (int): The largest size allowed.
+        target_seconds (float): The time a batch should take.
+        seconds_per_item (float | None): The estimated time an item takes to
+            process, or None until a batch was processed.
+    """
+
+    # weight of the latest batch in the estimate of the time per item
+    SMOOTHING = 0.5
+
+    def __init__(self, size: int, max_size: int, target_seconds: float):
+        self.max_size = max_size
+        self.size = max(1, min(size, max_size))
+        self.target_seconds = target_seconds
+        self.seconds_per_item: float | None = None
+
+    def observe(self, item_count: int, duration: float) -> int:
+        """
+        Updates the estimate with a processed batch, and returns the size of
+        the next batch.
+
+        Args:
+            item_count (int): The number of items in the batch.
+            duration (float): The time taken to process the batch.
+        """
+        if item_count <= 0 or duration <= 0:
+            return self.size
+        seconds_per_item = duration / item_count
+        if self.seconds_per_item is not None:
+            seconds_per_item = (
+                self.SMOOTHING * seconds_per_item
+                + (1 - self.SMOOTHING) * self.seconds_per_item
+            )
+        self.seconds_per_item = seconds_per_item
+        wanted = int(self.target_seconds / seconds_per_item)
+        self.size = max(1, min(wanted, self.size * 2, self.max_size))
+        return self.size
+
+
+class EmbeddingCache:
+    """
+    Keeps the embeddings of recently embedded chunks, so that a chunk whose
+    text is embedded again by a later batch is not sent to the embedding
+    provider. The least recently used embeddings are evicted first.
+
+    Entries are keyed by the embedding config of the vectorizer and the md5
+    hash of the chunk, so that vectorizers with the same config share them.
+
+    Attributes:
+        max_size (int): The number of embeddings kept.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._embeddings: OrderedDict[tuple[str, bytes], Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, bytes]) -> Any:
+        """Returns the embedding stored under the key, or None."""
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is not None:
+                self._embeddings.move_to_end(key)
+            return embedding
+
+    def put(self, key: tuple[str, bytes], embedding: Any) -> None:
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+
+@cache
+def shared_embedding_cache() -> EmbeddingCache | None:
+    """Returns the embedding cache of the process, or None when the
+    PGAI_VECTORIZER_EMBEDDING_CACHE_SIZE environment variable doesn't enable
+    it."""
+    size = int(os.getenv("PGAI_VECTORIZER_EMBEDDING_CACHE_SIZE", default="0"))
+    return EmbeddingCache(size) if size > 0 else None
+
+
+class EmbeddingRateLimiter(RateLimiter):
+    """
+    Shares the rate limits of an embedding provider between the workers,
+    through the `ai.embedding_rate_limit` table.
+
+    Before every embedding request, the capacity for it is reserved with the
+    `ai._reserve_embedding_capacity` function, which answers how long the
+    request has to wait for the reservation to fit the limits. The limits
+    apply to the provider, the model and the name of the API key together.
+    If the table has no limits for them, no reservations are made.
+
+    The reservations are made outside of the transactions of the batches, on
+    a connection in autocommit mode, so that the row of the limits is only
+    locked for a moment. The connection is taken from the pool of the worker
+    for every reservation, or, without a pool, opened once and kept.
+
+    Args:
+        db_url (str): The URL of the database holding the limits.
+        provider (str): The implementation of the embedder.
+        model (str): The model of the embedder.
+        api_key_name (str | None): The name of the API key of the embedder.
+        pool (AsyncConnectionPool | None): The pool to take connections from.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        provider: str,
+        model: str,
+        api_key_name: str | None,
+        pool: AsyncConnectionPool | None = None,
+    ):
+        self.db_url = db_url
+        self.provider = provider
+        self.model = model
+        self.api_key_name = api_key_name or ""
+        self.pool = pool
+        self.enabled = True
+        self._conn: AsyncConnection | None = None
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[AsyncConnection]:
+        if self.pool is not None:
+            async with self.pool.connection() as conn:
+                yield conn
+            return
+        async with self._lock:
+            if self._conn is None:
+                self._conn = await psycopg.AsyncConnection.connect(
+                    self.db_url, autocommit=True, application_name="pgai-worker"
+                )
+            yield self._conn
+
+    @override
+    async def reserve(self, requests: int, tokens: float) -> None:
+        if not self.enabled:
+            return
+        async with self._connection() as conn:
+            cursor = await conn.execute(
+                "select ai._reserve_embedding_capacity(%s, %s, %s, %s, %s)",
+                [self.provider, self.model, self.api_key_name, requests, tokens],
+            )
+            row = await cursor.fetchone()
+        wait = row[0] if row is not None else None
+        if wait is None:
+            # no limits for this embedder
+            self.enabled = False
+            await self.aclose()
+            return
+        if wait > 0:
+            await logger.adebug(
+                "waiting for embedding rate limit",
+                provider=self.provider,
+                model=self.model,
+                seconds=wait,
+            )
+            metrics.EMBEDDING_RATE_LIMIT_WAIT.inc(
+                self.provider, self.model, amount=wait
+            )
+            await asyncio.sleep(wait)
+
+    async def aclose(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
 T = TypeVar("T")
 
 
@@ -741,19 +1405,224 @@ class UUIDEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
-class Executor:
-    """
-    Responsible for processing items from the work queue and generating embeddings.
+async def configure_connection(conn: AsyncConnection) -> None:
+    """Prepares a connection for use by an Executor."""
+    set_json_dumps(partial(json.dumps, cls=UUIDEncoder), context=conn)
+    await register_vector_async(conn)
 
-    The Executor fetches tasks from a database queue table, processes them using
-    the vectorizer, and writes the resulting embeddings or errors back to the
-    database.
 
-    Attributes:
-        db_url (str): The URL of the database to connect to.
-        vectorizer (Vectorizer): The vectorizer configuration used for processing.
+@dataclass
+class DocumentPreparer:
+    """
+    Loads, parses, chunks and formats queue items. It only holds the parts of
+    the vectorizer configuration it needs, which can all be pickled, so items
+    can be prepared in another process.
+    """
+
+    loading: ColumnLoading | UriLoading
+    parsing: ParsingNone | ParsingAuto | ParsingPyMuPDF
+    chunking: (
+        LangChainCharacterTextSplitter
+        | LangChainRecursiveCharacterTextSplitter
+        | NoneChunker
+    )
+    formatting: PythonTemplate | ChunkValue
+    pk_attnames: list[str]
+    loading_retries: bool
+
+    def __call__(self, items: list[SourceRow]) -> PreparedDocuments:
+        """
+        Returns:
+            PreparedDocuments: The records waiting for an embedding, the
+            formatted chunk of each of those records, and the items that
+            failed to load.
+        """
+        return self.prepare(items)[0]
+
+    def prepare(
+        self, items: list[SourceRow]
+    ) -> tuple[PreparedDocuments, PreparingDurations]:
+        """
+        Prepares the items like `__call__`, and also returns the time spent
+        in each stage: loading, parsing, and chunking, which includes
+        formatting the chunks.
+        """
+        records_without_embeddings: list[EmbeddingRecord] = []
+        loading_errors: list[tuple[SourceRow, LoadingError]] = []
+        documents: list[str] = []
+        durations: PreparingDurations = {"load": 0.0, "parse": 0.0, "chunk": 0.0}
+        mark = time.perf_counter()
+
+        def lap(stage: str) -> None:
+            nonlocal mark
+            now = time.perf_counter()
+            durations[stage] += now - mark
+            mark = now
+
+        for item, payload in zip(items, self.loading.load_many(items), strict=True):
+            lap("load")
+            pk_values = [item[pk] for pk in self.pk_attnames]
+            if isinstance(payload, Exception):
+                if self.loading_retries:
+                    loading_errors.append((item, (LoadingError(e=payload))))
+                continue
+
+            if isinstance(payload, str) and not payload:
+                continue
+
+            if isinstance(payload, LoadedDocument):
+                # close the document, deleting its spool file, once parsed
+                with closing(payload):
+                    payload = self.parsing.parse(item, payload)
+            else:
+                payload = self.parsing.parse(item, payload)
+            lap("parse")
+            chunks = self.chunking.into_chunks(item, payload)
+            for chunk_id, chunk in enumerate(chunks, 0):
+                formatted = self.formatting.format(chunk, item)
+                records_without_embeddings.append(pk_values + [chunk_id, formatted])
+                documents.append(formatted)
+            lap("chunk")
+
+        return (records_without_embeddings, documents, loading_errors), durations
+
+
+def _init_preparing_process() -> None:
+    # The worker process handles the signals and shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class PreparingPool:
+    """
+    A pool of processes that prepare documents, so that parsing and chunking
+    use all cores and don't block the event loop of the worker. The processes
+    are started once and keep the parsing models they loaded between batches.
+
+    Args:
+        processes: The number of processes.
+    """
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_preparing_process,
+        )
+
+    async def prepare(
+        self, preparer: DocumentPreparer, items: list[SourceRow]
+    ) -> PreparedDocuments:
+        """Splits the items into one slice per process, and joins the prepared
+        slices in the order of the items."""
+        prepared, _ = await self.prepare_with_durations(preparer, items)
+        return prepared
+
+    async def prepare_with_durations(
+        self, preparer: DocumentPreparer, items: list[SourceRow]
+    ) -> tuple[PreparedDocuments, PreparingDurations]:
+        """Prepares the items like `prepare`, and also returns the time spent
+        in each stage, summed over the processes."""
+        loop = asyncio.get_running_loop()
+        size = max(1, -(-len(items) // self.processes))
+        slices = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.executor, preparer.prepare, items[i : i + size]
+                )
+                for i in range(0, len(items), size)
+            )
+        )
+        records_without_embeddings: list[EmbeddingRecord] = []
+        documents: list[str] = []
+        loading_errors: list[tuple[SourceRow, LoadingError]] = []
+        durations: PreparingDurations = {}
+        for (slice_records, slice_documents, slice_errors), slice_durations in slices:
+            records_without_embeddings.extend(slice_records)
+            documents.extend(slice_documents)
+            loading_errors.extend(slice_errors)
+            for stage, seconds in slice_durations.items():
+                durations[stage] = durations.get(stage, 0.0) + seconds
+        return (records_without_embeddings, documents, loading_errors), durations
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+@dataclass
+class PipelineBatch:
+    """
+    A batch of work travelling through the stages of a pipelined Executor.
+
+    Each batch owns a connection with an open transaction from the moment its
+    items are claimed from the queue until its embeddings are written, so the
+    queue rows stay locked while the batch is in flight. Batches claimed with
+    a lease hold no transaction while in flight.
+
+    Attributes:
+        conn (AsyncConnection): The connection holding the batch's transaction.
+        transaction (AsyncExitStack): Commits the transaction when closed.
+        lease_id (UUID | None): The lease of the batch's queue rows, if they
+            were claimed with a lease.
+        items (list[SourceRow]): The rows claimed from the queue.
+        working_seconds (float): The time the stages spent working on the
+            batch so far, leaving out the time it waited between stages.
+        records_without_embeddings (list[EmbeddingRecord]): The chunk records
+            waiting for their embeddings.
+        documents (list[str]): The formatted chunks to be embedded.
+        loading_errors (list[tuple[SourceRow, LoadingError]]): The items that
+            failed to load.
+        records (list[EmbeddingRecord]): The records ready to be written.
+    """
+
+    conn: AsyncConnection
+    transaction: AsyncExitStack
+    lease_id: UUID | None
+    items: list[SourceRow]
+    working_seconds: float
+    records_without_embeddings: list[EmbeddingRecord]
+    documents: list[str]
+    loading_errors: list[tuple[SourceRow, LoadingError]]
+    records: list[EmbeddingRecord]
+
+
+class Executor:
+    """
+    Responsible for processing items from the work queue and generating embeddings.
+
+    The Executor fetches tasks from a database queue table, processes them using
+    the vectorizer, and writes the resulting embeddings or errors back to the
+    database.
+
+    Attributes:
+        db_url (str): The URL of the database to connect to.
+        vectorizer (Vectorizer): The vectorizer configuration used for processing.
         queries (VectorizerQueryBuilder): A query builder instance used for
             generating SQL queries.
+        pipeline_depth (int | None): When set, batches are processed by a
+            staged pipeline with up to this many batches in flight instead of
+            one after the other.
+        pool (AsyncConnectionPool | None): The pool to take connections from.
+            Without a pool, the Executor opens its own connections.
+        disabled_check_interval (float): Minimum number of seconds between
+            checks of whether the vectorizer was disabled. The default of 0
+            checks before every batch.
+        preparing_pool (PreparingPool | None): The processes to prepare
+            documents in. Without a pool, documents are prepared in a thread.
+        shard_slot (tuple[int, int] | None): The slot of the Executor among
+            the Executors of its worker, and their number. When set, the
+            Executor claims work from its own share of the queue, see
+            `_shard_range`.
+        rate_limiter (RateLimiter | None): Reserves capacity before every
+            embedding request, when set. It is shared by the Executors of a
+            vectorizer.
+        round_trips (int): The number of round-trips to the database made by
+            the Executor so far. Statements that don't depend on each other's
+            results are sent together in pipeline mode, in one round-trip.
+
+    When the vectorizer's processing config sets `lease_seconds`, queue items
+    are claimed with a lease instead of being locked by a transaction that
+    stays open while they are embedded.
     """
 
     _queue_table_oid = None
@@ -766,6 +1635,12 @@ class Executor:
         features: Features,
         worker_tracking: WorkerTracking,
         should_continue_processing_hook: None | Callable[[int, int], bool] = None,
+        pipeline_depth: int | None = None,
+        pool: AsyncConnectionPool | None = None,
+        disabled_check_interval: float = 0,
+        preparing_pool: PreparingPool | None = None,
+        shard_slot: tuple[int, int] | None = None,
+        rate_limiter: RateLimiter | None = None,
     ):
         self.db_url = db_url
         self.vectorizer = vectorizer
@@ -775,7 +1650,39 @@ class Executor:
         )
         self.features = features
         self.copy_types: None | Sequence[int] = None
+        self.pk_types: None | tuple[str, ...] = None
+        self.update_types: None | tuple[str, ...] = None
         self.worker_tracking = worker_tracking
+        self.pipeline_depth = pipeline_depth
+        self.pool = pool
+        self.disabled_check_interval = disabled_check_interval
+        self._disabled_checked_at: float | None = None
+        self.preparing_pool = preparing_pool
+        self.shard_slot = shard_slot
+        self.rate_limiter = rate_limiter
+        self.round_trips = 0
+        self._reported_round_trips = 0
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[AsyncConnection]:
+        """
+        Yields an autocommit connection configured by `configure_connection`,
+        taken from the pool if there is one.
+        """
+        application_name = f"pgai-worker[{self.vectorizer.id}]: {self.worker_tracking.get_short_worker_id()}"  # noqa: E501
+        if self.pool is None:
+            async with await psycopg.AsyncConnection.connect(
+                self.db_url, autocommit=True, application_name=application_name
+            ) as conn:
+                await configure_connection(conn)
+                yield conn
+        else:
+            async with self.pool.connection() as conn:
+                await conn.execute(
+                    "select pg_catalog.set_config('application_name', %s, false)",
+                    [application_name],
+                )
+                yield conn
 
     async def run(self) -> int:
         """
@@ -788,15 +1695,11 @@ class Executor:
         res = 0
         loops = 0
 
-        async with await psycopg.AsyncConnection.connect(
-            self.db_url,
-            autocommit=True,
-            application_name=f"pgai-worker[{self.vectorizer.id}]: {self.worker_tracking.get_short_worker_id()}",  # noqa: E501
-        ) as conn:
+        async with self._connection() as conn:
             try:
-                set_json_dumps(partial(json.dumps, cls=UUIDEncoder), context=conn)
-                await register_vector_async(conn)
                 await self.vectorizer.config.embedding.setup()
+                if self.pipeline_depth:
+                    return await self._run_pipelined(conn, self.pipeline_depth)
                 while True:
                     if not await self._should_continue_processing(conn, loops, res):
                         return res
@@ -805,10 +1708,8 @@ class Executor:
                         return res
                     res += items_processed
                     loops += 1
-                    await self.worker_tracking.save_vectorizer_success(
-                        conn, self.vectorizer.id, items_processed
-                    )
             except EmbeddingProviderError as e:
+                metrics.ERRORS.inc(self.vectorizer.id, "embedding_provider")
                 async with conn.transaction():
                     await self._insert_vectorizer_error(
                         conn,
@@ -829,6 +1730,7 @@ class Executor:
                 raise e
 
             except Exception as e:
+                metrics.ERRORS.inc(self.vectorizer.id, "unexpected")
                 async with conn.transaction():
                     await self._insert_vectorizer_error(
                         conn,
@@ -857,13 +1759,19 @@ class Executor:
         Raises:
             Exception: If the vectorizer row is not found in the database.
         """
-        if self.features.disable_vectorizers:
+        now = time.monotonic()
+        if self.features.disable_vectorizers and (
+            self._disabled_checked_at is None
+            or now - self._disabled_checked_at >= self.disabled_check_interval
+        ):
+            self._disabled_checked_at = now
             async with conn.cursor() as cursor:
                 await cursor.execute(
                     self.queries.is_vectorizer_disabled_query,
                     [self.vectorizer.id],
                 )
                 row = await cursor.fetchone()
+                self.round_trips += 1
                 if not row:
                     raise Exception("vectorizer row not found")
                 if row[0]:
@@ -883,14 +1791,16 @@ class Executor:
         Returns:
             int: The number of items processed in the batch.
         """
-        processing_stats = ProcessingStats()
+        if self._lease_seconds is not None:
+            return await self._do_leased_batch(conn)
         start_time = time.perf_counter()
-        async with conn.transaction():
-            items = await self._fetch_work(conn)
+        async with AsyncExitStack() as transaction:
+            items = await self._fetch_work(conn, transaction)
 
             current_span = tracer.current_span()
             if current_span:
                 current_span.set_tag("items_from_queue.pulled", len(items))
+                current_span.set_tag("batch_size", self._batch_size)
             await logger.adebug(f"Items pulled from queue: {len(items)}")
 
             # Filter out items that were deleted from the source table.
@@ -901,20 +1811,390 @@ class Executor:
             ]
 
             if len(items) == 0:
+                await transaction.aclose()
+                self.round_trips += 1
                 return 0
 
-            num_chunks = await self._embed_and_write(conn, items)
+            num_chunks = await self._embed_and_write(conn, transaction, items)
+
+        await self._record_batch(
+            time.perf_counter() - start_time, len(items), num_chunks
+        )
+
+        return len(items)
+
+    @tracer.wrap()
+    async def _do_leased_batch(self, conn: AsyncConnection) -> int:
+        """
+        Processes a batch of tasks claimed with a lease.
+
+        The items are claimed in a short transaction of their own, embedded
+        outside of any transaction, and written in a second short transaction.
+        The lease is extended while the items are embedded, see
+        `_keeping_leases`. If embedding fails, the lease is released so that
+        other workers can pick the items up again.
+
+        Args:
+            conn (AsyncConnection): The asynchronous database connection.
+
+        Returns:
+            int: The number of items processed in the batch.
+        """
+        start_time = time.perf_counter()
+        lease_id = uuid4()
+        items = await self._lease_work(conn, lease_id)
+        if items is None:
+            return 0
+
+        try:
+            async with self._keeping_leases(conn, {lease_id}):
+                (
+                    records_without_embeddings,
+                    documents,
+                    loading_errors,
+                ) = await self._prepare(items)
+                stored = await self._load_stored_embeddings(conn, items)
+                records, records_without_embeddings, documents = (
+                    self._reuse_stored_embeddings(
+                        stored, records_without_embeddings, documents
+                    )
+                )
+                if documents:
+                    async for batch_records in self._embed_documents(
+                        records_without_embeddings, documents
+                    ):
+                        records.extend(batch_records)
+        except BaseException:
+            async with conn.cursor() as cursor:
+                await cursor.execute(self.queries.release_lease_query, [lease_id])
+            self.round_trips += 1
+            raise
+
+        num_chunks = await self._write_leased_work(
+            conn, lease_id, items, records, loading_errors
+        )
 
-            processing_stats.add_request_time(
-                time.perf_counter() - start_time, num_chunks
+        await self._record_batch(
+            time.perf_counter() - start_time, len(items), num_chunks
+        )
+
+        return len(items)
+
+    async def _run_pipelined(self, conn: AsyncConnection, depth: int) -> int:
+        """
+        Processes batches through a staged pipeline instead of one at a time.
+
+        The stages are connected by bounded queues and run concurrently:
+
+        - fetch: claims a batch from the queue in its own transaction.
+        - prepare: loads, parses, chunks and formats the batch's items.
+        - embed: sends the batch's chunks to the embedding provider.
+        - write: writes the embeddings and commits the batch's transaction.
+
+        This lets batch N+1 be claimed and prepared while batch N is waiting on
+        the embedding provider. Every batch in flight holds its own connection
+        and transaction, so `depth` bounds both the number of batches in flight
+        and the number of extra connections.
+
+        Batches claimed with a lease hold no transaction. Their leases are
+        extended on `conn` from the moment they are claimed until they are
+        written, including while they wait between stages, and the leases of
+        the batches still in flight are released when the pipeline stops
+        early.
+
+        Args:
+            conn (AsyncConnection): The connection used for control queries.
+            depth (int): The maximum number of batches in flight.
+
+        Returns:
+            int: The number of items processed.
+        """
+        res = 0
+        loops = 0
+        connections = AsyncExitStack()
+        idle: asyncio.Queue[AsyncConnection] = asyncio.Queue()
+        to_prepare: asyncio.Queue[PipelineBatch | None] = asyncio.Queue(maxsize=1)
+        to_embed: asyncio.Queue[PipelineBatch | None] = asyncio.Queue(maxsize=1)
+        to_write: asyncio.Queue[PipelineBatch | None] = asyncio.Queue(maxsize=1)
+        # The leases of the batches claimed but not written yet
+        leases: set[UUID] = set()
+
+        async def fetch_stage() -> None:
+            nonlocal loops
+            while await self._should_continue_processing(conn, loops, res):
+                batch = await self._claim_batch(await idle.get())
+                if batch is None:
+                    break
+                if batch.lease_id is not None:
+                    leases.add(batch.lease_id)
+                await to_prepare.put(batch)
+                loops += 1
+            await to_prepare.put(None)
+
+        async def prepare_stage() -> None:
+            while (batch := await to_prepare.get()) is not None:
+                # Loading may download documents and parsing is CPU heavy, so
+                # keep both off the event loop to let the other stages progress.
+                start_time = time.perf_counter()
+                (
+                    batch.records_without_embeddings,
+                    batch.documents,
+                    batch.loading_errors,
+                ) = await self._prepare(batch.items)
+                batch.working_seconds += time.perf_counter() - start_time
+                await to_embed.put(batch)
+            await to_embed.put(None)
+
+        async def embed_stage() -> None:
+            while (batch := await to_embed.get()) is not None:
+                start_time = time.perf_counter()
+                stored = await self._load_stored_embeddings(batch.conn, batch.items)
+                batch.records, batch.records_without_embeddings, batch.documents = (
+                    self._reuse_stored_embeddings(
+                        stored, batch.records_without_embeddings, batch.documents
+                    )
+                )
+                if batch.documents:
+                    async for records in self._embed_documents(
+                        batch.records_without_embeddings, batch.documents
+                    ):
+                        batch.records.extend(records)
+                batch.working_seconds += time.perf_counter() - start_time
+                await to_write.put(batch)
+            await to_write.put(None)
+
+        async def write_stage() -> None:
+            nonlocal res
+            while (batch := await to_write.get()) is not None:
+                start_time = time.perf_counter()
+                await self._write_batch(batch)
+                batch.working_seconds += time.perf_counter() - start_time
+                if batch.lease_id is not None:
+                    leases.discard(batch.lease_id)
+                await idle.put(batch.conn)
+                res += len(batch.items)
+                # Round-trips of the batches in flight are interleaved, so
+                # each batch is attributed those made since the previous one.
+                # The batch size adapts to the time the stages spent on the
+                # batch, as the time it waited for the previous batches to
+                # move on doesn't depend on its size.
+                await self._record_batch(
+                    batch.working_seconds, len(batch.items), len(batch.records)
+                )
+
+        try:
+            for _ in range(depth):
+                idle.put_nowait(
+                    await connections.enter_async_context(self._connection())
+                )
+
+            async with self._keeping_leases(conn, leases):
+                tasks = [
+                    asyncio.create_task(stage())
+                    for stage in (fetch_stage, prepare_stage, embed_stage, write_stage)
+                ]
+                try:
+                    done, _ = await asyncio.wait(
+                        tasks, return_when=asyncio.FIRST_EXCEPTION
+                    )
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            for task in done:
+                exception = task.exception()
+                if exception is not None:
+                    raise exception
+            return res
+        finally:
+            # Releasing a connection rolls back the transaction of any batch
+            # that was still in flight, returning its items to the queue.
+            # Leased items are not held by a transaction, so their leases are
+            # released explicitly.
+            await self._release_leases(conn, leases)
+            await connections.aclose()
+
+    async def _claim_batch(self, conn: AsyncConnection) -> PipelineBatch | None:
+        """
+        Opens a transaction on `conn` and claims a batch of items from the queue.
+
+        Returns:
+            PipelineBatch | None: The claimed batch, or None when there is no
+            more work. In that case the transaction is already committed.
+        """
+        start_time = time.perf_counter()
+        transaction = AsyncExitStack()
+        if self._lease_seconds is not None:
+            lease_id = uuid4()
+            items = await self._lease_work(conn, lease_id)
+            if items is None:
+                return None
+            return PipelineBatch(
+                conn,
+                transaction,
+                lease_id,
+                items,
+                time.perf_counter() - start_time,
+                [],
+                [],
+                [],
+                [],
             )
-            await processing_stats.print_stats()
+        items = await self._fetch_work(conn, transaction)
+        await logger.adebug(f"Items pulled from queue: {len(items)}")
+        # Filter out items that were deleted from the source table.
+        items = [
+            i for i in items if i[self.vectorizer.source_pk[0].attname] is not None
+        ]
+        if len(items) == 0:
+            await transaction.aclose()
+            self.round_trips += 1
+            return None
+        return PipelineBatch(
+            conn,
+            transaction,
+            None,
+            items,
+            time.perf_counter() - start_time,
+            [],
+            [],
+            [],
+            [],
+        )
+
+    @asynccontextmanager
+    async def _keeping_leases(
+        self, conn: AsyncConnection, lease_ids: set[UUID]
+    ) -> AsyncIterator[None]:
+        """
+        Extends the leases in `lease_ids` while the context is open, every
+        third of the lease duration, so that they don't expire while their
+        items are processed. The set may change while the context is open.
 
-            return len(items)
+        The extensions are made on `conn`, which can be used by the context in
+        the meantime. The context waits for an extension in progress to finish
+        on exit instead of interrupting it. Does nothing when items are not
+        claimed with a lease.
 
-    @cached_property
+        Args:
+            conn (AsyncConnection): The connection to extend the leases on.
+            lease_ids (set[UUID]): The leases to extend.
+        """
+        lease_seconds = self._lease_seconds
+        if lease_seconds is None:
+            yield
+            return
+        stopped = asyncio.Event()
+
+        async def extend_leases() -> None:
+            while True:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stopped.wait(), timeout=lease_seconds / 3)
+                    return
+                if not lease_ids:
+                    continue
+                try:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            self.queries.extend_leases_query,
+                            [lease_seconds, list(lease_ids)],
+                        )
+                    self.round_trips += 1
+                except psycopg.Error as e:
+                    await logger.awarning(f"failed to extend leases: {e}")
+
+        task = asyncio.create_task(extend_leases())
+        try:
+            yield
+        finally:
+            stopped.set()
+            await task
+
+    async def _release_leases(
+        self, conn: AsyncConnection, lease_ids: set[UUID]
+    ) -> None:
+        """
+        Releases the given leases so that other workers can pick their items
+        up right away. Failures are only logged, as the leases expire anyway.
+        """
+        for lease_id in lease_ids:
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(self.queries.release_lease_query, [lease_id])
+                self.round_trips += 1
+            except psycopg.Error as e:
+                await logger.awarning(f"failed to release lease: {e}")
+                return
+
+    @tracer.wrap()
+    async def _write_batch(self, batch: PipelineBatch) -> None:
+        """
+        Writes a pipelined batch's embeddings and commits its transaction.
+        """
+        if batch.lease_id is not None:
+            await self._write_leased_work(
+                batch.conn,
+                batch.lease_id,
+                batch.items,
+                batch.records,
+                batch.loading_errors,
+            )
+            return
+        await self._write_work(
+            batch.conn,
+            batch.transaction,
+            batch.items,
+            batch.records,
+            batch.loading_errors,
+        )
+
+    async def _record_batch(
+        self, duration: float, item_count: int, chunk_count: int
+    ) -> None:
+        """
+        Adds a processed batch that took `duration` seconds to the processing
+        stats, and adjusts the size of the next batches to the time it took
+        when the batch size adapts.
+        """
+        vectorizer_id = self.vectorizer.id
+        metrics.BATCH_DURATION.observe(vectorizer_id, value=duration)
+        metrics.BATCH_ITEMS.observe(vectorizer_id, value=item_count)
+        metrics.BATCH_CHUNKS.observe(vectorizer_id, value=chunk_count)
+        metrics.ITEMS.inc(vectorizer_id, amount=item_count)
+        metrics.CHUNKS.inc(vectorizer_id, amount=chunk_count)
+        processing_stats = ProcessingStats()
+        processing_stats.add_request_time(
+            duration, chunk_count, self._take_round_trips()
+        )
+        await processing_stats.print_stats()
+        if self._batch_sizer is not None:
+            previous_size = self._batch_sizer.size
+            size = self._batch_sizer.observe(item_count, duration)
+            if size != previous_size:
+                await logger.adebug(
+                    "adjusted batch size",
+                    vectorizer_id=self.vectorizer.id,
+                    batch_size=size,
+                    previous_batch_size=previous_size,
+                    seconds_per_item=self._batch_sizer.seconds_per_item,
+                )
+        metrics.BATCH_SIZE.set(vectorizer_id, value=self._batch_size)
+
+    def _observe_stage(self, stage: str, seconds: float) -> None:
+        """Adds the time a batch spent in a processing stage to the metrics."""
+        metrics.STAGE_DURATION.observe(self.vectorizer.id, stage, value=seconds)
+
+    @property
     def _batch_size(self) -> int:
-        """Returns the batch size for processing.
+        """Returns the batch size for processing, as adjusted by the batch
+        sizer when the processing config sets `target_batch_seconds`."""
+        if self._batch_sizer is not None:
+            return self._batch_sizer.size
+        return self._configured_batch_size
+
+    @cached_property
+    def _configured_batch_size(self) -> int:
+        """Returns the batch size set by the processing config, or the default.
         Documents take way longer to process than simple text rows,
         due to download and parsing overhead.
         So when the vectorizer is processing documents
@@ -922,70 +2202,306 @@ class Executor:
         if self.vectorizer.config.processing.batch_size is not None:
             return max(1, min(self.vectorizer.config.processing.batch_size, 2048))
         else:
-            if isinstance(self.vectorizer.config.loading, UriLoading):
-                return 1
-            else:
-                return 50
+            return self._default_batch_size
+
+    @cached_property
+    def _default_batch_size(self) -> int:
+        if isinstance(self.vectorizer.config.loading, UriLoading):
+            return 1
+        else:
+            return 50
+
+    @cached_property
+    def _batch_sizer(self) -> BatchSizer | None:
+        """Returns the batch sizer when the batch size adapts to the time
+        batches take. It starts from the default batch size, and the batch
+        size of the processing config is the largest it grows to."""
+        processing = self.vectorizer.config.processing
+        if processing.target_batch_seconds is None:
+            return None
+        max_size = min(processing.batch_size or 2048, 2048)
+        return BatchSizer(
+            self._default_batch_size, max_size, processing.target_batch_seconds
+        )
+
+    @cached_property
+    def _lease_seconds(self) -> int | None:
+        """Returns the lease duration when items are claimed with a lease, or
+        None when they are locked for the duration of a batch."""
+        if not self.features.queue_leases:
+            return None
+        return self.vectorizer.config.processing.lease_seconds
+
+    async def _lease_work(
+        self, conn: AsyncConnection, lease_id: UUID
+    ) -> list[SourceRow] | None:
+        """
+        Claims a batch of tasks from the work queue table with a lease. The
+        claim commits right away, the rows stay in the queue until the lease
+        is written by `_write_leased_work` or expires.
+
+        Args:
+            conn (AsyncConnection): The database connection in autocommit mode.
+            lease_id (UUID): The id stamped on the claimed queue rows.
+
+        Returns:
+            list[SourceRow] | None: The rows from the source table that need to
+            be embedded, or None when there is no work left. Items that were
+            deleted from the source table are not included, but their queue
+            rows are leased and removed with the others. When the Executor
+            claims work in shards, it leases from its own shard first.
+        """
+        params: dict[str, Any] = {
+            "batch_size": self._batch_size,
+            "lock_id": self.vectorizer.id,
+            "lease_id": lease_id,
+            "lease_seconds": self._lease_seconds,
+        }
+        shard_range = self._shard_range()
+        start_time = time.perf_counter()
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            items: list[SourceRow] = []
+            if shard_range is not None:
+                shard_min, shard_max = shard_range
+                await cursor.execute(
+                    self.queries.sharded_lease_work_query,
+                    {**params, "shard_min": shard_min, "shard_max": shard_max},
+                )
+                items = await cursor.fetchall()
+                self.round_trips += 1
+            if not items:
+                await cursor.execute(self.queries.lease_work_query, params)
+                items = await cursor.fetchall()
+                self.round_trips += 1
+        self._observe_stage("fetch", time.perf_counter() - start_time)
+        await logger.adebug(f"Items leased from queue: {len(items)}")
+        if len(items) == 0:
+            return None
+        return [i for i in items if i[self.vectorizer.source_pk[0].attname] is not None]
+
+    async def _write_leased_work(
+        self,
+        conn: AsyncConnection,
+        lease_id: UUID,
+        items: list[SourceRow],
+        records: list[EmbeddingRecord],
+        loading_errors: list[tuple[SourceRow, LoadingError]],
+    ) -> int:
+        """
+        Removes the queue rows of a lease and writes the embeddings of the
+        items that were still held by it, in a transaction of its own.
+
+        If the lease expired and another worker claimed some of the items in
+        the meantime, the results for those items are discarded, as the other
+        worker writes its own.
+
+        Returns:
+            int: The number of records written to the database.
+        """
+        async with AsyncExitStack() as transaction:
+            async with conn.cursor() as cursor:
+                # The BEGIN and the removal of the queue rows share a round-trip
+                async with conn.pipeline():
+                    await transaction.enter_async_context(conn.transaction())
+                    await cursor.execute(
+                        self.queries.delete_leased_work_query,
+                        {"lock_id": self.vectorizer.id, "lease_id": lease_id},
+                    )
+                self.round_trips += 1
+                held = {tuple(row) for row in await cursor.fetchall()}
+
+            pk_count = len(self.queries.pk_attnames)
+            lost = [i for i in items if tuple(self._get_item_pk_values(i)) not in held]
+            if lost:
+                await logger.awarning(
+                    "lease expired, discarding results", lost_items=len(lost)
+                )
+                items = [i for i in items if tuple(self._get_item_pk_values(i)) in held]
+                records = [r for r in records if tuple(r[:pk_count]) in held]
+                loading_errors = [
+                    (item, e)
+                    for item, e in loading_errors
+                    if tuple(self._get_item_pk_values(item)) in held
+                ]
 
-    async def _fetch_work(self, conn: AsyncConnection) -> list[SourceRow]:
+            await self._write_work(conn, transaction, items, records, loading_errors)
+        return len(records)
+
+    async def _fetch_work(
+        self, conn: AsyncConnection, transaction: AsyncExitStack
+    ) -> list[SourceRow]:
         """
-        Fetches a batch of tasks from the work queue table. Safe for concurrent use.
+        Opens a transaction on `conn` and fetches a batch of tasks from the work
+        queue table in it. Safe for concurrent use. The BEGIN and the fetch are
+        sent together in one round-trip. When the Executor claims work in
+        shards, it fetches from its own shard first, see `_shard_range`.
 
         Follows the approach described in:
         https://www.timescale.com/blog/how-we-designed-a-resilient-vector-embedding-creation-system-for-postgresql-data/
 
         Args:
             conn (AsyncConnection): The database connection.
+            transaction (AsyncExitStack): Commits the transaction when closed.
 
         Returns:
             list[SourceRow]: The rows from the source table that need to be embedded.
         """
+        if self.features.loading_retries:
+            query = self.queries.fetch_work_query_with_retries
+            sharded_query = self.queries.sharded_fetch_work_query_with_retries
+        else:
+            query = self.queries.fetch_work_query
+            sharded_query = self.queries.sharded_fetch_work_query
+        params = (self._batch_size, self.vectorizer.id)
+        shard_range = self._shard_range()
+        start_time = time.perf_counter()
         async with conn.cursor(row_factory=dict_row) as cursor:
-            if self.features.loading_retries:
-                await cursor.execute(
-                    self.queries.fetch_work_query_with_retries,
-                    (
-                        self._batch_size,
-                        self.vectorizer.id,
-                    ),
-                )
-            else:
-                await cursor.execute(
-                    self.queries.fetch_work_query,
-                    (
-                        self._batch_size,
-                        self.vectorizer.id,
-                    ),
-                )
-            return await cursor.fetchall()
+            async with conn.pipeline():
+                await transaction.enter_async_context(conn.transaction())
+                if shard_range is None:
+                    await cursor.execute(query, params)
+                else:
+                    await cursor.execute(sharded_query, (*shard_range, *params))
+            self.round_trips += 1
+            items = await cursor.fetchall()
+            if not items and shard_range is not None:
+                # The shard ran empty, take work from the shards of the others
+                await cursor.execute(query, params)
+                self.round_trips += 1
+                items = await cursor.fetchall()
+        self._observe_stage("fetch", time.perf_counter() - start_time)
+        return items
+
+    def _shard_range(self) -> tuple[int, int] | None:
+        """
+        Returns the range of shard keys, the hashes of the primary keys of the
+        queue items, that the Executor claims work from first. Returns None
+        when the Executor claims work from the whole queue.
+
+        The live workers split the range of int4 hashes between themselves, as
+        assigned by the worker tracking, and every worker splits its part
+        between its Executors. The Executors therefore read disjoint ranges of
+        the queue table's index on the shard key, and don't compete for the
+        same rows and advisory locks. Work is only claimed outside of the
+        range once the range is empty.
+        """
+        if self.shard_slot is None or not self.features.queue_shards:
+            return None
+        shard = self.worker_tracking.shard
+        if shard is None:
+            return None
+        shard_index, shard_count = shard
+        slot, slots = self.shard_slot
+        count = shard_count * slots
+        if count <= 1:
+            return None
+        index = shard_index * slots + slot
+        start = -(2**31)
+        return (
+            start + index * 2**32 // count,
+            start + (index + 1) * 2**32 // count - 1,
+        )
 
     @tracer.wrap()
-    async def _embed_and_write(self, conn: AsyncConnection, items: list[SourceRow]):
+    async def _embed_and_write(
+        self,
+        conn: AsyncConnection,
+        transaction: AsyncExitStack,
+        items: list[SourceRow],
+    ) -> int:
         """
         Embeds the items and writes them to the database.
 
-        - Deletes existing embeddings for the items.
         - Generates the documents to be embedded, chunks them, and formats the chunks.
-        - Sends the documents to the embedding provider and writes embeddings
-          to the database.
-        - Logs any non-fatal errors encountered during embedding.
+        - Reuses the stored embeddings of unchanged chunks, if enabled.
+        - Sends the documents to the embedding provider.
+        - Replaces the existing embeddings of the items with the new ones and
+          commits the transaction, see `_write_work`.
 
         Args:
             conn (AsyncConnection): The database connection.
+            transaction (AsyncExitStack): Commits the transaction when closed.
             items (list[SourceRow]): The items to be embedded.
 
         Returns:
             int: The number of records written to the database.
         """
+        stored = await self._load_stored_embeddings(conn, items)
+        records: list[EmbeddingRecord] = []
+        loading_errors: list[tuple[SourceRow, LoadingError]] = []
+        async for batch_records, batch_errors in self._generate_embeddings(
+            items, stored
+        ):
+            records.extend(batch_records)
+            loading_errors.extend(batch_errors)
+        await self._write_work(conn, transaction, items, records, loading_errors)
+        return len(records)
 
-        await self._delete_embeddings(conn, items)
-        count = 0
-        async for records, loading_errors in self._generate_embeddings(items):
-            if loading_errors:
-                await self.handle_loading_retries(conn, loading_errors)
-            await self._write_embeddings(conn, records)
-            count += len(records)
-        return count
+    async def _write_work(
+        self,
+        conn: AsyncConnection,
+        transaction: AsyncExitStack,
+        items: list[SourceRow],
+        records: list[EmbeddingRecord],
+        loading_errors: list[tuple[SourceRow, LoadingError]],
+    ) -> None:
+        """
+        Replaces the embeddings of the items with the given records, requeues
+        the items that failed to load, reports the worker's progress and
+        commits the transaction by closing `transaction`.
+
+        The statements are sent in pipeline mode, so that those that don't
+        depend on each other share a round-trip. With a column destination the
+        whole write, COMMIT included, takes a single round-trip. COPY can't run
+        in pipeline mode, so with a table destination the records are copied
+        in a round-trip of their own, followed by the COMMIT.
+
+        The progress is reported last, right before the COMMIT, so that the
+        lock on the worker's progress row isn't held while the records are
+        written.
+
+        Args:
+            conn (AsyncConnection): The database connection.
+            transaction (AsyncExitStack): Commits the transaction when closed.
+            items (list[SourceRow]): The items of the batch.
+            records (list[EmbeddingRecord]): The embedding records to write.
+            loading_errors (list[tuple[SourceRow, LoadingError]]): The items
+                that failed to load, with their error.
+        """
+        destination = self.vectorizer.config.destination
+        start_time = time.perf_counter()
+        # Loading the types needs their result, so it can't be pipelined. They
+        # are only loaded on first use.
+        await self._get_pk_types(conn)
+        if isinstance(destination, ColumnDestination):
+            await self._get_update_types(conn, destination)
+        elif self.copy_types is None:
+            await self._load_copy_types(conn, destination)
+
+        async with conn.pipeline():
+            if items:
+                await self._delete_embeddings(conn, items)
+            await self.handle_loading_retries(conn, loading_errors)
+            if isinstance(destination, ColumnDestination):
+                await self._update_source_table(destination, conn, records)
+                await self.worker_tracking.save_vectorizer_success(
+                    conn, self.vectorizer.id, len(items)
+                )
+                await transaction.aclose()
+        self.round_trips += 1
+
+        if isinstance(destination, TableDestination):
+            if records:
+                await self._copy_embeddings(conn, records, destination)
+                self.round_trips += 1
+            async with conn.pipeline():
+                await self.worker_tracking.save_vectorizer_success(
+                    conn, self.vectorizer.id, len(items)
+                )
+                await transaction.aclose()
+            self.round_trips += 1
+        self.worker_tracking.count_successes(len(items))
+        self._observe_stage("write", time.perf_counter() - start_time)
 
     async def _delete_embeddings(self, conn: AsyncConnection, items: list[SourceRow]):
         """
@@ -998,13 +2514,16 @@ class Executor:
         if self.vectorizer.config.destination.implementation == "column":
             return
         else:
-            ids = [item[pk] for item in items for pk in self.queries.pk_attnames]
+            pk_types = await self._get_pk_types(conn)
+            rows, params = self._batch_params(pk_types, self._pk_arrays(items))
             async with conn.cursor() as cursor:
                 await cursor.execute(
                     self.queries.delete_embeddings_query(
-                        len(items), self.vectorizer.config.destination
+                        self.vectorizer.config.destination,  # type: ignore
+                        pk_types,
+                        rows,
                     ),
-                    ids,
+                    params,
                 )
 
     async def _load_copy_types(
@@ -1048,6 +2567,7 @@ class Executor:
             )
             column_name_to_type = {row[0]: row[1] for row in await cursor.fetchall()}
             self.copy_types = [column_name_to_type[col] for col in target_columns]
+        self.round_trips += 1
         assert self.copy_types is not None
         # len(source_pk) + chunk_seq + chunk + embedding
         assert len(self.copy_types) == len(self.vectorizer.source_pk) + 3
@@ -1084,32 +2604,118 @@ class Executor:
         # len(source_pk) + chunk_seq + chunk + embedding
         assert len(self.copy_types) == len(self.vectorizer.source_pk) + 3
 
+    async def _load_column_types(
+        self, conn: AsyncConnection, columns: list[str]
+    ) -> tuple[str, ...]:
+        """
+        Loads the types of the given columns of the source table, as
+        formatted by format_type so that they can be used in casts.
+
+        Args:
+            conn (AsyncConnection): The database connection.
+            columns (list[str]): The names of the columns.
+
+        Returns:
+            tuple[str, ...]: The type of each column, in the given order.
+        """
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                select a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod)
+                from pg_catalog.pg_class k
+                inner join pg_catalog.pg_namespace n
+                    on (k.relnamespace operator(pg_catalog.=) n.oid)
+                inner join pg_catalog.pg_attribute a
+                    on (k.oid operator(pg_catalog.=) a.attrelid)
+                where n.nspname operator(pg_catalog.=) %s
+                and k.relname operator(pg_catalog.=) %s
+                and a.attname operator(pg_catalog.=) any(%s)
+                and a.attnum operator(pg_catalog.>) 0
+            """,
+                (
+                    self.vectorizer.source_schema,
+                    self.vectorizer.source_table,
+                    columns,
+                ),
+            )
+            column_name_to_type = {row[0]: row[1] for row in await cursor.fetchall()}
+        self.round_trips += 1
+        return tuple(column_name_to_type[col] for col in columns)
+
+    async def _get_pk_types(self, conn: AsyncConnection) -> tuple[str, ...]:
+        """
+        Returns the types of the primary key fields, loading them on first
+        use. Queries matching many items at once cast their arrays of primary
+        key values to these types.
+        """
+        if self.pk_types is None:
+            self.pk_types = await self._load_column_types(
+                conn, self.queries.pk_attnames
+            )
+        return self.pk_types
+
+    async def _get_update_types(
+        self, conn: AsyncConnection, destination: ColumnDestination
+    ) -> tuple[str, ...]:
+        """
+        Returns the types of the primary key fields and of the embedding
+        column, loading them on first use. The UPDATE of a column destination
+        casts its arrays to these types.
+        """
+        if self.update_types is None:
+            self.update_types = await self._load_column_types(
+                conn, [*self.queries.pk_attnames, destination.embedding_column]
+            )
+        return self.update_types
+
+    def _pk_arrays(self, items: list[SourceRow]) -> list[list[Any]]:
+        """Returns one array of values per primary key field of the items."""
+        return [[item[pk] for item in items] for pk in self.queries.pk_attnames]
+
+    def _batch_params(
+        self, pk_types: tuple[str, ...], arrays: list[list[Any]]
+    ) -> tuple[int | None, list[Any]]:
+        """
+        Returns the parameters of a query matching many items at once, given
+        one array of values per field: the arrays themselves, or, when a
+        primary key field has an array type, the values row by row, see
+        `Queries.by_row`. Also returns the number of rows to pass to the
+        query in the latter case, or None.
+        """
+        if not self.queries.by_row(pk_types):
+            return None, arrays
+        return len(arrays[0]), [
+            value for row in zip(*arrays, strict=True) for value in row
+        ]
+
     async def _update_source_table(
         self,
         destination: ColumnDestination,
         conn: AsyncConnection,
         records: list[EmbeddingRecord],
     ):
-        async with conn.cursor() as cursor:
-            for record in records:
-                pk_values = record[: len(self.queries.pk_attnames)]
-                embedding = record[-1]  # Last item is the embedding
-                await cursor.execute(
-                    self.queries.update_embedding_query(destination),  # type: ignore
-                    [embedding] + pk_values,
-                )
-
-    async def _write_embeddings(
-        self, conn: AsyncConnection, records: list[EmbeddingRecord]
-    ):
-        if self.vectorizer.config.destination.implementation == "table":
-            await self._copy_embeddings(
-                conn, records, self.vectorizer.config.destination
-            )
+        """
+        Writes the embeddings into the embedding column of the source table
+        with a single UPDATE for all the records.
 
-        if self.vectorizer.config.destination.implementation == "column":
-            await self._update_source_table(
-                self.vectorizer.config.destination, conn, records
+        Args:
+            destination (ColumnDestination): The destination of the embeddings.
+            conn (AsyncConnection): The database connection.
+            records (list[EmbeddingRecord]): The embedding records to write.
+        """
+        if not records:
+            return
+        update_types = await self._get_update_types(conn, destination)
+        pk_count = len(self.queries.pk_attnames)
+        # One array per primary key field, then the embeddings (the last item
+        # of each record), passed row by row for array typed primary keys.
+        arrays = [[record[i] for record in records] for i in range(pk_count)]
+        arrays.append([record[-1] for record in records])
+        rows, params = self._batch_params(update_types[:pk_count], arrays)
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                self.queries.update_embeddings_query(destination, update_types, rows),  # type: ignore
+                params,
             )
 
     async def _insert_vectorizer_error(
@@ -1127,11 +2733,19 @@ class Executor:
         async with conn.cursor() as cursor:
             await cursor.execute(self.queries.insert_errors_query, record)
 
+    def _take_round_trips(self) -> int:
+        """Returns the number of round-trips made since the previous call."""
+        round_trips = self.round_trips - self._reported_round_trips
+        self._reported_round_trips = self.round_trips
+        return round_trips
+
     def _get_item_pk_values(self, item: SourceRow) -> list[Any]:
         return [item[pk] for pk in self.queries.pk_attnames]
 
     async def _generate_embeddings(
-        self, items: list[SourceRow]
+        self,
+        items: list[SourceRow],
+        stored: dict[tuple[Any, ...], Any] | None = None,
     ) -> AsyncGenerator[
         tuple[list[EmbeddingRecord], list[tuple[SourceRow, LoadingError]]], None
     ]:
@@ -1140,6 +2754,8 @@ class Executor:
 
         Args:
             items (list[SourceRow]): The items to generate embeddings for.
+            stored (dict[tuple[Any, ...], Any] | None): The stored embeddings
+                of the items, as returned by `_load_stored_embeddings`.
 
         Returns:
             AsyncGenerator[
@@ -1149,30 +2765,18 @@ class Executor:
                 ], None
             ]: A tuple of embedding records and error records.
         """
-        # Note: deferred import to avoid import overhead
-        import numpy as np
-
-        records_without_embeddings: list[EmbeddingRecord] = []
-        loading_errors: list[tuple[SourceRow, LoadingError]] = []
-        documents: list[str] = []
-        for item in items:
-            pk_values = self._get_item_pk_values(item)
-            try:
-                payload = self.vectorizer.config.loading.load(item)
-            except Exception as e:
-                if self.features.loading_retries:
-                    loading_errors.append((item, (LoadingError(e=e))))
-                continue
-
-            if isinstance(payload, str) and not payload:
-                continue
+        records_without_embeddings, documents, loading_errors = await self._prepare(
+            items
+        )
 
-            payload = self.vectorizer.config.parsing.parse(item, payload)
-            chunks = self.vectorizer.config.chunking.into_chunks(item, payload)
-            for chunk_id, chunk in enumerate(chunks, 0):
-                formatted = self.vectorizer.config.formatting.format(chunk, item)
-                records_without_embeddings.append(pk_values + [chunk_id, formatted])
-                documents.append(formatted)
+        if stored:
+            reused, records_without_embeddings, documents = (
+                self._reuse_stored_embeddings(
+                    stored, records_without_embeddings, documents
+                )
+            )
+            if reused:
+                yield reused, []
 
         if not documents:
             yield [], []
@@ -1180,29 +2784,274 @@ class Executor:
         if loading_errors:
             yield [], loading_errors
 
+        async for records in self._embed_documents(
+            records_without_embeddings, documents
+        ):
+            yield records, []
+
+    async def _load_stored_embeddings(
+        self, conn: AsyncConnection, items: list[SourceRow]
+    ) -> dict[tuple[Any, ...], Any]:
+        """
+        Loads the stored embeddings of the given items, keyed by the item's
+        primary key values and the md5 hash of the chunk. Returns an empty dict
+        unless the vectorizer reuses embeddings and stores them in a table.
+
+        Args:
+            conn (AsyncConnection): The database connection.
+            items (list[SourceRow]): The items whose embeddings to load.
+        """
+        destination = self.vectorizer.config.destination
+        if (
+            not self.vectorizer.config.processing.reuse_embeddings
+            or destination.implementation != "table"
+            or not items
+        ):
+            return {}
+        pk_types = await self._get_pk_types(conn)
+        rows, params = self._batch_params(pk_types, self._pk_arrays(items))
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                self.queries.stored_embeddings_query(destination, pk_types, rows),  # type: ignore
+                params,
+            )
+            self.round_trips += 1
+            return {tuple(row[:-1]): row[-1] for row in await cursor.fetchall()}
+
+    def _reuse_stored_embeddings(
+        self,
+        stored: dict[tuple[Any, ...], Any],
+        records_without_embeddings: list[EmbeddingRecord],
+        documents: list[str],
+    ) -> tuple[list[EmbeddingRecord], list[EmbeddingRecord], list[str]]:
+        """
+        Pairs every chunk whose text is unchanged with its stored embedding.
+
+        Args:
+            stored (dict[tuple[Any, ...], Any]): The stored embeddings, as
+                returned by `_load_stored_embeddings`.
+            records_without_embeddings (list[EmbeddingRecord]): The records
+                waiting for an embedding.
+            documents (list[str]): The formatted chunk of each record.
+
+        Returns:
+            tuple[
+                list[EmbeddingRecord],
+                list[EmbeddingRecord],
+                list[str],
+            ]: The records with a reused embedding, and the records and chunks
+            that still need to be embedded.
+        """
+        if not stored:
+            return [], records_without_embeddings, documents
+        pk_count = len(self.queries.pk_attnames)
+        reused: list[EmbeddingRecord] = []
+        remaining_records: list[EmbeddingRecord] = []
+        remaining_documents: list[str] = []
+        for record, document in zip(records_without_embeddings, documents, strict=True):
+            key = (
+                *record[:pk_count],
+                hashlib.md5(document.encode(), usedforsecurity=False).hexdigest(),
+            )
+            embedding = stored.get(key)
+            if embedding is None:
+                remaining_records.append(record)
+                remaining_documents.append(document)
+            else:
+                reused.append(record + [embedding])
+        logger.debug(
+            "reusing stored embeddings",
+            reused=len(reused),
+            remaining=len(remaining_documents),
+        )
+        return reused, remaining_records, remaining_documents
+
+    def _prepare_documents(self, items: list[SourceRow]) -> PreparedDocuments:
+        """
+        Loads, parses, chunks and formats the given items.
+
+        Args:
+            items (list[SourceRow]): The items to prepare.
+
+        Returns:
+            PreparedDocuments: The records waiting for an embedding, the
+            formatted chunk of each of those records, and the items that
+            failed to load.
+        """
+        return self._preparer(items)
+
+    @cached_property
+    def _preparer(self) -> DocumentPreparer:
+        config = self.vectorizer.config
+        return DocumentPreparer(
+            config.loading,
+            config.parsing,
+            config.chunking,
+            config.formatting,
+            self.queries.pk_attnames,
+            self.features.loading_retries,
+        )
+
+    async def _prepare(self, items: list[SourceRow]) -> PreparedDocuments:
+        """
+        Prepares the given items off the event loop: in the preparing pool if
+        there is one, else in a thread.
+        """
+        if self.preparing_pool is not None:
+            prepared, durations = await self.preparing_pool.prepare_with_durations(
+                self._preparer, items
+            )
+        else:
+            prepared, durations = await asyncio.to_thread(self._preparer.prepare, items)
+        for stage, seconds in durations.items():
+            self._observe_stage(stage, seconds)
+        return prepared
+
+    async def _embed_documents(
+        self, records_without_embeddings: list[EmbeddingRecord], documents: list[str]
+    ) -> AsyncGenerator[list[EmbeddingRecord], None]:
+        """
+        Embeds the formatted chunks and pairs every embedding with its record.
+
+        Every distinct text is sent to the embedding provider once, and its
+        embedding is paired with all the records of that text. With the
+        embedding cache enabled, texts embedded by earlier batches are not
+        sent at all, see `EmbeddingCache`.
+
+        Args:
+            records_without_embeddings (list[EmbeddingRecord]): The records
+                waiting for an embedding.
+            documents (list[str]): The formatted chunk of each record.
+
+        Returns:
+            AsyncGenerator[list[EmbeddingRecord], None]: The records with their
+            embedding appended, one list per embedding request.
+        """
+        # Note: deferred import to avoid import overhead
+        import numpy as np
+
+        start_time = time.perf_counter()
+        embedding_cache = shared_embedding_cache()
+        # the embedding of every distinct text, None until it is embedded
+        embeddings: list[Any] = []
+        texts: list[str] = []
+        positions: dict[str, int] = {}
+        # the position of the text of every record in embeddings
+        record_positions: list[int] = []
+        cache_keys: list[tuple[str, bytes] | None] = []
+        to_embed: list[int] = []
+        for document in documents:
+            position = positions.get(document)
+            if position is None:
+                position = positions[document] = len(embeddings)
+                embedding = None
+                cache_key = None
+                if embedding_cache is not None:
+                    cache_key = (
+                        self._embedding_cache_key,
+                        hashlib.md5(document.encode(), usedforsecurity=False).digest(),
+                    )
+                    embedding = embedding_cache.get(cache_key)
+                embeddings.append(embedding)
+                texts.append(document)
+                cache_keys.append(cache_key)
+                if embedding is None:
+                    to_embed.append(position)
+            record_positions.append(position)
+        self._report_deduplication(len(documents), len(embeddings), len(to_embed))
+
+        next_record = 0
+
+        def ready_records() -> list[EmbeddingRecord]:
+            # The records are passed on in order, as soon as their text is
+            # embedded
+            nonlocal next_record
+            records: list[EmbeddingRecord] = []
+            while (
+                next_record < len(records_without_embeddings)
+                and embeddings[record_positions[next_record]] is not None
+            ):
+                record = records_without_embeddings[next_record]
+                records.append(record + [embeddings[record_positions[next_record]]])
+                next_record += 1
+            return records
+
         try:
-            rwe_take = flexible_take(records_without_embeddings)
-            async for embeddings in self.vectorizer.config.embedding.embed(documents):
-                records: list[EmbeddingRecord] = []
-                for record, embedding in zip(
-                    rwe_take(len(embeddings)), embeddings, strict=True
+            to_embed_take = flexible_take(to_embed)
+            if to_embed:
+                async for batch in self.vectorizer.config.embedding.embed(
+                    [texts[position] for position in to_embed], self.rate_limiter
                 ):
-                    records.append(record + [np.array(embedding)])
-                yield records, []
+                    for position, embedding in zip(
+                        to_embed_take(len(batch)), batch, strict=True
+                    ):
+                        # Rows of an embedding matrix are already float32, so
+                        # they are used without a copy and written out as they
+                        # are by the binary dumper of pgvector.
+                        embeddings[position] = np.asarray(embedding, dtype=np.float32)
+                        cache_key = cache_keys[position]
+                        if embedding_cache is not None and cache_key is not None:
+                            # a row of a matrix is a view that keeps the whole
+                            # matrix alive, so the cache keeps a copy of it
+                            embedding_cache.put(cache_key, embeddings[position].copy())
+                    yield ready_records()
+            else:
+                yield ready_records()
         except Exception as e:
             raise EmbeddingProviderError() from e
+        self._observe_stage("embed", time.perf_counter() - start_time)
+
+    @cached_property
+    def _embedding_cache_key(self) -> str:
+        return self.vectorizer.config.embedding.model_dump_json()
+
+    def _report_deduplication(
+        self, chunk_count: int, distinct_count: int, embed_count: int
+    ) -> None:
+        """Reports how many of the chunks to embed were duplicates of another
+        chunk of the batch, and how many were found in the embedding cache."""
+        duplicates = chunk_count - distinct_count
+        cached = distinct_count - embed_count
+        metrics.DEDUPLICATED_CHUNKS.inc(self.vectorizer.id, "batch", amount=duplicates)
+        metrics.DEDUPLICATED_CHUNKS.inc(self.vectorizer.id, "cache", amount=cached)
+        current_span = tracer.current_span()
+        if current_span:
+            current_span.set_tag("chunks.duplicates", duplicates)
+            current_span.set_tag("chunks.cached", cached)
+        if duplicates or cached:
+            logger.debug(
+                "deduplicated chunks",
+                chunks=chunk_count,
+                duplicates=duplicates,
+                cached=cached,
+                embedded=embed_count,
+            )
 
     async def handle_loading_retries(
         self,
         conn: AsyncConnection,
         loading_errors: list[tuple[SourceRow, LoadingError]],
     ):
+        """
+        Requeues the items that failed to load, or moves them to the failed
+        queue once they are out of retries, and records an error for each.
+        Each of these is written for all the items at once.
+
+        Args:
+            conn (AsyncConnection): The database connection.
+            loading_errors (list[tuple[SourceRow, LoadingError]]): The items
+                that failed to load, with their error.
+        """
+        if not loading_errors:
+            return
+        max_loading_retries = self.vectorizer.config.loading.retries
+        retry: list[SourceRow] = []
+        failed: list[SourceRow] = []
+        errors: list[VectorizerErrorRecord] = []
         for item, e in loading_errors:
-            is_retryable = await self._reinsert_loading_work_to_retry(
-                conn, self.vectorizer.config.loading.retries, item
-            )
-            await self._insert_vectorizer_error(
-                conn,
+            is_retryable = item.get("loading_retries", 0) < max_loading_retries
+            (retry if is_retryable else failed).append(item)
+            errors.append(
                 (
                     self.vectorizer.id,
                     e.msg,
@@ -1213,46 +3062,32 @@ class Executor:
                             "is_retryable": is_retryable,
                         }
                     ),
-                ),
+                )
             )
 
-    async def _reinsert_loading_work_to_retry(
-        self, conn: AsyncConnection, max_loading_retries: int, item: SourceRow
-    ) -> bool:
-        """
-        Requeue the work items that failed to generate embeddings.
-        """
-
-        loading_retries = item.get("loading_retries", 0)
-        if loading_retries >= max_loading_retries:
-            queue_failed_params = {
-                "failure_step": "loading",
-                **{
-                    f"pk{i}": value
-                    for i, value in enumerate(self._get_item_pk_values(item))
-                },
-            }
-
-            async with conn.cursor() as cursor:
+        metrics.LOADING_RETRIES.inc(self.vectorizer.id, amount=len(retry))
+        metrics.LOADING_FAILURES.inc(self.vectorizer.id, amount=len(failed))
+        pk_types = await self._get_pk_types(conn)
+        async with conn.cursor() as cursor:
+            if failed:
+                rows, params = self._batch_params(pk_types, self._pk_arrays(failed))
                 await cursor.execute(
-                    self.queries.insert_queue_failed_query, queue_failed_params
+                    self.queries.insert_queue_failed_query(pk_types, rows),
+                    ["loading", *params],
                 )
-            return False
-
-        reinsert_params = {
-            "loading_retries": loading_retries,
-            **{
-                f"pk{i}": value
-                for i, value in enumerate(self._get_item_pk_values(item))
-            },
-        }
-
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                self.queries.reinsert_work_to_retry_query,
-                reinsert_params,
-            )
-            return True
+            if retry:
+                rows, params = self._batch_params(
+                    pk_types,
+                    [
+                        *self._pk_arrays(retry),
+                        [item.get("loading_retries", 0) for item in retry],
+                    ],
+                )
+                await cursor.execute(
+                    self.queries.reinsert_work_to_retry_query(pk_types, rows),
+                    params,
+                )
+            await cursor.executemany(self.queries.insert_errors_query, errors)
 
 
 TIKTOKEN_CACHE_DIR = os.path.join(
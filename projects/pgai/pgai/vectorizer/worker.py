@@ -1,21 +1,32 @@
 import asyncio
 import datetime
+import math
 import os
 import random
 import sys
+import time
 import traceback
-from collections.abc import Sequence
-from dataclasses import dataclass
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from typing import Any
 
 import psycopg
 import semver
 import structlog
 from psycopg.rows import dict_row, namedtuple_row
+from psycopg_pool import AsyncConnectionPool
 
 from .. import __version__
 from .embeddings import ApiKeyMixin
 from .features import Features
-from .vectorizer import Vectorizer
+from .metrics import serve_metrics
+from .vectorizer import (
+    DEFAULT_CONCURRENCY,
+    PreparingPool,
+    Vectorizer,
+    configure_connection,
+)
 from .worker_tracking import WorkerTracking
 
 if sys.version_info >= (3, 11):
@@ -26,6 +37,15 @@ else:
 
 logger = structlog.get_logger()
 
+# Channels the database notifies when work is queued for a vectorizer, with the
+# queue table as payload, and when a vectorizer changes, with its id as payload.
+QUEUE_CHANNEL = "ai_vectorizer_queue"
+CONFIG_CHANNEL = "ai_vectorizer_config"
+
+# Secrets revealed by the database are used for this many seconds before they
+# are revealed again, so that rotated keys are picked up.
+SECRET_TTL = float(os.getenv("PGAI_VECTORIZER_SECRET_TTL", default="300"))
+
 
 @dataclass
 class Version:
@@ -33,6 +53,23 @@ class Version:
     pgai_lib_version: str | None
 
 
+@dataclass
+class CachedVectorizer:
+    """
+    A row of ai.vectorizer as of its version, which is the xmin of the row and
+    changes with every update of the row. The row is parsed on first use.
+    """
+
+    version: str
+    row: dict[str, Any]
+    vectorizer: Vectorizer | None = None
+    # the embedding config as stored, before any migration of the config
+    embedding: dict[str, Any] = field(init=False)
+
+    def __post_init__(self):
+        self.embedding = self.row["config"]["embedding"]
+
+
 class VectorizerNotFoundError(Exception):
     pass
 
@@ -41,6 +78,48 @@ class ApiKeyNotFoundError(Exception):
     pass
 
 
+class VectorizerScheduler:
+    """
+    Decides which vectorizers with pending work get the next time slice.
+
+    Vectorizers are ranked by how long they have been waiting for a slice,
+    measured in slices, minus the order of magnitude of their queue depth. A
+    queue with a handful of items is therefore picked ahead of a large
+    backfill, while the backfill gains priority for every slice it waits and
+    can't be starved.
+    """
+
+    # ai.vectorizer_queue_pending stops counting at this depth
+    MAX_QUEUE_DEPTH = 10001
+
+    def __init__(self, time_slice: float):
+        self.time_slice = time_slice
+        self.waiting_since: dict[int, float] = {}
+
+    def order(self, pending: dict[int, int], now: float) -> list[int]:
+        """Returns the ids of the vectorizers with pending work, most urgent
+        first."""
+        for vectorizer_id in list(self.waiting_since):
+            if pending.get(vectorizer_id, 0) <= 0:
+                del self.waiting_since[vectorizer_id]
+
+        def priority(vectorizer_id: int) -> float:
+            waited = now - self.waiting_since.setdefault(vectorizer_id, now)
+            depth = min(pending[vectorizer_id], self.MAX_QUEUE_DEPTH)
+            return waited / self.time_slice - math.log10(1 + depth)
+
+        candidates = [
+            vectorizer_id for vectorizer_id, depth in pending.items() if depth > 0
+        ]
+        return sorted(candidates, key=priority, reverse=True)
+
+    def started(self, vectorizer_id: int) -> None:
+        self.waiting_since.pop(vectorizer_id, None)
+
+    def stopped(self, vectorizer_id: int, now: float) -> None:
+        self.waiting_since[vectorizer_id] = now
+
+
 def warn_on_old_version(version: Version):
     if version.pgai_lib_version is None:
         if (
@@ -60,6 +139,9 @@ def warn_on_old_version(version: Version):
 
 
 class Worker:
+    # the clock that full rounds are timed by
+    _clock = staticmethod(time.monotonic)
+
     def __init__(
         self,
         db_url: str,
@@ -68,6 +150,12 @@ class Worker:
         vectorizer_ids: Sequence[int] = [],
         exit_on_error: bool | None = None,
         concurrency: int | None = None,
+        pipeline_depth: int | None = None,
+        max_concurrency: int | None = None,
+        time_slice: datetime.timedelta = datetime.timedelta(seconds=30),
+        parsing_processes: int | None = None,
+        shard_queue: bool = False,
+        metrics_port: int | None = None,
     ):
         self.vectorizer_ids = vectorizer_ids
         self.db_url = db_url
@@ -75,13 +163,87 @@ class Worker:
         self.once = once
         self.exit_on_error = exit_on_error
         self.concurrency = concurrency
+        self.pipeline_depth = pipeline_depth
+        self.max_concurrency = max_concurrency
+        self.time_slice = time_slice.total_seconds()
+        self.parsing_processes = parsing_processes
+        self.shard_queue = shard_queue
+        self.metrics_port = metrics_port
+        self.metrics_server: asyncio.Server | None = None
+        self.preparing_pool: PreparingPool | None = None
         self.shutdown_requested = asyncio.Event()
+        self.pool: AsyncConnectionPool | None = None
+
+        # state shared with the task listening for notifications
+        self.listening = False
+        self._wake_up = asyncio.Event()
+        self._woken: set[int] = set()
+        # notified rounds only run some vectorizers, a full round runs them all
+        self._full_round_at = self._clock()
+        self._changed: set[int] = set()
+        self._queues: dict[str, int] = {}
+        self._vectorizers: dict[int, CachedVectorizer] = {}
+        self._secrets: dict[str, tuple[str, float]] = {}
+        self._listener: asyncio.Task[None] | None = None
 
         self.dynamic_mode = len(self.vectorizer_ids) == 0
         if once and exit_on_error is None:
             # once implies exit-on-error
             self.exit_on_error = True
 
+    def _pool_size(self, concurrency: int) -> int:
+        """
+        The number of connections needed to run a vectorizer with the given
+        concurrency: one per Executor, plus one per batch in flight when
+        pipelining, plus one for loading configuration, tracking and
+        reserving embedding rate limits.
+        """
+        return concurrency * (1 + (self.pipeline_depth or 0)) + 1
+
+    async def _open_pool(self) -> AsyncConnectionPool:
+        """
+        Opens the connection pool shared by the Executors, the worker tracking
+        and the configuration loading. Connections are opened on demand, up to
+        the size needed for `--max-concurrency` or `--concurrency`.
+        """
+
+        async def reset(conn: psycopg.AsyncConnection) -> None:
+            # Executors name their connections after the vectorizer they run
+            await conn.execute("reset application_name")
+
+        pool: AsyncConnectionPool = AsyncConnectionPool(
+            self.db_url,
+            kwargs={"autocommit": True, "application_name": "pgai-worker"},
+            min_size=1,
+            max_size=self._pool_size(
+                self.max_concurrency or self.concurrency or DEFAULT_CONCURRENCY
+            ),
+            open=False,
+            configure=configure_connection,
+            check=AsyncConnectionPool.check_connection,
+            reset=reset,
+        )
+        await pool.open()
+        return pool
+
+    async def _resize_pool(self, concurrency: int) -> None:
+        """Grows the pool when a vectorizer runs with more Executors than it
+        was sized for."""
+        size = self._pool_size(concurrency)
+        if self.pool is not None and size > self.pool.max_size:
+            await self.pool.resize(self.pool.min_size, size)
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Yields a connection from the pool, or a new one if the pool is not
+        open yet."""
+        if self.pool is not None:
+            async with self.pool.connection() as con:
+                yield con
+        else:
+            async with await psycopg.AsyncConnection.connect(self.db_url) as con:
+                yield con
+
     @staticmethod
     def _get_pgai_version(cur: psycopg.Cursor) -> Version | None:
         cur.execute(
@@ -109,50 +271,80 @@ class Worker:
             pgai_lib_version = row[0] if row is not None else None
         return Version(ext_version, pgai_lib_version)
 
-    def _get_vectorizer(self, vectorizer_id: int, features: Features) -> Vectorizer:
-        with (
-            psycopg.Connection.connect(self.db_url) as con,
+    async def _get_vectorizer(
+        self, vectorizer_id: int, features: Features
+    ) -> Vectorizer:
+        changed = vectorizer_id in self._changed
+        self._changed.discard(vectorizer_id)
+        cached = self._vectorizers.get(vectorizer_id)
+        if cached is None or changed:
+            cached = self._vectorizers[vectorizer_id] = await self._fetch_vectorizer(
+                vectorizer_id
+            )
+        if cached.vectorizer is None:
+            cached.vectorizer = Vectorizer.model_validate(cached.row)
+        vectorizer = cached.vectorizer
+        embedding = cached.embedding
+
+        # The Ollama API doesn't need a key, so `api_key_name` may be unset
+        if "api_key_name" in embedding:
+            api_key_name = embedding["api_key_name"]
+            api_key = await self._get_secret(api_key_name, features)
+            if not api_key:
+                raise ApiKeyNotFoundError(
+                    f"api_key_name={api_key_name} vectorizer_id={vectorizer_id}"
+                )
+            secrets: dict[str, str | None] = {api_key_name: api_key}
+            # The Ollama API doesn't need a key, so doesn't inherit `ApiKeyMixin`
+            if isinstance(vectorizer.config.embedding, ApiKeyMixin):
+                vectorizer.config.embedding.set_api_key(secrets)
+            else:
+                logger.error(
+                    f"cannot set secret value '{api_key_name}' for vectorizer with id: '{vectorizer.id}'"
+                )
+        return vectorizer
+
+    async def _fetch_vectorizer(self, vectorizer_id: int) -> CachedVectorizer:
+        async with (
+            self._connection() as con,
             con.cursor(row_factory=dict_row) as cur,
         ):
-            cur.execute(
-                "select pg_catalog.to_jsonb(v) as vectorizer from ai.vectorizer v where v.id = %s",
+            await cur.execute(
+                """
+                select v.xmin::text as version, pg_catalog.to_jsonb(v) as vectorizer
+                from ai.vectorizer v where v.id = %s
+                """,
                 (vectorizer_id,),
             )
-            row = cur.fetchone()
+            row = await cur.fetchone()
             if row is None:
+                self._vectorizers.pop(vectorizer_id, None)
                 raise VectorizerNotFoundError(f"vectorizer_id={vectorizer_id}")
-            vectorizer = row["vectorizer"]
-            embedding = vectorizer["config"]["embedding"]
-            vectorizer = Vectorizer.model_validate(vectorizer)
-
-            # The Ollama API doesn't need a key, so `api_key_name` may be unset
-            if "api_key_name" in embedding:
-                api_key_name = embedding["api_key_name"]
-                api_key = os.getenv(api_key_name, None)
-                if api_key is not None:
-                    logger.debug(f"obtained secret '{api_key_name}' from environment")
-                elif features.db_reveal_secrets:
-                    cur.execute(
-                        "select ai.reveal_secret(%s)",
-                        (api_key_name,),
-                    )
-                    row = cur.fetchone()
-                    api_key = row["reveal_secret"] if row is not None else None
-                    if api_key is not None:
-                        logger.debug(f"obtained secret '{api_key_name}' from database")
-                if not api_key:
-                    raise ApiKeyNotFoundError(
-                        f"api_key_name={api_key_name} vectorizer_id={vectorizer_id}"
-                    )
-                secrets: dict[str, str | None] = {api_key_name: api_key}
-                # The Ollama API doesn't need a key, so doesn't inherit `ApiKeyMixin`
-                if isinstance(vectorizer.config.embedding, ApiKeyMixin):
-                    vectorizer.config.embedding.set_api_key(secrets)
-                else:
-                    logger.error(
-                        f"cannot set secret value '{api_key_name}' for vectorizer with id: '{vectorizer.id}'"
-                    )
-            return vectorizer
+            return CachedVectorizer(row["version"], row["vectorizer"])
+
+    async def _get_secret(self, api_key_name: str, features: Features) -> str | None:
+        """Gets a secret from the environment, or else from the database, where
+        it's revealed at most once per SECRET_TTL seconds."""
+        api_key = os.getenv(api_key_name, None)
+        if api_key is not None:
+            logger.debug(f"obtained secret '{api_key_name}' from environment")
+            return api_key
+        if not features.db_reveal_secrets:
+            return None
+        cached = self._secrets.get(api_key_name)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        async with (
+            self._connection() as con,
+            con.cursor(row_factory=dict_row) as cur,
+        ):
+            await cur.execute("select ai.reveal_secret(%s)", (api_key_name,))
+            row = await cur.fetchone()
+            api_key = row["reveal_secret"] if row is not None else None
+        if api_key is not None:
+            logger.debug(f"obtained secret '{api_key_name}' from database")
+            self._secrets[api_key_name] = (api_key, time.monotonic() + SECRET_TTL)
+        return api_key
 
     async def _handle_error(
         self,
@@ -172,28 +364,306 @@ class Worker:
             logger.info("exiting processor due to error")
         return Exception(error_message)
 
-    def _get_vectorizer_ids(
+    async def _handle_run_exception(
+        self,
+        e: BaseException,
+        vectorizer_id: int | None,
+        worker_tracking: WorkerTracking | None,
+    ) -> Exception:
+        """Logs an unexpected exception raised while running a vectorizer and
+        records it as an error of that vectorizer."""
+        if isinstance(e, psycopg.OperationalError):
+            if "connection failed" in str(e):
+                err_msg = f"unable to connect to database: {str(e)}"
+            else:
+                err_msg = f"unexpected error: {str(e)}"
+            return await self._handle_error(err_msg, vectorizer_id, worker_tracking)
+        if isinstance(e, BaseExceptionGroup):
+            for exception in e.exceptions:  # type: ignore
+                error_msg = str(exception)  # type: ignore
+                logger.error(error_msg, vectorizer_id=vectorizer_id)
+        for exception_line in traceback.format_exception(e):  # type: ignore
+            for line in exception_line.rstrip().split("\n"):
+                logger.debug(line)
+        err_msg = f"unexpected error: {str(e)}"  # type: ignore
+        return await self._handle_error(err_msg, vectorizer_id, worker_tracking)
+
+    async def _get_vectorizer_ids(
         self, vectorizer_ids: Sequence[int] | None = None
     ) -> list[int]:
-        with (
-            psycopg.Connection.connect(self.db_url) as con,
+        async with (
+            self._connection() as con,
             con.cursor(row_factory=namedtuple_row) as cur,
         ):
             valid_vectorizer_ids: list[int] = []
+            # the rows are only sent again when their version changed
+            query = """
+                select v.id, v.queue_schema, v.queue_table, v.xmin::text
+                , case when (v.id, v.xmin::text) in
+                    (select * from pg_catalog.unnest(%s::int4[], %s::text[]))
+                  then null
+                  else pg_catalog.to_jsonb(v)
+                  end
+                from ai.vectorizer v
+            """
+            cached = list(self._vectorizers.items())
+            params: list[Any] = [
+                [vectorizer_id for vectorizer_id, _ in cached],
+                [vectorizer.version for _, vectorizer in cached],
+            ]
             if vectorizer_ids is None or len(vectorizer_ids) == 0:
-                cur.execute("select id from ai.vectorizer")
+                await cur.execute(query, params)
             else:
-                cur.execute(
-                    "select id from ai.vectorizer where id = any(%s)",
+                await cur.execute(
+                    query + "where v.id = any(%s)",
                     [
+                        *params,
                         list(vectorizer_ids),
                     ],
                 )
-            for row in cur.fetchall():
+            self._queues = {}
+            vectorizers: dict[int, CachedVectorizer] = {}
+            for row in await cur.fetchall():
                 valid_vectorizer_ids.append(row[0])
+                self._queues[f"{row[1]}.{row[2]}"] = row[0]
+                vectorizers[row[0]] = (
+                    self._vectorizers[row[0]]
+                    if row[4] is None
+                    else CachedVectorizer(row[3], row[4])
+                )
+            self._vectorizers = vectorizers
             random.shuffle(valid_vectorizer_ids)
             return valid_vectorizer_ids
 
+    async def _get_queue_depths(self, vectorizer_ids: Sequence[int]) -> dict[int, int]:
+        async with (
+            self._connection() as con,
+            con.cursor(row_factory=namedtuple_row) as cur,
+        ):
+            await cur.execute(
+                """
+                select v.id, ai.vectorizer_queue_pending(v.id)
+                from ai.vectorizer v
+                where v.id = any(%s)
+                """,
+                (list(vectorizer_ids),),
+            )
+            return {row[0]: row[1] for row in await cur.fetchall()}
+
+    async def _run_scheduled(
+        self,
+        vectorizer_ids: Sequence[int],
+        features: Features,
+        worker_tracking: WorkerTracking,
+    ) -> Exception | None:
+        """
+        Runs the vectorizers concurrently until none of them has pending work.
+
+        Each vectorizer runs for at most one time slice before it's put back in
+        line, and vectorizers are only started while the Executors of all the
+        running vectorizers fit in `--max-concurrency`. A vectorizer that
+        stops before its time slice is over has no work that can be processed
+        right now, and isn't started again until the next poll.
+        """
+        assert self.max_concurrency is not None
+        budget = self.max_concurrency
+        await self._resize_pool(budget)
+        scheduler = VectorizerScheduler(self.time_slice)
+        running: dict[asyncio.Task[int], tuple[int, int, float]] = {}
+        drained: set[int] = set()
+
+        async def run_slice(
+            vectorizer: Vectorizer, concurrency: int, deadline: float
+        ) -> int:
+            def should_continue(_: int, __: int) -> bool:
+                return (
+                    self._should_continue(vectorizer.id) and time.monotonic() < deadline
+                )
+
+            return await vectorizer.run(
+                db_url=self.db_url,
+                features=features,
+                worker_tracking=worker_tracking,
+                concurrency=concurrency,
+                should_continue_processing_hook=should_continue,
+                pipeline_depth=self.pipeline_depth,
+                pool=self.pool,
+                disabled_check_interval=self._disabled_check_interval(features),
+                preparing_pool=self.preparing_pool,
+                shard_queue=self.shard_queue,
+            )
+
+        try:
+            while not self.shutdown_requested.is_set():
+                idle = [
+                    vectorizer_id
+                    for vectorizer_id in vectorizer_ids
+                    if vectorizer_id not in drained
+                    and all(vectorizer_id != v for v, _, _ in running.values())
+                ]
+                pending = await self._get_queue_depths(idle) if idle else {}
+                used = sum(concurrency for _, concurrency, _ in running.values())
+                for vectorizer_id in scheduler.order(pending, time.monotonic()):
+                    try:
+                        vectorizer = await self._get_vectorizer(vectorizer_id, features)
+                    except (VectorizerNotFoundError, ApiKeyNotFoundError) as e:
+                        err_msg = (
+                            f"error getting vectorizer: {type(e).__name__}: {str(e)}"
+                        )
+                        exception = await self._handle_error(
+                            err_msg, vectorizer_id, worker_tracking
+                        )
+                        if self.exit_on_error:
+                            return exception
+                        drained.add(vectorizer_id)
+                        continue
+                    concurrency = min(
+                        self.concurrency or vectorizer.config.processing.concurrency,
+                        budget,
+                    )
+                    if running and used + concurrency > budget:
+                        break
+                    logger.info(
+                        "running vectorizer",
+                        vectorizer_id=vectorizer_id,
+                        queue_depth=pending[vectorizer_id],
+                    )
+                    scheduler.started(vectorizer_id)
+                    deadline = time.monotonic() + self.time_slice
+                    task = asyncio.create_task(
+                        run_slice(vectorizer, concurrency, deadline)
+                    )
+                    running[task] = (vectorizer_id, concurrency, deadline)
+                    used += concurrency
+
+                if not running:
+                    return None
+
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    vectorizer_id, _, deadline = running.pop(task)
+                    now = time.monotonic()
+                    scheduler.stopped(vectorizer_id, now)
+                    exception = task.exception()
+                    if exception is not None:
+                        drained.add(vectorizer_id)
+                        exception = await self._handle_run_exception(
+                            exception, vectorizer_id, worker_tracking
+                        )
+                        if self.exit_on_error:
+                            return exception
+                    elif task.result() == 0 or now < deadline:
+                        drained.add(vectorizer_id)
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
+
+    def _should_continue(self, vectorizer_id: int) -> bool:
+        """Whether a running vectorizer should keep processing batches. A
+        vectorizer whose configuration changed stops, and is loaded again by
+        the next round."""
+        return (
+            not self.shutdown_requested.is_set() and vectorizer_id not in self._changed
+        )
+
+    def _disabled_check_interval(self, features: Features) -> float:
+        """While the worker is notified of vectorizer changes, the Executors
+        only check whether their vectorizer was disabled once per poll
+        interval, as a fallback."""
+        if self.listening and features.vectorizer_notifications:
+            return self.poll_interval
+        return 0
+
+    def _on_notification(self, channel: str, payload: str) -> None:
+        if channel == QUEUE_CHANNEL:
+            vectorizer_id = self._queues.get(payload)
+            if vectorizer_id is None:
+                # not one of the vectorizers this worker processes
+                return
+        else:
+            try:
+                vectorizer_id = int(payload)
+            except ValueError:
+                logger.warning(
+                    "ignoring notification", channel=channel, payload=payload
+                )
+                return
+            self._changed.add(vectorizer_id)
+        logger.debug("got notification", channel=channel, vectorizer_id=vectorizer_id)
+        self._woken.add(vectorizer_id)
+        self._wake_up.set()
+
+    async def _listen(self) -> None:
+        """
+        Listens for notifications of queued work and vectorizer changes, and
+        wakes up the worker for the vectorizers they concern. When the
+        connection is lost, the worker falls back to polling until it's
+        listening again, and then checks all vectorizers for missed work.
+        """
+        reconnecting = False
+        while not self.shutdown_requested.is_set():
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    self.db_url, autocommit=True, application_name="pgai-worker"
+                ) as conn:
+                    await conn.execute(f"listen {QUEUE_CHANNEL}")
+                    await conn.execute(f"listen {CONFIG_CHANNEL}")
+                    self.listening = True
+                    if reconnecting:
+                        self._woken.clear()
+                        self._wake_up.set()
+                    async for notify in conn.notifies():
+                        self._on_notification(notify.channel, notify.payload)
+            except psycopg.Error as e:
+                logger.warning(f"stopped listening for notifications: {e}")
+            finally:
+                self.listening = False
+            reconnecting = True
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self.shutdown_requested.wait(), timeout=self.poll_interval
+                )
+
+    async def _wait_for_work(self) -> set[int] | None:
+        """
+        Sleeps until the poll interval since the last full round is over, a
+        notification comes in or a shutdown is requested.
+
+        A full round runs at least once per poll interval, however often
+        vectorizers are notified, so that the others still get their loading
+        retries, expired leases and work queued while no one was listening.
+
+        Returns:
+            The ids of the vectorizers that were notified, or None if all
+            vectorizers should be checked for work.
+        """
+        deadline = self._full_round_at + self.poll_interval
+        if not self._wake_up.is_set():
+            waits = [
+                asyncio.create_task(self.shutdown_requested.wait()),
+                asyncio.create_task(self._wake_up.wait()),
+            ]
+            await asyncio.wait(
+                waits,
+                timeout=max(0, deadline - self._clock()),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for wait in waits:
+                wait.cancel()
+        woken = self._woken
+        self._woken = set()
+        self._wake_up.clear()
+        # waking up without notified vectorizers means notifications were missed
+        if not woken or self._clock() >= deadline:
+            self._full_round_at = self._clock()
+            return None
+        return woken
+
     async def request_graceful_shutdown(self):
         """
         Request a graceful shutdown of the processor.
@@ -201,6 +671,30 @@ class Worker:
         self.shutdown_requested.set()
 
     async def run(self) -> Exception | None:
+        if self.metrics_port is not None:
+            self.metrics_server = await serve_metrics(self.metrics_port)
+        if self.parsing_processes:
+            self.preparing_pool = PreparingPool(self.parsing_processes)
+        try:
+            return await self._run()
+        finally:
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+                await self.metrics_server.wait_closed()
+                self.metrics_server = None
+            if self.preparing_pool is not None:
+                await asyncio.to_thread(self.preparing_pool.shutdown)
+                self.preparing_pool = None
+            if self._listener is not None:
+                self._listener.cancel()
+                with suppress(asyncio.CancelledError):
+                    await self._listener
+                self._listener = None
+            if self.pool is not None:
+                await self.pool.close()
+                self.pool = None
+
+    async def _run(self) -> Exception | None:
         logger.debug("starting vectorizer worker")
 
         valid_vectorizer_ids = []
@@ -208,6 +702,7 @@ class Worker:
         pgai_version = None
         features = None
         worker_tracking = None
+        woken: set[int] | None = None
 
         while not self.shutdown_requested.is_set():
             vectorizer_id = None
@@ -231,17 +726,29 @@ class Worker:
                         else:
                             warn_on_old_version(pgai_version)
                             features = Features.from_db(cur)
+                            if self.pool is None:
+                                self.pool = await self._open_pool()
                             worker_tracking = WorkerTracking(
-                                self.db_url, self.poll_interval, features, __version__
+                                self.db_url,
+                                self.poll_interval,
+                                features,
+                                __version__,
+                                self.pool,
                             )
                             await worker_tracking.start()
                             can_connect = True
+                            if (
+                                features.vectorizer_notifications
+                                and not self.once
+                                and self._listener is None
+                            ):
+                                self._listener = asyncio.create_task(self._listen())
 
                 if can_connect and features is not None and worker_tracking is not None:
                     if not self.dynamic_mode and len(valid_vectorizer_ids) != len(
                         self.vectorizer_ids
                     ):
-                        valid_vectorizer_ids = self._get_vectorizer_ids(
+                        valid_vectorizer_ids = await self._get_vectorizer_ids(
                             self.vectorizer_ids,
                         )
                         if len(valid_vectorizer_ids) != len(self.vectorizer_ids):
@@ -254,68 +761,80 @@ class Worker:
                             if self.exit_on_error:
                                 return exception
                     else:
-                        valid_vectorizer_ids = self._get_vectorizer_ids(
+                        valid_vectorizer_ids = await self._get_vectorizer_ids(
                             self.vectorizer_ids,
                         )
                         if len(valid_vectorizer_ids) == 0:
                             logger.warning("no vectorizers found")
 
-                    for vectorizer_id in valid_vectorizer_ids:
-                        try:
-                            vectorizer = self._get_vectorizer(vectorizer_id, features)
-                        except (VectorizerNotFoundError, ApiKeyNotFoundError) as e:
-                            err_msg = f"error getting vectorizer: {type(e).__name__}: {str(e)}"
-                            exception = await self._handle_error(
-                                err_msg, vectorizer_id, worker_tracking
+                    # after a notification, only the notified vectorizers
+                    round_vectorizer_ids = [
+                        vectorizer_id
+                        for vectorizer_id in valid_vectorizer_ids
+                        if woken is None or vectorizer_id in woken
+                    ]
+                    if self.max_concurrency is not None:
+                        exception = await self._run_scheduled(
+                            round_vectorizer_ids, features, worker_tracking
+                        )
+                        if exception is not None:
+                            return exception
+                    else:
+                        for vectorizer_id in round_vectorizer_ids:
+                            try:
+                                vectorizer = await self._get_vectorizer(
+                                    vectorizer_id, features
+                                )
+                            except (VectorizerNotFoundError, ApiKeyNotFoundError) as e:
+                                err_msg = f"error getting vectorizer: {type(e).__name__}: {str(e)}"
+                                exception = await self._handle_error(
+                                    err_msg, vectorizer_id, worker_tracking
+                                )
+                                if self.exit_on_error:
+                                    return exception
+                                break
+
+                            logger.info(
+                                "running vectorizer", vectorizer_id=vectorizer_id
                             )
-                            if self.exit_on_error:
-                                return exception
-                            break
 
-                        logger.info("running vectorizer", vectorizer_id=vectorizer_id)
+                            def should_continue(
+                                _: int, __: int, vectorizer_id: int = vectorizer_id
+                            ) -> bool:
+                                return self._should_continue(vectorizer_id)
 
-                        def should_continue(_: int, __: int) -> bool:
-                            return not self.shutdown_requested.is_set()
-
-                        await vectorizer.run(
-                            db_url=self.db_url,
-                            features=features,
-                            worker_tracking=worker_tracking,
-                            concurrency=self.concurrency,
-                            should_continue_processing_hook=should_continue,
-                        )
-            except psycopg.OperationalError as e:
-                if "connection failed" in str(e):
-                    err_msg = f"unable to connect to database: {str(e)}"
-                else:
-                    err_msg = f"unexpected error: {str(e)}"
-                exception = await self._handle_error(
-                    err_msg, vectorizer_id, worker_tracking
-                )
-                if self.exit_on_error:
-                    return exception
+                            concurrency = (
+                                self.concurrency
+                                or vectorizer.config.processing.concurrency
+                            )
+                            await self._resize_pool(concurrency)
+                            await vectorizer.run(
+                                db_url=self.db_url,
+                                features=features,
+                                worker_tracking=worker_tracking,
+                                concurrency=self.concurrency,
+                                should_continue_processing_hook=should_continue,
+                                pipeline_depth=self.pipeline_depth,
+                                pool=self.pool,
+                                disabled_check_interval=(
+                                    self._disabled_check_interval(features)
+                                ),
+                                preparing_pool=self.preparing_pool,
+                                shard_queue=self.shard_queue,
+                            )
             except BaseExceptionGroup as e:  # type: ignore
                 # catch any exceptions, log them, and keep on going
-                for exception in e.exceptions:  # type: ignore
-                    error_msg = str(exception)  # type: ignore
-                    logger.error(error_msg, vectorizer_id=vectorizer_id)
-                for exception_line in traceback.format_exception(e):  # type: ignore
-                    for line in exception_line.rstrip().split("\n"):
-                        logger.debug(line)
-                err_msg = f"unexpected error: {str(e)}"  # type: ignore
-                exception = await self._handle_error(
-                    err_msg, vectorizer_id, worker_tracking
+                exception = await self._handle_run_exception(
+                    e,  # type: ignore
+                    vectorizer_id,
+                    worker_tracking,
                 )
                 if self.exit_on_error:
                     return exception
             except Exception as e:
                 # catch any exceptions, log them, and keep on going
-                for exception_line in traceback.format_exception(e):
-                    for line in exception_line.rstrip().split("\n"):
-                        logger.debug(line)
-                err_msg = f"unexpected error: {str(e)}"
-                exception = await self._handle_error(
-                    err_msg, vectorizer_id, worker_tracking
+                exception = await self._handle_run_exception(
+                    e, vectorizer_id, worker_tracking
                 )
                 if self.exit_on_error:
                     return exception
@@ -328,15 +847,10 @@ class Worker:
 
             poll_interval_str = datetime.timedelta(seconds=self.poll_interval)
             logger.info(f"sleeping for {poll_interval_str} before polling for new work")
-            try:
-                await asyncio.wait_for(
-                    self.shutdown_requested.wait(), timeout=self.poll_interval
-                )
+            woken = await self._wait_for_work()
+            if self.shutdown_requested.is_set():
                 # shutdown event was set, the loop should exit
                 logger.info("got a graceful shutdown request")
-            except asyncio.TimeoutError:
-                # timeout means the sleep completed
-                pass
 
         if worker_tracking is not None:
             await worker_tracking.force_last_heartbeat_and_stop()
@@ -1,9 +1,13 @@
 import asyncio
 import datetime
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
 from uuid import UUID
 
 import psycopg
 import structlog
+from psycopg_pool import AsyncConnectionPool
 
 from ..features import Features
 
@@ -12,14 +16,23 @@ log = structlog.get_logger()
 
 class WorkerTracking:
     def __init__(
-        self, db_url: str, poll_interval: int, features: Features, version: str
+        self,
+        db_url: str,
+        poll_interval: int,
+        features: Features,
+        version: str,
+        pool: AsyncConnectionPool | None = None,
     ):
         self.db_url = db_url
+        self.pool = pool
         self.poll_interval = poll_interval
         self.worker_id: UUID | None = None
         self.num_errors_since_last_heartbeat = 0
         self.error_message = None
         self.enabled = features.worker_tracking
+        self.shards_enabled = self.enabled and features.queue_shards
+        # (shard, shard_count) of this worker among the live workers
+        self.shard: tuple[int, int] | None = None
         self.version = version
         self.num_successes_since_last_heartbeat = 0
         self.heartbeat_task: asyncio.Task[None] | None = None
@@ -32,7 +45,7 @@ class WorkerTracking:
         log.debug("starting worker tracking", version=self.version)
 
         async with (
-            await psycopg.AsyncConnection.connect(self.db_url, autocommit=True) as conn,
+            self._connection("pgai-worker-start") as conn,
             conn.cursor() as cur,
             conn.transaction(),
         ):
@@ -45,9 +58,24 @@ class WorkerTracking:
             if res is None:
                 raise Exception("Failed to start worker tracking")
             self.worker_id = res[0]
+            await self._refresh_shard(cur)
 
         self.heartbeat_task = asyncio.create_task(self.heartbeat())
 
+    @asynccontextmanager
+    async def _connection(
+        self, application_name: str
+    ) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Yields an autocommit connection, taken from the pool if there is one."""
+        if self.pool is not None:
+            async with self.pool.connection() as conn:
+                yield conn
+        else:
+            async with await psycopg.AsyncConnection.connect(
+                self.db_url, autocommit=True, application_name=application_name
+            ) as conn:
+                yield conn
+
     def get_short_worker_id(self) -> str:
         # Return first segment of UUID (before first hyphen)
         return str(self.worker_id).split("-")[0] if self.worker_id else ""
@@ -64,10 +92,8 @@ class WorkerTracking:
             self.heartbeat_task.cancel()
             self.heartbeat_task = None
 
-        async with await psycopg.AsyncConnection.connect(
-            self.db_url,
-            autocommit=True,
-            application_name=f"pgai-worker-heartbeat-force: {self.get_short_worker_id()}",
+        async with self._connection(
+            f"pgai-worker-heartbeat-force: {self.get_short_worker_id()}"
         ) as conn:
             await self._heartbeat(conn)
 
@@ -83,6 +109,19 @@ class WorkerTracking:
                 "select ai._worker_heartbeat(%s, %s, %s, %s)",
                 (self.worker_id, num_successes, num_errors, error_message),
             )
+            await self._refresh_shard(cur)
+
+    async def _refresh_shard(self, cur: psycopg.AsyncCursor[Any]) -> None:
+        """Updates the share of the queues this worker claims work from, as
+        workers come and go."""
+        if not self.shards_enabled:
+            return
+        await cur.execute(
+            "select shard, shard_count from ai._worker_shard(%s)", (self.worker_id,)
+        )
+        res = await cur.fetchone()
+        if res is not None and res[0] is not None:
+            self.shard = (res[0], res[1])
 
     async def heartbeat(self) -> None:
         if not self.enabled:
@@ -119,17 +158,27 @@ class WorkerTracking:
         vectorizer_id: int,
         num_successes: int,
     ) -> None:
+        """Records the progress of the worker for a vectorizer. Runs in the
+        transaction open on `conn`, if any, so that progress is reported
+        together with the writes of a batch and without round-trips of its
+        own. The successes only count towards the next heartbeat once the
+        caller committed them, see `count_successes`."""
         if not self.enabled:
             return
 
-        self.num_successes_since_last_heartbeat += num_successes
-
-        async with conn.cursor() as cur, conn.transaction():
+        async with conn.cursor() as cur:
             await cur.execute(
                 "select ai._worker_progress(%s, %s, %s, NULL)",
                 (self.worker_id, vectorizer_id, num_successes),
             )
 
+    def count_successes(self, num_successes: int) -> None:
+        """Adds committed successes to those reported by the next heartbeat."""
+        if not self.enabled:
+            return
+
+        self.num_successes_since_last_heartbeat += num_successes
+
     async def save_vectorizer_error(
         self, vectorizer_id: int | None, error_message: str
     ) -> None:
@@ -142,10 +191,8 @@ class WorkerTracking:
             return
 
         async with (
-            await psycopg.AsyncConnection.connect(
-                self.db_url,
-                autocommit=True,
-                application_name=f"pgai-worker-error-reporter: {self.get_short_worker_id()}",
+            self._connection(
+                f"pgai-worker-error-reporter: {self.get_short_worker_id()}"
             ) as conn,
             conn.cursor() as cur,
             conn.transaction(),
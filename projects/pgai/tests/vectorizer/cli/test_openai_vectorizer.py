@@ -134,6 +134,121 @@ def test_process_vectorizer(
         assert cur.fetchone() is None
 
 
+@pytest.mark.parametrize(
+    "extra_params,leased",
+    [
+        (["--pipeline-depth", "2"], False),
+        ([], True),
+        (["--pipeline-depth", "2"], True),
+        (["--max-concurrency", "3"], False),
+    ],
+    ids=["pipelined", "leased", "leased-pipelined", "scheduled"],
+)
+def test_process_vectorizer_executor_modes(
+    cli_db: tuple[TestDatabase, Connection],
+    cli_db_url: str,
+    vcr_: Any,
+    extra_params: list[str],
+    leased: bool,
+):
+    """Test that every way of running the Executors embeds every item once"""
+    _, conn = cli_db
+    vectorizer_id = configure_openai_vectorizer(
+        cli_db[1], number_of_rows=4, concurrency=2, batch_size=2
+    )
+    if leased:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE ai.vectorizer
+                SET config = jsonb_set(config, '{processing,lease_seconds}', '60'::jsonb)
+                WHERE id = %s
+            """,
+                (vectorizer_id,),
+            )
+            # A lease left behind by a worker that died is picked up again
+            cur.execute("""
+                UPDATE ai._vectorizer_q_1
+                SET lease_id = gen_random_uuid(),
+                    lease_expires_at = now() - interval '1 minute'
+                WHERE id = 1
+            """)
+
+    # The requests are the same as for the serial worker, so reuse its cassette
+    cassette = (
+        "openai-character_text_splitter-chunk_value-"
+        "items=4-batch_size=2-custom_base_url=False.yaml"
+    )
+    with vcr_.use_cassette(cassette):
+        result = run_vectorizer_worker(
+            cli_db_url, vectorizer_id, 2, extra_params=extra_params
+        )
+
+    assert not result.exception
+    assert result.exit_code == 0
+
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute("SELECT count(*) as count FROM blog_embedding_store;")
+        assert cur.fetchone()["count"] == 4  # type: ignore
+        cur.execute("SELECT count(*) as count FROM ai._vectorizer_q_1;")
+        assert cur.fetchone()["count"] == 0  # type: ignore
+        cur.execute("SELECT success_count FROM ai.vectorizer_worker_progress;")
+        assert cur.fetchone()["success_count"] == 4  # type: ignore
+
+
+def test_process_vectorizer_reuses_unchanged_chunks(
+    cli_db: tuple[TestDatabase, Connection],
+    cli_db_url: str,
+    vcr_: Any,
+):
+    """Test that requeued items with unchanged chunks are not embedded again"""
+    _, conn = cli_db
+    vectorizer_id = configure_openai_vectorizer(cli_db[1])
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE ai.vectorizer
+            SET config = jsonb_set(
+                config, '{processing,reuse_embeddings}', 'true'::jsonb
+            )
+            WHERE id = %s
+        """,
+            (vectorizer_id,),
+        )
+
+    cassette = (
+        "openai-character_text_splitter-chunk_value-"
+        "items=1-batch_size=1-custom_base_url=False.yaml"
+    )
+    # The cassette only plays its single response once, so the second run
+    # fails if it calls the embedding provider again.
+    with vcr_.use_cassette(cassette):
+        result = run_vectorizer_worker(cli_db_url, vectorizer_id)
+        assert result.exit_code == 0
+
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute("SELECT embedding_uuid, embedding FROM blog_embedding_store")
+            before = cur.fetchall()
+            assert len(before) == 1
+            cur.execute("UPDATE blog SET id2 = id2 + 1")
+            cur.execute("SELECT count(*) as count FROM ai._vectorizer_q_1;")
+            assert cur.fetchone()["count"] == 1  # type: ignore
+
+        result = run_vectorizer_worker(cli_db_url, vectorizer_id)
+        assert not result.exception
+        assert result.exit_code == 0
+
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute("SELECT embedding_uuid, embedding FROM blog_embedding_store")
+        after = cur.fetchall()
+        assert len(after) == 1
+        # The row was rewritten with the embedding it had before
+        assert after[0]["embedding_uuid"] != before[0]["embedding_uuid"]
+        assert after[0]["embedding"] == before[0]["embedding"]
+        cur.execute("SELECT count(*) as count FROM ai.vectorizer_errors")
+        assert cur.fetchone()["count"] == 0  # type: ignore
+
+
 @pytest.mark.postgres_params(load_openai_key=False)
 def test_vectorizer_without_secrets_fails(
     cli_db: tuple[TestDatabase, Connection],
@@ -1,11 +1,28 @@
+import asyncio
+import base64
+import json
 import os
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
 
+import numpy as np
 import pytest
 from dotenv import load_dotenv
+from typing_extensions import override
 
 from pgai.vectorizer.embedders import OpenAI
 from pgai.vectorizer.embeddings import (
+    ClientCache,
+    ConcurrencyController,
+    Embedder,
+    EmbeddingResponse,
+    Embeddings,
+    RateLimiter,
+    Usage,
     batch_indices,
+    cached_token_counter,
+    concurrency_controller,
 )
 
 token_documents = [5, 1, 1, 1, 1, 1, 1, 1, 1]
@@ -80,6 +97,156 @@ def test_batch_indices(
         assert str(e) == error
 
 
+class SlowEmbedder(Embedder):
+    """Embeds "n" as [n], answering earlier requests more slowly."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_seen_in_flight = 0
+
+    @override
+    async def embed(
+        self, documents: list[str], rate_limiter: RateLimiter | None = None
+    ) -> AsyncGenerator[Embeddings, None]:
+        async for embeddings in self.batch_chunks_and_embed(
+            documents, [1] * len(documents), rate_limiter
+        ):
+            yield embeddings
+
+    @override
+    def _max_chunks_per_batch(self) -> int:
+        return 2
+
+    @override
+    async def call_embed_api(self, documents: list[str]) -> EmbeddingResponse:
+        self.in_flight += 1
+        self.max_seen_in_flight = max(self.max_seen_in_flight, self.in_flight)
+        await asyncio.sleep(0.05 / (int(documents[0]) + 1))
+        self.in_flight -= 1
+        return EmbeddingResponse(
+            embeddings=[[float(document)] for document in documents],
+            usage=Usage(prompt_tokens=0, total_tokens=0),
+        )
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 3])
+async def test_batch_chunks_and_embed_yields_in_order(
+    monkeypatch: pytest.MonkeyPatch, max_in_flight: int
+):
+    monkeypatch.setenv("PGAI_VECTORIZER_EMBEDDING_MAX_IN_FLIGHT", str(max_in_flight))
+    embedder = SlowEmbedder()
+    documents = [str(i) for i in range(9)]
+
+    responses = [response async for response in embedder.embed(documents)]
+
+    assert [len(response) for response in responses] == [2, 2, 2, 2, 1]
+    assert [e for response in responses for e in response] == [
+        [float(i)] for i in range(9)
+    ]
+    assert embedder.max_seen_in_flight == max_in_flight
+
+
+async def test_batch_chunks_and_embed_cancels_requests_when_closed(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv("PGAI_VECTORIZER_EMBEDDING_MAX_IN_FLIGHT", "3")
+    embedder = SlowEmbedder()
+    documents = [str(i) for i in range(9)]
+    responses = embedder.batch_chunks_and_embed(documents, [1] * len(documents))
+
+    await anext(responses)
+    await responses.aclose()
+
+    # the requests still in flight were cancelled and have finished
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+
+
+class SlotRecordingRateLimiter(RateLimiter):
+    """Records the requests in flight when capacity is reserved."""
+
+    def __init__(self, controller: ConcurrencyController):
+        self.controller = controller
+        self.in_flight: list[int] = []
+
+    @override
+    async def reserve(self, requests: int, tokens: float) -> None:
+        self.in_flight.append(self.controller.in_flight)
+
+
+async def test_rate_limits_are_reserved_after_taking_a_slot(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv("PGAI_VECTORIZER_EMBEDDING_MAX_CONCURRENCY", "1")
+    embedder = SlowEmbedder()
+    controller = embedder._concurrency_controller()  # type: ignore
+    assert controller is not None
+    rate_limiter = SlotRecordingRateLimiter(controller)
+
+    responses = [
+        response async for response in embedder.embed(["1", "2", "3"], rate_limiter)
+    ]
+
+    assert len(responses) == 2
+    # the capacity is reserved by the request holding the only slot
+    assert rate_limiter.in_flight == [1, 1]
+
+
+class FakeStreamingResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_bytes(self, chunk_size: int) -> AsyncIterator[bytes]:
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+
+class FakeEmbeddings:
+    """Answers like the embeddings endpoint, in the requested encoding."""
+
+    def __init__(self, vectors: list[list[float]]):
+        self.vectors = vectors
+        self.encoding_format: str | None = None
+
+    @asynccontextmanager
+    async def create(
+        self, encoding_format: str, **_kwargs: Any
+    ) -> AsyncIterator[FakeStreamingResponse]:
+        self.encoding_format = encoding_format
+        data = [
+            {
+                "object": "embedding",
+                "index": i,
+                "embedding": base64.b64encode(
+                    np.array(vector, dtype="<f4").tobytes()
+                ).decode()
+                if encoding_format == "base64"
+                else vector,
+            }
+            for i, vector in enumerate(self.vectors)
+        ]
+        body = {"data": data, "usage": {"prompt_tokens": 3, "total_tokens": 3}}
+        yield FakeStreamingResponse(json.dumps(body).encode())
+
+
+@pytest.mark.parametrize("encoding_format", ["float", "base64"])
+async def test_openai_call_embed_api_returns_float32_matrix(
+    monkeypatch: pytest.MonkeyPatch, encoding_format: str
+):
+    monkeypatch.setenv("PGAI_VECTORIZER_OPENAI_ENCODING_FORMAT", encoding_format)
+    vectors = [[0.5, -1.25, 2.0], [0.0, 3.5, -0.125], [1.0, 1.0, 1.0]]
+    fake = FakeEmbeddings(vectors)
+    monkeypatch.setattr(OpenAI, "_embedder", property(lambda _: fake))  # type: ignore
+    client = OpenAI(implementation="openai", model="text-embedding-3-small")
+
+    response = await client.call_embed_api(["a", "b", "c"])
+
+    assert fake.encoding_format == encoding_format
+    assert isinstance(response.embeddings, np.ndarray)
+    assert response.embeddings.dtype == np.float32
+    assert response.embeddings.tolist() == vectors
+    assert response.usage == Usage(prompt_tokens=3, total_tokens=3)
+
+
 @pytest.fixture
 def openai_client() -> OpenAI:
     """Create an OpenAI client."""
@@ -139,3 +306,272 @@ async def test_openai_embeddings_doesnt_break_300k_tokens_but_estimator(
     # which should mean 2 requests
     responses = [response async for response in result]
     assert len(responses) == 2
+
+
+async def test_openai_truncates_chunks_over_context_length(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    client = OpenAI(implementation="openai", model="text-embedding-3-small")
+    encoder = client._encoder  # type: ignore
+    assert encoder is not None
+    documents = ["apple " * 9000, "apple " * 1000, "a"]
+    encoded = [document.encode() for document in documents]
+
+    await client._truncate(documents, encoded)  # type: ignore
+
+    assert len(encoder.encode(documents[0])) == 8191
+    assert encoded[0] == documents[0].encode()
+    assert documents[1:] == ["apple " * 1000, "a"]
+
+    # the token count of a chunk that fits is cached, it's not tokenized again
+    def fail(*_args: Any, **_kwargs: Any):
+        raise AssertionError("tokenized again")
+
+    fitting = ["apple " * 1500]
+    await client._truncate(fitting, [fitting[0].encode()])  # type: ignore
+    monkeypatch.setattr(encoder, "encode_batch", fail)
+    await client._truncate(fitting, [fitting[0].encode()])  # type: ignore
+    assert fitting == ["apple " * 1500]
+
+
+def test_cached_token_counter():
+    loads: list[str] = []
+
+    def load_counter():
+        loads.append("counter")
+        return lambda texts: [len(text) for text in texts]
+
+    def load_none():
+        loads.append("none")
+        return None
+
+    counter = cached_token_counter("test", "model", load_counter)
+    assert counter is not None
+    assert counter(["ab", "c"]) == [2, 1]
+    assert cached_token_counter("test", "model", load_counter) is counter
+    assert cached_token_counter("test", "unknown", load_none) is None
+    assert cached_token_counter("test", "unknown", load_none) is None
+    assert loads == ["counter", "none"]
+
+
+def test_cached_token_counter_retries_failed_loads():
+    attempts: list[int] = []
+
+    def load():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise ConnectionError("tokenizer download failed")
+        return lambda texts: [len(text) for text in texts]
+
+    with pytest.raises(ConnectionError):
+        cached_token_counter("test", "flaky", load)
+    assert cached_token_counter("test", "flaky", load) is not None
+    assert cached_token_counter("test", "flaky", load) is not None
+    assert attempts == [0, 1]
+
+
+def test_voyage_token_counter_without_tokenizer(monkeypatch: pytest.MonkeyPatch):
+    voyageai = pytest.importorskip("voyageai")
+    from huggingface_hub.errors import RepositoryNotFoundError
+
+    from pgai.vectorizer.embedders.voyageai import voyage_token_counter
+
+    attempts: list[str] = []
+
+    def tokenizer(_self: Any, model: str) -> Any:
+        attempts.append(model)
+        if model == "voyage-flaky" and attempts.count(model) == 1:
+            raise ConnectionError("tokenizer download failed")
+        if model == "voyage-flaky":
+            return object()
+        raise RepositoryNotFoundError("no tokenizer")
+
+    monkeypatch.setattr(voyageai.Client, "tokenizer", tokenizer)
+
+    # a model without a published tokenizer is remembered as such
+    assert voyage_token_counter("voyage-missing", "key") is None
+    assert voyage_token_counter("voyage-missing", "key") is None
+    # transient errors are raised, and tried again
+    with pytest.raises(ConnectionError):
+        voyage_token_counter("voyage-flaky", "key")
+    assert voyage_token_counter("voyage-flaky", "key") is not None
+    assert attempts == ["voyage-missing", "voyage-flaky", "voyage-flaky"]
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+async def test_concurrency_controller_aimd():
+    controller = ConcurrencyController(max_limit=8)
+    assert controller.limit == 1
+
+    # grows by one per healthy request until the first overload
+    for _ in range(3):
+        controller.observe(duration=1.0, chunk_count=10)
+    assert controller.limit == 4
+
+    # halves once per round of requests on a rate limit
+    with pytest.raises(RateLimitError):
+        async with controller.request(chunk_count=10):
+            raise RateLimitError()
+    assert controller.limit == 2
+    with pytest.raises(RateLimitError):
+        async with controller.request(chunk_count=10):
+            raise RateLimitError()
+    assert controller.limit == 2
+    assert controller.in_flight == 0
+
+    # then grows by about one per round
+    for _ in range(2):
+        controller.observe(duration=1.0, chunk_count=10)
+    assert int(controller.limit) == 2
+    controller.observe(duration=1.0, chunk_count=10)
+    assert int(controller.limit) == 3
+
+    # other errors don't change the limit
+    with pytest.raises(ValueError):
+        async with controller.request(chunk_count=10):
+            raise ValueError()
+    assert int(controller.limit) == 3
+
+
+class OverloadedEmbedder(SlowEmbedder):
+    """Rejects the first request as rate limited."""
+
+    _overload_retries = 3
+
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    @override
+    async def call_embed_api(self, documents: list[str]) -> EmbeddingResponse:
+        self.attempts += 1
+        if self.attempts == 1:
+            raise RateLimitError()
+        return await super().call_embed_api(documents)
+
+
+async def test_overloaded_requests_are_retried_through_the_controller(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv("PGAI_VECTORIZER_EMBEDDING_MAX_CONCURRENCY", "8")
+    monkeypatch.setattr("pgai.vectorizer.embeddings.OVERLOAD_RETRY_SECONDS", 0)
+    embedder = OverloadedEmbedder()
+    controller = embedder._concurrency_controller()  # type: ignore
+    assert controller is not None
+    controller.limit = 4
+
+    responses = [response async for response in embedder.embed(["1", "2"])]
+
+    assert responses == [[[1.0], [2.0]]]
+    assert embedder.attempts == 2
+    assert int(controller.limit) == 2
+
+
+@pytest.mark.parametrize("max_concurrency,max_retries", [("", 3), ("8", 0)])
+async def test_openai_client_retries_without_adaptive_concurrency(
+    monkeypatch: pytest.MonkeyPatch, max_concurrency: str, max_retries: int
+):
+    import openai
+
+    monkeypatch.setenv("PGAI_VECTORIZER_EMBEDDING_MAX_CONCURRENCY", max_concurrency)
+    clients: list[dict[str, Any]] = []
+
+    class RecordingAsyncOpenAI(openai.AsyncOpenAI):
+        def __init__(self, **kwargs: Any):
+            clients.append(kwargs)
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(openai, "AsyncOpenAI", RecordingAsyncOpenAI)
+    client = OpenAI(
+        implementation="openai",
+        model="text-embedding-3-small",
+        api_key_name="OPENAI_API_KEY",
+    )
+    client.set_api_key({"OPENAI_API_KEY": f"key-{max_concurrency}"})
+
+    assert client._embedder is not None  # type: ignore
+    assert [kwargs["max_retries"] for kwargs in clients] == [max_retries]
+
+
+def test_concurrency_controller_latency_spike():
+    controller = ConcurrencyController(max_limit=8)
+    for _ in range(10):
+        controller.observe(duration=1.0, chunk_count=10)
+    assert controller.limit == 8
+
+    controller.observe(duration=10.0, chunk_count=10)
+    assert controller.limit == 4
+
+
+def test_concurrency_controller_per_event_loop(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("PGAI_VECTORIZER_EMBEDDING_MAX_CONCURRENCY", "8")
+
+    async def get_controllers():
+        return (
+            concurrency_controller("openai", "model"),
+            concurrency_controller("openai", "model"),
+        )
+
+    first, same = asyncio.run(get_controllers())
+    other, _ = asyncio.run(get_controllers())
+    assert first is same
+    assert first is not other
+
+
+async def test_concurrency_controller_holds_requests_back():
+    controller = ConcurrencyController(max_limit=8)
+    in_flight: list[int] = []
+
+    async def send():
+        async with controller.request(chunk_count=1):
+            in_flight.append(controller.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(send() for _ in range(5)))
+    # the second request waits for the first, then the limit grows
+    assert in_flight[:2] == [1, 1]
+    assert max(in_flight) > 1
+
+
+async def test_client_cache_reuses_clients_until_idle():
+    cache = ClientCache(idle_timeout=60)
+    closed: list[object] = []
+
+    async def close(client: object):
+        closed.append(client)
+
+    client = cache.get(("openai", None), object, close)
+    assert cache.get(("openai", None), object, close) is client
+    assert cache.get(("openai", "http://localhost"), object, close) is not client
+
+    cache.idle_timeout = 0
+    await asyncio.sleep(0.01)
+    assert cache.get(("openai", None), object, close) is not client
+    await asyncio.sleep(0)
+    assert client in closed
+
+
+async def test_client_cache_sets_up_once():
+    cache = ClientCache(idle_timeout=60)
+    calls = 0
+
+    async def setup():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            raise ValueError()
+
+    # concurrent callers share the failed setup, which the next caller retries
+    results = await asyncio.gather(
+        cache.setup("ollama", setup),
+        cache.setup("ollama", setup),
+        return_exceptions=True,
+    )
+    assert [type(r) for r in results] == [ValueError, ValueError]
+    await cache.setup("ollama", setup)
+    await cache.setup("ollama", setup)
+    assert calls == 2
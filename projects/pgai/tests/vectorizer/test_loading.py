@@ -0,0 +1,113 @@
+import datetime
+import os
+import time
+from io import BytesIO
+from typing import Any
+
+import pytest
+from typing_extensions import override
+
+from pgai.vectorizer import loading
+from pgai.vectorizer.loading import (
+    LoadedDocument,
+    UriLoading,
+    _Clients,  # type: ignore
+    spool,
+)
+
+
+@pytest.fixture(autouse=True)
+def clients(monkeypatch: pytest.MonkeyPatch) -> _Clients:
+    # The download threads are sized on first use, so each test gets its own
+    clients = _Clients()
+    monkeypatch.setattr(loading, "_clients", clients)
+    return clients
+
+
+class SlowUriLoading(UriLoading):
+    """Loads the rows that don't fail after a delay that decreases with the
+    row number, so that later rows finish loading first."""
+
+    @override
+    def load(self, row: dict[str, str]) -> LoadedDocument:
+        if row["uri"] == "fail":
+            raise ValueError("loading failed")
+        time.sleep(0.01 * (10 - len(row["uri"])))
+        return LoadedDocument(content=BytesIO(b""), file_path=row["uri"])
+
+
+@pytest.mark.parametrize("max_in_flight", ["1", "4"])
+def test_load_many_yields_in_order(monkeypatch: pytest.MonkeyPatch, max_in_flight: str):
+    monkeypatch.setenv("PGAI_VECTORIZER_LOADING_MAX_IN_FLIGHT", max_in_flight)
+    loading = SlowUriLoading(implementation="uri", column_name="uri")
+    rows = [{"uri": "x" * i} for i in range(1, 6)]
+    rows.insert(2, {"uri": "fail"})
+
+    loaded = list(loading.load_many(rows))
+
+    assert [
+        document.file_path
+        for document in loaded
+        if isinstance(document, LoadedDocument)
+    ] == [row["uri"] for row in rows if row["uri"] != "fail"]
+    assert isinstance(loaded[2], ValueError)
+
+
+def test_load_many_closes_documents_it_did_not_yield(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv("PGAI_VECTORIZER_LOADING_MAX_IN_FLIGHT", "4")
+    closed: list[str] = []
+    monkeypatch.setattr(
+        LoadedDocument, "close", lambda document: closed.append(document.file_path)
+    )
+    loading = SlowUriLoading(implementation="uri", column_name="uri")
+    rows = [{"uri": "x" * i} for i in range(1, 6)]
+
+    documents = loading.load_many(rows)
+    next(documents)
+    documents.close()
+
+    # the documents loading ahead are closed once they are loaded
+    deadline = time.monotonic() + 5
+    while len(closed) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(closed) == ["xx", "xxx", "xxxx"]
+
+
+def test_s3_client_is_reused_until_credentials_expire(
+    monkeypatch: pytest.MonkeyPatch, clients: _Clients
+):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expirations = [now + datetime.timedelta(hours=1), now - datetime.timedelta(1)]
+    assumed: list[str] = []
+
+    def assume_role(aws_role_arn: str) -> tuple[Any, datetime.datetime]:
+        assumed.append(aws_role_arn)
+        return object(), expirations.pop()
+
+    monkeypatch.setattr(clients, "_assume_role", assume_role)
+
+    # the first credentials are already expired
+    expired = clients.s3_client("arn:role")
+    client = clients.s3_client("arn:role")
+    assert client is not expired
+    assert clients.s3_client("arn:role") is client
+    assert assumed == ["arn:role", "arn:role"]
+
+
+def test_spool_moves_large_documents_to_disk(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("PGAI_VECTORIZER_LOADING_SPOOL_MAX_SIZE", "1024")
+
+    content, path = spool(BytesIO(b"small"))
+    assert path is None
+    assert content.read() == b"small"
+
+    data = os.urandom(4096)
+    content, path = spool(BytesIO(data), ".pdf")
+    assert path is not None and path.endswith(".pdf")
+    assert content.read() == data
+    with open(path, "rb") as f:
+        assert f.read() == data
+    LoadedDocument(content=content, spool_path=path).close()
+    assert not os.path.exists(path)
@@ -1,17 +1,36 @@
 import asyncio
+import datetime
+from collections.abc import AsyncIterator
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import Any
 
 import psycopg
 import pytest
 from psycopg.rows import namedtuple_row
 from psycopg.sql import SQL, Identifier
 from testcontainers.postgres import PostgresContainer  # type: ignore
+from typing_extensions import override
 
 import pgai
 from pgai.vectorizer import Vectorizer, Worker
+from pgai.vectorizer.chunking import LangChainCharacterTextSplitter
+from pgai.vectorizer.embedders import OpenAI
 from pgai.vectorizer.features import Features
+from pgai.vectorizer.formatting import ChunkValue
+from pgai.vectorizer.loading import ColumnLoading
+from pgai.vectorizer.metrics import Counter, Histogram, serve_metrics
+from pgai.vectorizer.parsing import ParsingAuto
+from pgai.vectorizer.vectorizer import (
+    BatchSizer,
+    DocumentPreparer,
+    EmbeddingCache,
+    PreparingPool,
+)
+from pgai.vectorizer.worker import VectorizerScheduler
 from pgai.vectorizer.worker_tracking import WorkerTracking
 
 from .conftest import create_connection_url
+from .test_embeddings import FakeEmbeddings, FakeStreamingResponse
 
 
 def create_database(dbname: str, postgres_container: PostgresContainer) -> None:
@@ -98,19 +117,30 @@ async def _vectorizer_test_after_install(
         worker = Worker(db_url)
 
         # test cli.get_vectorizer_ids
-        assert len(worker._get_vectorizer_ids()) == 1  # type: ignore
-        assert len(worker._get_vectorizer_ids([42, 19])) == 0  # type: ignore
-        assert len(worker._get_vectorizer_ids([vectorizer_id, 19])) == 1  # type: ignore
-        assert len(worker._get_vectorizer_ids([vectorizer_id])) == 1  # type: ignore
+        assert len(await worker._get_vectorizer_ids()) == 1  # type: ignore
+        assert len(await worker._get_vectorizer_ids([42, 19])) == 0  # type: ignore
+        assert len(await worker._get_vectorizer_ids([vectorizer_id, 19])) == 1  # type: ignore
+        assert len(await worker._get_vectorizer_ids([vectorizer_id])) == 1  # type: ignore
 
         # test cli.get_vectorizer
         features = Features.for_testing_latest_version()
-        vectorizer_actual: Vectorizer = worker._get_vectorizer(  # type: ignore
+        vectorizer_actual: Vectorizer = await worker._get_vectorizer(  # type: ignore
             vectorizer_id, features
         )
         assert vectorizer_actual is not None
         assert vectorizer_expected.source_table == vectorizer_actual.source_table  # type: ignore
 
+        # the parsed vectorizer is kept until its row changes
+        await worker._get_vectorizer_ids()  # type: ignore
+        cached = await worker._get_vectorizer(vectorizer_id, features)  # type: ignore
+        assert cached is vectorizer_actual
+        cur.execute(
+            "update ai.vectorizer set config = config where id = %s", (vectorizer_id,)
+        )
+        await worker._get_vectorizer_ids()  # type: ignore
+        vectorizer_actual = await worker._get_vectorizer(vectorizer_id, features)  # type: ignore
+        assert vectorizer_actual is not cached
+
         # run the vectorizer
         worker_tracking = WorkerTracking(db_url, 500, features, "0.0.1")
 
@@ -220,7 +250,7 @@ async def test_vectorizer_weird_pk(postgres_container: PostgresContainer):
         # test worker._get_vectorizer
         worker = Worker(db_url)
         features = Features.for_testing_latest_version()
-        vectorizer_actual: Vectorizer = worker._get_vectorizer(  # type: ignore
+        vectorizer_actual: Vectorizer = await worker._get_vectorizer(  # type: ignore
             vectorizer_id, features
         )
         assert vectorizer_actual is not None
@@ -263,6 +293,346 @@ async def test_vectorizer_weird_pk(postgres_container: PostgresContainer):
         assert actual == 7
 
 
+class NumberedNoteEmbeddings(FakeEmbeddings):
+    """Embeds the note "note <n>" as [n, 0, 0]."""
+
+    def __init__(self):
+        super().__init__([])
+
+    @override
+    def create(
+        self, input: list[str], **kwargs: Any
+    ) -> AbstractAsyncContextManager[FakeStreamingResponse]:
+        self.vectors = [[float(note.split()[-1]), 0.0, 0.0] for note in input]
+        return super().create(**kwargs)
+
+
+def _create_weird_table(cur: psycopg.Cursor[Any], document_column: str) -> None:
+    # a multi-column primary key with "interesting" data types, and 7 rows
+    # whose document ends with their number
+    cur.execute(f"""
+            create table weird
+            ( a text[] not null
+            , b varchar(3) not null
+            , c timestamp with time zone not null
+            , d tstzrange not null
+            , n int not null
+            , {document_column} text not null
+            -- use a different ordering for pk to ensure we handle it
+            , primary key (a, c, b, d)
+            )
+        """)
+    cur.execute(f"""
+            insert into weird (a, b, c, d, n, {document_column})
+            select
+              array['larry', 'moe', 'curly']
+            , 'xyz'
+            , '2025-01-06'::timestamptz + n * interval '1d'
+            , tstzrange('2025-01-06'::timestamptz, '2025-01-06'::timestamptz + n * interval '1d', '[)')
+            , n
+            , '/nonexistent/note ' || n
+            from generate_series(1, 7) n
+        """)  # noqa
+
+
+@pytest.mark.asyncio
+async def test_vectorizer_weird_pk_column_destination(
+    postgres_container: PostgresContainer, monkeypatch: pytest.MonkeyPatch
+):
+    # the embeddings of a whole batch are written to the source table with a
+    # single statement, which has to match them to the rows on every column
+    # of the primary key
+    db = "weird_pk_column"
+    create_database(db, postgres_container)
+    db_url = create_connection_url(postgres_container, dbname=db)
+    pgai.install(db_url)
+    monkeypatch.setattr(
+        OpenAI,
+        "_embedder",
+        property(lambda _: NumberedNoteEmbeddings()),  # type: ignore
+    )
+    with (
+        psycopg.connect(db_url, autocommit=True, row_factory=namedtuple_row) as con,
+        con.cursor() as cur,
+    ):
+        _create_weird_table(cur, "note")
+        cur.execute("""
+                select ai.create_vectorizer
+                ( 'weird'::regclass
+                , loading=>ai.loading_column('note')
+                , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+                , destination=>ai.destination_column('embedding')
+                , chunking=>ai.chunking_none()
+                , processing=>ai.processing_default(batch_size=>7)
+                , grant_to=>null
+                , enqueue_existing=>true
+                )
+            """)
+        vectorizer_id = cur.fetchone()[0]  # type: ignore
+
+        worker = Worker(db_url)
+        features = Features.for_testing_latest_version()
+        vectorizer: Vectorizer = await worker._get_vectorizer(  # type: ignore
+            vectorizer_id, features
+        )
+        worker_tracking = WorkerTracking(db_url, 500, features, "0.0.1")
+        await vectorizer.run(db_url, features, worker_tracking, 1)
+
+        cur.execute("select ai.vectorizer_queue_pending(%s)", (vectorizer_id,))
+        assert cur.fetchone()[0] == 0  # type: ignore
+
+        # every row got the embedding of its own note
+        cur.execute("select n, embedding::real[] as embedding from weird order by n")
+        rows = cur.fetchall()
+        assert [(row.n, row.embedding) for row in rows] == [
+            (n, [float(n), 0.0, 0.0]) for n in range(1, 8)
+        ]
+
+
+@pytest.mark.asyncio
+async def test_vectorizer_weird_pk_loading_retries(
+    postgres_container: PostgresContainer,
+):
+    # the items that fail to load are requeued, and moved to the failed queue
+    # once they are out of retries, all at once and keeping their primary key
+    db = "weird_pk_retries"
+    create_database(db, postgres_container)
+    db_url = create_connection_url(postgres_container, dbname=db)
+    pgai.install(db_url)
+    with (
+        psycopg.connect(db_url, autocommit=True, row_factory=namedtuple_row) as con,
+        con.cursor() as cur,
+    ):
+        _create_weird_table(cur, "uri")
+        cur.execute("""
+                select ai.create_vectorizer
+                ( 'weird'::regclass
+                , loading=>ai.loading_uri('uri')
+                , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+                , chunking=>ai.chunking_none()
+                , grant_to=>null
+                , enqueue_existing=>true
+                )
+            """)
+        vectorizer_id = cur.fetchone()[0]  # type: ignore
+
+        worker = Worker(db_url)
+        features = Features.for_testing_latest_version()
+        vectorizer: Vectorizer = await worker._get_vectorizer(  # type: ignore
+            vectorizer_id, features
+        )
+        queue_table = SQL("{}.{}").format(
+            Identifier(vectorizer.queue_schema), Identifier(vectorizer.queue_table)
+        )
+        queue_failed_table = SQL("{}.{}").format(
+            Identifier(vectorizer.queue_schema),
+            Identifier(vectorizer.queue_failed_table),  # type: ignore
+        )
+        worker_tracking = WorkerTracking(db_url, 500, features, "0.0.1")
+
+        # the first failure requeues all the items for a retry
+        await vectorizer.run(db_url, features, worker_tracking, 1)
+        cur.execute(
+            SQL("""
+                select count(*) as items
+                , min(loading_retries) as min_retries
+                , max(loading_retries) as max_retries
+                , bool_and(loading_retry_after > now()) as later
+                from {queue_table} q
+                join weird w using (a, b, c, d)
+            """).format(queue_table=queue_table)
+        )
+        queued = cur.fetchone()
+        assert queued == (7, 1, 1, True)
+        cur.execute(
+            "select count(*) from ai.vectorizer_errors"
+            " where id = %s and details->>'is_retryable' = 'true'",
+            (vectorizer_id,),
+        )
+        assert cur.fetchone()[0] == 7  # type: ignore
+
+        # the last retry moves them to the failed queue
+        cur.execute(
+            SQL(
+                "update {queue_table}"
+                " set loading_retries = 6"
+                ", loading_retry_after = now() - interval '1 minute'"
+            ).format(queue_table=queue_table)
+        )
+        await vectorizer.run(db_url, features, worker_tracking, 1)
+        cur.execute(SQL("select count(*) from {}").format(queue_table))
+        assert cur.fetchone()[0] == 0  # type: ignore
+        cur.execute(
+            SQL("""
+                select count(*) as items
+                , bool_and(f.failure_step = 'loading') as loading
+                from {queue_failed_table} f
+                join weird w using (a, b, c, d)
+            """).format(queue_failed_table=queue_failed_table)
+        )
+        assert cur.fetchone() == (7, True)
+
+
+@pytest.mark.asyncio
+async def test_vectorizer_shard_queue_indexes_queue_table(
+    postgres_container: PostgresContainer, monkeypatch: pytest.MonkeyPatch
+):
+    # the queue table is only indexed on the shard key once a worker claims
+    # work from it in shards
+    db = "shard_queue_index"
+    create_database(db, postgres_container)
+    db_url = create_connection_url(postgres_container, dbname=db)
+    pgai.install(db_url)
+    monkeypatch.setattr(
+        OpenAI,
+        "_embedder",
+        property(lambda _: NumberedNoteEmbeddings()),  # type: ignore
+    )
+    with (
+        psycopg.connect(db_url, autocommit=True, row_factory=namedtuple_row) as con,
+        con.cursor() as cur,
+    ):
+        cur.execute(
+            "create table blog (id int primary key, note text not null"
+            ", embedding vector(3))"
+        )
+        cur.execute(
+            "insert into blog (id, note) select n, 'note ' || n"
+            " from generate_series(1, 3) n"
+        )
+        cur.execute("""
+                select ai.create_vectorizer
+                ( 'blog'::regclass
+                , loading=>ai.loading_column('note')
+                , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+                , destination=>ai.destination_column('embedding')
+                , chunking=>ai.chunking_none()
+                , grant_to=>null
+                , enqueue_existing=>true
+                )
+            """)
+        vectorizer_id = cur.fetchone()[0]  # type: ignore
+
+        worker = Worker(db_url)
+        features = Features.for_testing_latest_version()
+        vectorizer: Vectorizer = await worker._get_vectorizer(  # type: ignore
+            vectorizer_id, features
+        )
+
+        def shard_indexes() -> list[str]:
+            cur.execute(
+                "select pg_get_indexdef(indexrelid) as indexdef from pg_index"
+                " where indrelid = %s::regclass",
+                (f"{vectorizer.queue_schema}.{vectorizer.queue_table}",),
+            )
+            return [
+                row.indexdef for row in cur.fetchall() if "hash_record" in row.indexdef
+            ]
+
+        assert shard_indexes() == []
+        worker_tracking = WorkerTracking(db_url, 500, features, "0.0.1")
+        await vectorizer.run(db_url, features, worker_tracking, 2, shard_queue=True)
+        assert len(shard_indexes()) == 1
+
+        cur.execute("select count(*) from blog where embedding is not null")
+        assert cur.fetchone()[0] == 3  # type: ignore
+
+
+class SlowFailingEmbeddings(FakeEmbeddings):
+    """Counts the expired leases of the queue after a slow request, then
+    fails it."""
+
+    def __init__(self, db_url: str, queue_table: Identifier):
+        super().__init__([])
+        self.db_url = db_url
+        self.queue_table = queue_table
+        self.expired_leases: int | None = None
+
+    @override
+    @asynccontextmanager
+    async def create(
+        self, encoding_format: str, **_kwargs: Any
+    ) -> AsyncIterator[FakeStreamingResponse]:
+        await asyncio.sleep(2)
+        async with await psycopg.AsyncConnection.connect(self.db_url) as conn:
+            cursor = await conn.execute(
+                SQL("select count(*) from {} where lease_expires_at < now()").format(
+                    self.queue_table
+                )
+            )
+            self.expired_leases = (await cursor.fetchone())[0]  # type: ignore
+        raise RuntimeError("embedding failed")
+        yield  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_pipelined_leases_are_extended_and_released(
+    postgres_container: PostgresContainer, monkeypatch: pytest.MonkeyPatch
+):
+    # the leases of the batches in flight don't expire while they are embedded
+    # or wait for the embed stage, and are given up when embedding fails
+    db = "pipelined_leases"
+    create_database(db, postgres_container)
+    db_url = create_connection_url(postgres_container, dbname=db)
+    pgai.install(db_url)
+    with (
+        psycopg.connect(db_url, autocommit=True, row_factory=namedtuple_row) as con,
+        con.cursor() as cur,
+    ):
+        cur.execute(
+            "create table blog (id int primary key, note text not null"
+            ", embedding vector(3))"
+        )
+        cur.execute(
+            "insert into blog (id, note) select n, 'note ' || n"
+            " from generate_series(1, 3) n"
+        )
+        cur.execute("""
+                select ai.create_vectorizer
+                ( 'blog'::regclass
+                , loading=>ai.loading_column('note')
+                , embedding=>ai.embedding_openai('text-embedding-3-small', 3)
+                , destination=>ai.destination_column('embedding')
+                , chunking=>ai.chunking_none()
+                , processing=>ai.processing_default(batch_size=>1)
+                , grant_to=>null
+                , enqueue_existing=>true
+                )
+            """)
+        vectorizer_id = cur.fetchone()[0]  # type: ignore
+        cur.execute(
+            "update ai.vectorizer set config = jsonb_set"
+            "(config, '{processing,lease_seconds}', '1'::jsonb) where id = %s",
+            (vectorizer_id,),
+        )
+
+        worker = Worker(db_url)
+        features = Features.for_testing_latest_version()
+        vectorizer: Vectorizer = await worker._get_vectorizer(  # type: ignore
+            vectorizer_id, features
+        )
+        queue_table = Identifier(vectorizer.queue_schema, vectorizer.queue_table)
+        embeddings = SlowFailingEmbeddings(db_url, queue_table)
+        monkeypatch.setattr(
+            OpenAI,
+            "_embedder",
+            property(lambda _: embeddings),  # type: ignore
+        )
+        worker_tracking = WorkerTracking(db_url, 500, features, "0.0.1")
+        with pytest.raises(RuntimeError, match="embedding failed"):
+            await vectorizer.run(db_url, features, worker_tracking, 1, pipeline_depth=2)
+
+        assert embeddings.expired_leases == 0
+        cur.execute(
+            SQL("select count(*) from {} where lease_id is not null").format(
+                queue_table
+            )
+        )
+        assert cur.fetchone()[0] == 0  # type: ignore
+        cur.execute(SQL("select count(*) from {}").format(queue_table))
+        assert cur.fetchone()[0] == 3  # type: ignore
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("async_install", [True, False])
 async def test_vectorizer_install_twice(
@@ -468,3 +838,162 @@ async def test_vectorizer_run_with_shutdown(
     await worker.request_graceful_shutdown()
     result = await asyncio.wait_for(task, timeout=300)
     assert result is None
+
+
+def test_vectorizer_scheduler_order():
+    scheduler = VectorizerScheduler(time_slice=10)
+    # the small queue goes first, vectorizers without work are left out
+    assert scheduler.order({1: 10001, 2: 3, 3: 0}, now=0) == [2, 1]
+
+    # a backfill that has waited long enough goes ahead of a new small queue
+    scheduler = VectorizerScheduler(time_slice=10)
+    assert scheduler.order({1: 2**63 - 1, 2: 0}, now=0) == [1]
+    assert scheduler.order({1: 2**63 - 1, 2: 3}, now=45) == [1, 2]
+
+    # and goes back in line once it had its turn
+    scheduler.started(1)
+    scheduler.stopped(1, now=55)
+    assert scheduler.order({1: 2**63 - 1, 2: 3}, now=60) == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_worker_wakes_up_on_notification():
+    worker = Worker("postgres://unused", poll_interval=datetime.timedelta(hours=1))
+    worker._queues = {"ai._vectorizer_q_1": 1}  # type: ignore
+
+    # notifications for queues of other vectorizers are ignored
+    worker._on_notification("ai_vectorizer_queue", "ai._vectorizer_q_2")  # type: ignore
+    worker._on_notification("ai_vectorizer_queue", "ai._vectorizer_q_1")  # type: ignore
+    woken = await asyncio.wait_for(worker._wait_for_work(), timeout=1)  # type: ignore
+    assert woken == {1}
+    assert worker._should_continue(1)  # type: ignore
+
+    # a changed vectorizer stops and is run again
+    worker._on_notification("ai_vectorizer_config", "3")  # type: ignore
+    assert not worker._should_continue(3)  # type: ignore
+    woken = await asyncio.wait_for(worker._wait_for_work(), timeout=1)  # type: ignore
+    assert woken == {3}
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_full_rounds_while_notified(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # the worker's clock advances by 50ms per round
+    now = 0.0
+    monkeypatch.setattr(Worker, "_clock", staticmethod(lambda: now))
+    worker = Worker("postgres://unused", poll_interval=datetime.timedelta(seconds=1))
+    worker._queues = {"ai._vectorizer_q_1": 1, "ai._vectorizer_q_2": 2}  # type: ignore
+
+    # vectorizer 1 is notified more often than the poll interval, vectorizer 2
+    # has pending work but is never notified
+    runs = {1: 0, 2: 0}
+    for tick in range(50):
+        now = tick / 20
+        worker._on_notification("ai_vectorizer_queue", "ai._vectorizer_q_1")  # type: ignore
+        woken = await asyncio.wait_for(worker._wait_for_work(), timeout=2)  # type: ignore
+        for vectorizer_id in runs:
+            if woken is None or vectorizer_id in woken:
+                runs[vectorizer_id] += 1
+
+    # full rounds at 1s and 2s
+    assert runs == {1: 50, 2: 2}
+
+
+@pytest.mark.asyncio
+async def test_worker_ignores_invalid_notifications():
+    worker = Worker("postgres://unused")
+
+    worker._on_notification("ai_vectorizer_config", "not an id")  # type: ignore
+    worker._on_notification("ai_vectorizer_config", "3")  # type: ignore
+
+    assert worker._changed == {3}  # type: ignore
+    assert worker._woken == {3}  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_preparing_pool_keeps_item_order():
+    preparer = DocumentPreparer(
+        ColumnLoading(implementation="column", column_name="content"),
+        ParsingAuto(implementation="auto"),
+        LangChainCharacterTextSplitter(
+            implementation="character_text_splitter",
+            separator=" ",
+            chunk_size=10,
+            chunk_overlap=0,
+            is_separator_regex=False,
+        ),
+        ChunkValue(implementation="chunk_value"),
+        ["id"],
+        True,
+    )
+    items = [{"id": i, "content": f"post {i} " * i} for i in range(10)]
+    pool = PreparingPool(3)
+    try:
+        assert await pool.prepare(preparer, items) == preparer(items)
+    finally:
+        pool.shutdown()
+
+
+def test_batch_sizer():
+    sizer = BatchSizer(size=50, max_size=500, target_seconds=10)
+
+    # fast items: grows, at most doubling per batch, up to the maximum
+    assert sizer.observe(50, 1.0) == 100
+    assert sizer.observe(100, 2.0) == 200
+    assert sizer.observe(200, 4.0) == 400
+    assert sizer.observe(400, 8.0) == 500
+
+    # slow items: shrinks right away to fill the target time
+    assert sizer.observe(500, 100.0) == 90
+    # an empty batch doesn't change the size
+    assert sizer.observe(0, 1.0) == 90
+
+
+@pytest.mark.asyncio
+async def test_metrics():
+    counter = Counter("test_items", "Items.", ["vectorizer_id"])
+    counter.inc(1, amount=3)
+    counter.inc(1)
+    assert counter.render() == (
+        "# HELP test_items_total Items.\n"
+        "# TYPE test_items_total counter\n"
+        'test_items_total{vectorizer_id="1"} 4\n'
+    )
+    histogram = Histogram("test_seconds", "Seconds.", buckets=(1, 5))
+    histogram.observe(value=0.5)
+    histogram.observe(value=2)
+    histogram.observe(value=10)
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="1"} 1',
+        'test_seconds_bucket{le="5"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_count 3",
+        "test_seconds_sum 12.5",
+    ]
+
+    server = await serve_metrics(0, "127.0.0.1")
+    try:
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert response.startswith("HTTP/1.1 200 OK\r\n")
+    assert "# TYPE pgai_vectorizer_items_total counter" in response
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(max_size=2)
+    cache.put(("config", b"a"), [1.0])
+    cache.put(("config", b"b"), [2.0])
+    assert cache.get(("config", b"a")) == [1.0]
+    cache.put(("config", b"c"), [3.0])
+
+    assert cache.get(("config", b"b")) is None
+    assert cache.get(("config", b"a")) == [1.0]
+    assert cache.get(("config", b"c")) == [3.0]
+    assert cache.get(("other config", b"a")) is None